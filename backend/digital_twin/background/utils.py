@@ -26,7 +26,7 @@ from digital_twin.db.connectors.index_attempt import (
     mark_attempt_succeeded,
 )
 from digital_twin.db.engine import get_db_current_time, get_sqlalchemy_engine
-from digital_twin.db.indexing_pipeline import build_indexing_pipeline
+from digital_twin.db.indexing_pipeline import IndexingStats, build_pipelined_indexing_pipeline
 from digital_twin.db.model import Connector, IndexAttempt, IndexingStatus
 from digital_twin.db.user import get_qdrant_collection_by_user_id, get_typesense_collection_by_user_id
 from digital_twin.indexdb.qdrant.store import QdrantVectorDB
@@ -181,9 +181,11 @@ def run_indexing_jobs(
             db_credential.organization_id,
         )
 
-        org_indexing_pipeline = build_indexing_pipeline(
+        org_indexing_pipeline = build_pipelined_indexing_pipeline(
             vectordb=QdrantVectorDB(collection=org_qdrant_collection),
             keyword_index=TypesenseIndex(collection=org_typesense_collection),
+            # Polls re-fetch overlapping windows, don't re-embed what's already indexed
+            fingerprint_collection=org_qdrant_collection,
         )
 
         backend_update_connector_credential_pair(
@@ -208,7 +210,7 @@ def run_indexing_jobs(
             backend_disable_connector(db_connector.id, db_session)
             continue
 
-        net_doc_change = 0
+        indexing_stats = IndexingStats()
         try:
             if task == InputType.LOAD_STATE:
                 assert isinstance(runnable_connector, LoadConnector)
@@ -229,27 +231,27 @@ def run_indexing_jobs(
             else:
                 # Event types cannot be handled by a background type, leave these untouched
                 continue
-            document_count = 0
-            chunk_count = 0
-            for doc_batch in doc_batch_generator:
-                index_user_id = None if db_credential.public_doc else db_credential.user_id
-                new_docs, total_batch_chunks = org_indexing_pipeline(
-                    documents=doc_batch, user_id=index_user_id
-                )
-                net_doc_change += new_docs
-                chunk_count += total_batch_chunks
-                document_count += len(doc_batch)
+            # Connector fetching, chunking, embedding and index writes of consecutive
+            # batches overlap, so we don't sit idle while waiting on the connector
+            index_user_id = None if db_credential.public_doc else db_credential.user_id
+            org_indexing_pipeline(
+                doc_batches=doc_batch_generator,
+                user_id=index_user_id,
+                stats=indexing_stats,
+            )
 
             mark_attempt_succeeded(attempt, db_session)
             backend_update_connector_credential_pair(
                 connector_id=db_connector.id,
                 credential_id=db_credential.id,
                 attempt_status=IndexingStatus.SUCCESS,
-                net_docs=net_doc_change,
+                net_docs=indexing_stats.net_new_docs,
                 db_session=db_session,
             )
             logger.info(
-                f"Indexed or updated {document_count} total documents for a total of {chunk_count} chunks"
+                f"Indexed or updated {indexing_stats.documents} total documents "
+                f"for a total of {indexing_stats.chunks} chunks, "
+                f"skipped {indexing_stats.unchanged_documents} unchanged documents"
             )
             logger.info(f"Connector successfully finished, elapsed time: {time.time() - run_time} seconds")
         except Exception as e:
@@ -260,6 +262,6 @@ def run_indexing_jobs(
                 connector_id=db_connector.id,
                 credential_id=db_credential.id,
                 attempt_status=IndexingStatus.FAILED,
-                net_docs=net_doc_change,
+                net_docs=indexing_stats.net_new_docs,
                 db_session=db_session,
             )
@@ -46,6 +46,23 @@ QDRANT_DEFAULT_COLLECTION = os.environ.get("QDRANT_DEFAULT_COLLECTION", "testing
 # Host / Port are used for connecting to local Qdrant instance
 QDRANT_HOST = os.environ.get("QDRANT_HOST", "localhost")
 QDRANT_PORT = 6333
+# Vector compression of new collections: "none", "scalar" (int8, 4x smaller) or "product" (16x smaller).
+# Quantized vectors are kept in RAM and the original vectors on disk, only used to rescore the best candidates
+QDRANT_QUANTIZATION = os.environ.get("QDRANT_QUANTIZATION", "none")
+# Quantized searches fetch this many times more candidates, which are then rescored at full precision
+QDRANT_QUANTIZATION_OVERSAMPLING = float(os.environ.get("QDRANT_QUANTIZATION_OVERSAMPLING", 2.0))
+QDRANT_QUANTIZATION_RESCORE = os.environ.get("QDRANT_QUANTIZATION_RESCORE", "true").lower() != "false"
+# HNSW graph of new collections, Qdrant defaults. Higher values trade memory and indexing time for recall
+QDRANT_HNSW_M = int(os.environ.get("QDRANT_HNSW_M", 16))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.environ.get("QDRANT_HNSW_EF_CONSTRUCT", 100))
+# Payloads (chunk content and metadata) are read from disk for the returned hits only
+QDRANT_ON_DISK_PAYLOAD = os.environ.get("QDRANT_ON_DISK_PAYLOAD", "true").lower() != "false"
+# Only store the ids, ACLs and filtered fields in Qdrant points, the chunk contents are read from Typesense.
+# Cuts the memory per point at the cost of one more Typesense request per semantic search
+QDRANT_SLIM_PAYLOAD = os.environ.get("QDRANT_SLIM_PAYLOAD", "false").lower() == "true"
+# Connection pool of the async Qdrant and Typesense clients used for retrieval in the API process
+INDEX_ASYNC_CLIENT_MAX_CONNECTIONS = int(os.environ.get("INDEX_ASYNC_CLIENT_MAX_CONNECTIONS", 100))
+INDEX_ASYNC_CLIENT_TIMEOUT_SECONDS = 10
 
 # The first few sentences for each Section in a Chunk
 BLURB_LENGTH = 200
@@ -59,9 +76,29 @@ BATCH_SIZE_ENCODE_CHUNKS = 8
 CHUNK_OVERLAP = 5
 # Number of documents in a batch during indexing (further batching done by chunks before passing to bi-encoder)
 INDEX_BATCH_SIZE = 16
+# Number of document batches allowed to wait between two stages of the indexing pipeline
+# Higher values smooth out bursty connectors at the cost of holding more batches in memory
+INDEXING_PIPELINE_QUEUE_SIZE = 2
 
 NUM_RETURNED_HITS = 50
 NUM_RERANKED_RESULTS = 15
+# "cohere" for the Cohere rerank API or "local" to run LOCAL_RERANK_MODEL in-process on CPU
+RERANKER_BACKEND = os.environ.get("RERANKER_BACKEND", "cohere")
+LOCAL_RERANK_MODEL = os.environ.get("LOCAL_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Number of top retrieved chunks that are scored by the reranker, the rest keep their retrieval order
+NUM_RERANK_CANDIDATES = int(os.environ.get("NUM_RERANK_CANDIDATES", NUM_RERANKED_RESULTS))
+# Query / chunk pairs per cross-encoder inference batch, and batches scored in parallel
+LOCAL_RERANK_BATCH_SIZE = 16
+LOCAL_RERANK_WORKERS = int(os.environ.get("LOCAL_RERANK_WORKERS", 2))
+# Max number of (query, chunk) scores kept in memory by the local reranker
+LOCAL_RERANK_CACHE_SIZE = 10_000
+# Max number of hybrid retrieval results kept in memory, 0 disables the cache. Entries are dropped
+# as soon as either collection is re-indexed, the TTL only bounds how long an idle entry is kept
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", 1024))
+RETRIEVAL_CACHE_TTL_SECONDS = int(os.environ.get("RETRIEVAL_CACHE_TTL_SECONDS", 24 * 60 * 60))
+# Weights of the semantic and keyword rankings when fusing them for hybrid search
+SEMANTIC_RRF_WEIGHT = 0.3
+KEYWORD_RRF_WEIGHT = 0.7
 # Better to keep it loose, surfacing more results better than missing results
 SEARCH_DISTANCE_CUTOFF = (
     0.1  # Cosine similarity (currently), range of -1 to 1 with -1 being completely opposite
@@ -74,6 +111,35 @@ ENABLE_MINI_CHUNK = False
 # calculated as 128 tokens for 4 additional vectors for 512 chunk size above
 # Not rounded down to not lose any context in full chunk.
 MINI_CHUNK_SIZE = 512
+# Embeddings are cached by (embedding model, text hash) so identical texts are only embedded once
+# Set to "none" to disable the cache
+EMBEDDING_CACHE_TYPE = os.environ.get("EMBEDDING_CACHE_TYPE", "sqlite")
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "/home/embedding_cache/embeddings.sqlite3")
+# ~6KB per 1536 dim embedding, so the default is around 1.2GB on disk
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 200_000))
+# In-memory cache of query embeddings in front of the embedding cache, repeated queries skip the lookup
+# Set the size to 0 to disable it
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 2048))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = int(os.environ.get("QUERY_EMBEDDING_CACHE_TTL_SECONDS", 3600))
+# Embedding API requests are batched by token count and sent concurrently
+# Default rate limit is the OpenAI one for text-embedding-ada-002, shared by all requests of the process
+EMBEDDING_TOKENS_PER_MINUTE = int(os.environ.get("EMBEDDING_TOKENS_PER_MINUTE", 1_000_000))
+EMBEDDING_MAX_IN_FLIGHT_REQUESTS = int(os.environ.get("EMBEDDING_MAX_IN_FLIGHT_REQUESTS", 4))
+EMBEDDING_BATCH_MAX_TOKENS = 20_000
+EMBEDDING_BATCH_MAX_TEXTS = 256
+EMBEDDING_MAX_RETRIES = 6
+# "openai" for the OpenAI embedding API or "local" to run LOCAL_EMBEDDING_MODEL in-process on CPU
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "openai")
+LOCAL_EMBEDDING_MODEL = os.environ.get("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2")
+# Export the local model to ONNX Runtime and quantize the weights to int8, requires optimum[onnxruntime]
+LOCAL_EMBEDDING_USE_ONNX = os.environ.get("LOCAL_EMBEDDING_USE_ONNX", "true").lower() == "true"
+LOCAL_EMBEDDING_QUANTIZE = os.environ.get("LOCAL_EMBEDDING_QUANTIZE", "true").lower() == "true"
+LOCAL_EMBEDDING_MODEL_DIR = os.environ.get("LOCAL_EMBEDDING_MODEL_DIR", "/home/embedding_models")
+# Texts longer than this many tokens are truncated by the local model
+LOCAL_EMBEDDING_MAX_LENGTH = 512
+# Budget of tokens per inference batch, counting the padding, texts are grouped by length to minimize it
+LOCAL_EMBEDDING_BATCH_MAX_TOKENS = 16_384
+LOCAL_EMBEDDING_TOKENIZER_THREADS = int(os.environ.get("LOCAL_EMBEDDING_TOKENIZER_THREADS", 4))
 
 
 #########################
@@ -129,12 +195,23 @@ WEB_CONNECTOR_OAUTH_TOKEN_URL = os.environ.get("WEB_CONNECTOR_OAUTH_TOKEN_URL")
 #####################
 # QA Config         #
 #####################
-# OPENAI
+# OPENAI, the local embedding backend uses the dimension of its model
 DOC_EMBEDDING_DIM = 1536
 NUM_DOCS = 5
 MIN_SCRAPED_THRESHOLD = 10  # 80 letters
 MIN_CHAT_PAIRS_THRESHOLD = 5
 DEFAULT_QA_TIMEOUT = 10
+# Start rephrasing the answer as soon as the QA model has streamed it, while it still writes the quotes
+# and the relevancy check runs. Otherwise the rephrasing waits for both
+QA_SPECULATIVE_REPHRASE = os.environ.get("QA_SPECULATIVE_REPHRASE", "true").lower() == "true"
+# Max number of verified answers kept in memory, 0 disables the cache. An answer is served to a query
+# whose embedding is at least QA_ANSWER_CACHE_SIMILARITY_THRESHOLD similar (cosine) and that is answered
+# from the same chunks, until either collection is re-indexed
+QA_ANSWER_CACHE_SIZE = int(os.environ.get("QA_ANSWER_CACHE_SIZE", 1024))
+QA_ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("QA_ANSWER_CACHE_TTL_SECONDS", 24 * 60 * 60))
+QA_ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("QA_ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.95))
+# Max number of prompt sections (context documents, examples) whose token count is kept in memory
+PROMPT_TOKEN_CACHE_SIZE = int(os.environ.get("PROMPT_TOKEN_CACHE_SIZE", 4096))
 
 
 #####################
@@ -143,6 +220,8 @@ DEFAULT_QA_TIMEOUT = 10
 DEFAULT_MODEL_TYPE = os.environ.get("DEFAULT_LLM", "AZURE")
 MODEL_API_KEY = os.environ.get("MODEL_API_KEY", "")
 EMBEDDING_OPENAI_API_KEY = os.environ.get("EMBEDDING_OPENAI_API_KEY", "")
+# Keep-alive connections to the OpenAI / Azure API shared by the async LLM calls of the process
+LLM_ASYNC_CLIENT_MAX_CONNECTIONS = int(os.environ.get("LLM_ASYNC_CLIENT_MAX_CONNECTIONS", 100))
 
 #######################
 # EMAIL Sender Config #
@@ -4,6 +4,7 @@ DOCUMENT_ID = "document_id"
 CHUNK_ID = "chunk_id"
 BLURB = "blurb"
 CONTENT = "content"
+CONTENT_HASH = "content_hash"
 SOURCE_TYPE = "source_type"
 SOURCE_LINKS = "source_links"
 SOURCE_LINK = "link"
@@ -12,6 +13,9 @@ ALLOWED_USERS = "allowed_users"
 ALLOWED_GROUPS = "allowed_groups"
 SEMANTIC_IDENTIFIER = "semantic_identifier"
 SECTION_CONTINUATION = "section_continuation"
+# Number of tokens of the chunk content and the tiktoken encoding they were counted with
+NUM_TOKENS = "num_tokens"
+TOKENIZER = "tokenizer"
 HTML_SEPARATOR = "\n"
 PUBLIC_DOC_PAT = "PUBLIC"
 
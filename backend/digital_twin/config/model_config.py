@@ -7,6 +7,8 @@ class ModelInfo(BaseModel):
     name: str
     n_context_len: int
     platform: str = Field(default="openai")
+    # tiktoken encoding of the model, None when the model doesn't use a tiktoken tokenizer
+    tokenizer: str | None = Field(default="cl100k_base")
 
 
 class SupportedModelType(Enum):
@@ -15,7 +17,7 @@ class SupportedModelType(Enum):
     GPT4 = ModelInfo(name="gpt-4", n_context_len=8192)
     GPT3_5_16k = ModelInfo(name="gpt-3.5-turbo-16k", n_context_len=16384)
     GPT3_5_16k_FN = ModelInfo(name="gpt-3.5-turbo-16k-0613", n_context_len=16384)
-    ANTHROPIC = ModelInfo(name="claude", n_context_len=100000, platform="anthropic")
+    ANTHROPIC = ModelInfo(name="claude", n_context_len=100000, platform="anthropic", tokenizer=None)
     AZURE = ModelInfo(name="azure", n_context_len=4096, platform="azure")
 
     @property
@@ -29,3 +31,7 @@ class SupportedModelType(Enum):
     @property
     def platform(self):
         return self.value.platform
+
+    @property
+    def tokenizer(self):
+        return self.value.tokenizer
@@ -1,3 +1,5 @@
+import hashlib
+import json
 from dataclasses import dataclass
 from enum import Enum
 from typing import Any
@@ -32,6 +34,24 @@ def get_raw_document_text(document: Document) -> str:
     return "\n\n".join([section.text for section in document.sections])
 
 
+def get_document_fingerprint(document: Document) -> str:
+    """Hash of everything that ends up in the indices for a document, if it matches the hash
+    from the last indexing, the document doesn't need to be chunked, embedded or written again"""
+    hasher = hashlib.sha256()
+    hasher.update(document.source.value.encode())
+    hasher.update(b"\x00")
+    hasher.update((document.semantic_identifier or "").encode())
+    for section in document.sections:
+        # Separators so that moving text across section boundaries changes the hash
+        hasher.update(b"\x00")
+        hasher.update((section.link or "").encode())
+        hasher.update(b"\x00")
+        hasher.update(section.text.encode())
+    hasher.update(b"\x01")
+    hasher.update(json.dumps(document.metadata, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+
 class InputType(str, Enum):
     # e.g. loading a current full state or a save state, such as from a file
     LOAD_STATE = "load_state"
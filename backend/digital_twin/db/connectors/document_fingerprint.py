@@ -0,0 +1,72 @@
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from digital_twin.db.model import DocumentFingerprint
+from digital_twin.utils.logging import log_sqlalchemy_error, setup_logger
+
+logger = setup_logger()
+
+# Keeps the number of bound parameters per statement well under the Postgres limit
+_UPSERT_BATCH_SIZE = 1000
+
+
+@log_sqlalchemy_error(logger)
+def get_document_fingerprints(
+    document_ids: list[str],
+    collection: str,
+    indexed_by: str,
+    db_session: Session,
+) -> dict[str, str]:
+    """Returns a mapping of document id to the content hash stored on its last indexing"""
+    if not document_ids:
+        return {}
+    stmt = select(DocumentFingerprint.document_id, DocumentFingerprint.content_hash)
+    stmt = stmt.where(DocumentFingerprint.collection == collection)
+    stmt = stmt.where(DocumentFingerprint.indexed_by == indexed_by)
+    stmt = stmt.where(DocumentFingerprint.document_id.in_(document_ids))
+    return {row.document_id: row.content_hash for row in db_session.execute(stmt)}
+
+
+@log_sqlalchemy_error(logger)
+def upsert_document_fingerprints(
+    fingerprints: dict[str, str],
+    collection: str,
+    indexed_by: str,
+    db_session: Session,
+) -> None:
+    rows = [
+        {
+            "document_id": document_id,
+            "collection": collection,
+            "indexed_by": indexed_by,
+            "content_hash": content_hash,
+        }
+        for document_id, content_hash in fingerprints.items()
+    ]
+    if not rows:
+        return
+    for start in range(0, len(rows), _UPSERT_BATCH_SIZE):
+        # Postgres specific upsert
+        upsert_stmt = insert(DocumentFingerprint).values(rows[start : start + _UPSERT_BATCH_SIZE])
+        do_update_stmt = upsert_stmt.on_conflict_do_update(
+            index_elements=["document_id", "collection", "indexed_by"],
+            set_=dict(content_hash=upsert_stmt.excluded.content_hash, updated_at=func.now()),
+        )
+        db_session.execute(do_update_stmt)
+    db_session.commit()
+
+
+@log_sqlalchemy_error(logger)
+def delete_document_fingerprints(
+    collection: str,
+    db_session: Session,
+    document_ids: list[str] | None = None,
+) -> None:
+    """Forgets the fingerprints of a collection (or only of the given documents in it), so the next
+    indexing run re-indexes those documents even if they haven't changed"""
+    stmt = delete(DocumentFingerprint).where(DocumentFingerprint.collection == collection)
+    if document_ids is not None:
+        stmt = stmt.where(DocumentFingerprint.document_id.in_(document_ids))
+    db_session.execute(stmt)
+    db_session.commit()
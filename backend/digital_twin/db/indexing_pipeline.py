@@ -1,62 +1,292 @@
-from collections.abc import Callable
+import queue
+import threading
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
 from functools import partial
 from itertools import chain
-from typing import List, Optional, Protocol
+from typing import Any, Optional, Protocol
 from uuid import UUID
 
-from digital_twin.config.app_config import QDRANT_DEFAULT_COLLECTION, TYPESENSE_DEFAULT_COLLECTION
-from digital_twin.connectors.model import Document
+from digital_twin.config.app_config import (
+    INDEXING_PIPELINE_QUEUE_SIZE,
+    QDRANT_DEFAULT_COLLECTION,
+    TYPESENSE_DEFAULT_COLLECTION,
+)
+from digital_twin.config.constants import PUBLIC_DOC_PAT
+from digital_twin.connectors.model import Document, get_document_fingerprint
+from digital_twin.db.connectors.document_fingerprint import (
+    get_document_fingerprints,
+    upsert_document_fingerprints,
+)
+from digital_twin.db.engine import get_session
 from digital_twin.indexdb.chunking.chunk import Chunker, DefaultChunker
-from digital_twin.indexdb.chunking.models import EmbeddedIndexChunk
+from digital_twin.indexdb.chunking.models import EmbeddedIndexChunk, IndexChunk
 from digital_twin.indexdb.interface import KeywordIndex, VectorIndexDB
 from digital_twin.indexdb.qdrant.store import QdrantVectorDB
 from digital_twin.indexdb.typesense.store import TypesenseIndex
 from digital_twin.search.interface import DefaultEmbedder
 from digital_twin.search.models import Embedder
+from digital_twin.search.result_cache import bump_collection_generation
 from digital_twin.utils.logging import setup_logger
 
 logger = setup_logger()
 
+# How often a blocked stage wakes up to check whether another stage has failed
+_QUEUE_POLL_SECONDS = 0.5
+_STAGE_DONE = object()
 
-class IndexingPipelineProtocol(Protocol):
-    def __call__(self, documents: list[Document], user_id: UUID | None) -> tuple[int, int]:
+
+@dataclass
+class IndexingStats:
+    net_new_docs: int = 0
+    chunks: int = 0
+    documents: int = 0
+    # Documents skipped since they haven't changed since they were last indexed
+    unchanged_documents: int = 0
+
+
+class PipelinedIndexingProtocol(Protocol):
+    def __call__(
+        self,
+        doc_batches: Iterable[list[Document]],
+        user_id: UUID | None,
+        stats: IndexingStats | None = None,
+    ) -> IndexingStats:
         ...
 
 
-def _indexing_pipeline(
+def _get_indexed_by(user_id: UUID | None) -> str:
+    return PUBLIC_DOC_PAT if user_id is None else str(user_id)
+
+
+def _drop_unchanged_documents(
+    documents: list[Document], fingerprint_collection: str, user_id: UUID | None
+) -> tuple[list[Document], dict[str, str]]:
+    """Returns the documents whose content changed since they were last indexed into the collection,
+    along with their new fingerprints to be recorded once they are indexed"""
+    fingerprints = {document.id: get_document_fingerprint(document) for document in documents}
+    with get_session() as db_session:
+        stored_fingerprints = get_document_fingerprints(
+            list(fingerprints.keys()), fingerprint_collection, _get_indexed_by(user_id), db_session
+        )
+    changed_documents = [
+        document
+        for document in documents
+        if stored_fingerprints.get(document.id) != fingerprints[document.id]
+    ]
+    return changed_documents, {document.id: fingerprints[document.id] for document in changed_documents}
+
+
+def _record_fingerprints(
+    fingerprints: dict[str, str], fingerprint_collection: str, user_id: UUID | None
+) -> None:
+    with get_session() as db_session:
+        upsert_document_fingerprints(
+            fingerprints, fingerprint_collection, _get_indexed_by(user_id), db_session
+        )
+
+
+def _embed_changed_chunks(
+    embedder: Embedder, vectordb: VectorIndexDB, chunks: list[IndexChunk]
+) -> list[EmbeddedIndexChunk]:
+    """Embeds only the chunks that are new or whose content changed, the rest reuse the vectors
+    already in the vector index. Edited documents mostly keep the content of their chunks"""
+    reusable_embeddings = vectordb.get_reusable_embeddings(chunks)
+    changed_chunks = [chunk for chunk_ind, chunk in enumerate(chunks) if chunk_ind not in reusable_embeddings]
+    embedded_changed_chunks = iter(embedder.embed(changed_chunks) if changed_chunks else [])
+    logger.info(f"Reusing stored embeddings for {len(reusable_embeddings)} of {len(chunks)} chunks")
+
+    embedded_chunks: list[EmbeddedIndexChunk] = []
+    for chunk_ind, chunk in enumerate(chunks):
+        if chunk_ind in reusable_embeddings:
+            embedded_chunks.append(
+                EmbeddedIndexChunk(
+                    **{k: getattr(chunk, k) for k in chunk.__dataclass_fields__},
+                    embeddings=reusable_embeddings[chunk_ind],
+                )
+            )
+        else:
+            embedded_chunks.append(next(embedded_changed_chunks))
+    return embedded_chunks
+
+
+class _PipelineAborted(Exception):
+    """Raised inside a stage when another stage of the pipeline has failed"""
+
+
+def _put(stage_queue: queue.Queue, item: Any, abort: threading.Event) -> None:
+    while True:
+        if abort.is_set():
+            raise _PipelineAborted()
+        try:
+            stage_queue.put(item, timeout=_QUEUE_POLL_SECONDS)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(stage_queue: queue.Queue, abort: threading.Event) -> Any:
+    while True:
+        if abort.is_set():
+            raise _PipelineAborted()
+        try:
+            return stage_queue.get(timeout=_QUEUE_POLL_SECONDS)
+        except queue.Empty:
+            continue
+
+
+def _run_stage(
+    stage_name: str,
+    work: Callable[[Any], Any],
+    in_queue: queue.Queue | None,
+    out_queues: list[queue.Queue],
+    abort: threading.Event,
+    errors: list[Exception],
+    source: Iterable[Any] | None = None,
+) -> None:
+    """Runs one stage of the pipeline until its input is exhausted.
+    A stage either pulls from a source iterable (first stage) or from the previous stage's queue,
+    and pushes its result to every downstream queue. On failure, every other stage is aborted."""
+    try:
+        items = source if source is not None else iter(partial(_get, in_queue, abort), _STAGE_DONE)
+        for item in items:
+            result = work(item)
+            if result is None:
+                continue
+            for out_queue in out_queues:
+                _put(out_queue, result, abort)
+        for out_queue in out_queues:
+            _put(out_queue, _STAGE_DONE, abort)
+    except _PipelineAborted:
+        logger.warning(f"Indexing stage '{stage_name}' stopped since another stage failed")
+    except Exception as e:
+        logger.exception(f"Indexing stage '{stage_name}' failed due to {e}")
+        errors.append(e)
+        abort.set()
+
+
+def _pipelined_indexing(
     chunker: Chunker,
     embedder: Embedder,
     vectordb: VectorIndexDB,
     keyword_index: KeywordIndex,
-    documents: list[Document],
+    fingerprint_collection: str | None,
+    queue_size: int,
+    doc_batches: Iterable[list[Document]],
     user_id: UUID | None,
-) -> tuple[int, int]:
-    """Takes different pieces of the indexing pipeline and applies it to a batch of documents
-    Note that the documents should already be batched at this point so that it does not inflate the
-    memory requirements"""
-    # TODO: make entire indexing pipeline async to not block the entire process
-    # when running on async endpoints
-    chunks = list(chain(*[chunker.chunk(document) for document in documents]))
-    net_doc_count_keyword = keyword_index.index(chunks, user_id)
-    chunks_with_embeddings = embedder.embed(chunks)
-    net_doc_count_vector = vectordb.index(chunks_with_embeddings, user_id)
-    if net_doc_count_vector != net_doc_count_vector:
-        logger.exception("Number of documents indexed by keyword and vector indices aren't align")
-    net_new_docs = max(net_doc_count_keyword, net_doc_count_vector)
-    logger.info(f"Indexed {net_new_docs} new documents")
-    return net_new_docs, len(chunks)
-
-
-def build_indexing_pipeline(
+    stats: IndexingStats | None = None,
+) -> IndexingStats:
+    """Takes different pieces of the indexing pipeline and applies it to all the document batches of a
+    connector run, with connector fetch, chunking, embedding and the two index writes running as
+    concurrent stages joined by bounded queues. This way batch N+1 is fetched and embedded while
+    batch N is written.
+
+    Stats are updated in place, so callers have the partial counts even if a stage raises."""
+    stats = stats if stats is not None else IndexingStats()
+    abort = threading.Event()
+    errors: list[Exception] = []
+    # batch index -> fingerprints of the changed documents in the batch
+    batch_fingerprints: dict[int, dict[str, str]] = {}
+    # batch index -> number of documents skipped as unchanged
+    batch_unchanged: dict[int, int] = {}
+    # batch index -> net new docs for keyword index
+    keyword_results: dict[int, int] = {}
+    # batch index -> (documents in batch, chunks in batch, net new docs for vector index)
+    vector_results: dict[int, tuple[int, int, int]] = {}
+
+    chunk_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    keyword_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    embed_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    vector_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    def _chunk(item: tuple[int, list[Document]]) -> tuple[int, list[Document], list[IndexChunk]] | None:
+        batch_ind, documents = item
+        if fingerprint_collection is not None:
+            num_documents = len(documents)
+            documents, batch_fingerprints[batch_ind] = _drop_unchanged_documents(
+                documents, fingerprint_collection, user_id
+            )
+            batch_unchanged[batch_ind] = num_documents - len(documents)
+            if not documents:
+                # Nothing to chunk, embed or write for this batch
+                return None
+        chunks = list(chain(*[chunker.chunk(document) for document in documents]))
+        return batch_ind, documents, chunks
+
+    def _write_keyword(item: tuple[int, list[Document], list[IndexChunk]]) -> None:
+        batch_ind, _, chunks = item
+        keyword_results[batch_ind] = keyword_index.index(chunks, user_id)
+        bump_collection_generation(keyword_index.collection)
+
+    def _embed(
+        item: tuple[int, list[Document], list[IndexChunk]]
+    ) -> tuple[int, list[Document], list[EmbeddedIndexChunk]]:
+        batch_ind, documents, chunks = item
+        return batch_ind, documents, _embed_changed_chunks(embedder, vectordb, chunks)
+
+    def _write_vector(item: tuple[int, list[Document], list[EmbeddedIndexChunk]]) -> None:
+        batch_ind, documents, embedded_chunks = item
+        net_doc_count_vector = vectordb.index(embedded_chunks, user_id)
+        bump_collection_generation(vectordb.collection)
+        vector_results[batch_ind] = (len(documents), len(embedded_chunks), net_doc_count_vector)
+
+    stage_args: list[tuple] = [
+        ("fetch", lambda item: item, None, [chunk_queue], abort, errors, enumerate(doc_batches)),
+        ("chunk", _chunk, chunk_queue, [keyword_queue, embed_queue], abort, errors),
+        ("keyword_index", _write_keyword, keyword_queue, [], abort, errors),
+        ("embed", _embed, embed_queue, [vector_queue], abort, errors),
+        ("vector_index", _write_vector, vector_queue, [], abort, errors),
+    ]
+    threads = [
+        threading.Thread(target=_run_stage, args=args, name=f"indexing-{args[0]}", daemon=True)
+        for args in stage_args
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Only batches that made it into both indices count towards the totals
+    # and get their fingerprints recorded, the rest will be re-indexed on the next run
+    indexed_fingerprints: dict[str, str] = {}
+    for batch_ind, (num_docs, num_chunks, net_doc_count_vector) in sorted(vector_results.items()):
+        if batch_ind not in keyword_results:
+            continue
+        net_doc_count_keyword = keyword_results[batch_ind]
+        if net_doc_count_keyword != net_doc_count_vector:
+            logger.warning("Number of documents indexed by keyword and vector indices aren't align")
+        stats.net_new_docs += max(net_doc_count_keyword, net_doc_count_vector)
+        stats.chunks += num_chunks
+        stats.documents += num_docs
+        indexed_fingerprints.update(batch_fingerprints.get(batch_ind, {}))
+    stats.unchanged_documents += sum(batch_unchanged.values())
+    if fingerprint_collection is not None:
+        _record_fingerprints(indexed_fingerprints, fingerprint_collection, user_id)
+    logger.info(
+        f"Indexed {stats.net_new_docs} new documents, skipped {stats.unchanged_documents} unchanged documents"
+    )
+
+    if errors:
+        raise errors[0]
+    return stats
+
+
+def build_pipelined_indexing_pipeline(
     *,
     chunker: Optional[Chunker] = None,
     embedder: Optional[Embedder] = None,
     vectordb: Optional[VectorIndexDB] = None,
     keyword_index: Optional[KeywordIndex] = None,
-) -> IndexingPipelineProtocol:
-    """Builds a pipline which takes in a list of docs and indexes them.
+    fingerprint_collection: Optional[str] = None,
+    queue_size: int = INDEXING_PIPELINE_QUEUE_SIZE,
+) -> PipelinedIndexingProtocol:
+    """Builds a pipeline which takes in a generator of doc batches and indexes them with
+    overlapping stages.
 
-    Default uses _ chunker, _ embedder, and qdrant for the datastore"""
+    Default uses _ chunker, _ embedder, and qdrant for the datastore
+    If fingerprint_collection is set, documents that haven't changed since they were last indexed
+    into that collection are skipped. The fingerprints of a collection are cleared when it is created,
+    scripts/reset_document_fingerprints.py forces documents of an existing collection to be re-indexed"""
     if chunker is None:
         chunker = DefaultChunker()
 
@@ -67,12 +297,14 @@ def build_indexing_pipeline(
         keyword_index = TypesenseIndex(collection=TYPESENSE_DEFAULT_COLLECTION)
 
     if vectordb is None:
-        vectordb = QdrantVectorDB(collection=QDRANT_DEFAULT_COLLECTION)
+        vectordb = QdrantVectorDB(collection=QDRANT_DEFAULT_COLLECTION, content_index=keyword_index)
 
     return partial(
-        _indexing_pipeline,
+        _pipelined_indexing,
         chunker=chunker,
         embedder=embedder,
         vectordb=vectordb,
         keyword_index=keyword_index,
+        fingerprint_collection=fingerprint_collection,
+        queue_size=queue_size,
     )
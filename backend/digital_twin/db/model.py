@@ -270,6 +270,26 @@ class IndexAttempt(Base):
         )
 
 
+class DocumentFingerprint(Base):
+    """
+    Hash of a document's sections and metadata as of the last time it was indexed
+    into a collection on behalf of a user (or publicly). Lets the indexing pipeline
+    skip documents that connectors return again without any change.
+    """
+
+    __tablename__ = "document_fingerprints"
+
+    document_id: Mapped[str] = mapped_column(String, primary_key=True)
+    collection: Mapped[str] = mapped_column(String, primary_key=True)
+    # The user string written to the ACLs (user id or PUBLIC), a new user indexing
+    # the same unchanged document still needs to be added to the whitelist
+    indexed_by: Mapped[str] = mapped_column(String, primary_key=True)
+    content_hash: Mapped[str] = mapped_column(String(64))
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
 class SlackUser(Base):
     __tablename__ = "slack_users"
     __table_args__ = (UniqueConstraint("team_id", "slack_user_email", name="_team_id_slack_user_email_uc"),)
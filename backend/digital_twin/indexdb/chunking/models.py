@@ -1,10 +1,21 @@
-import inspect
 import json
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any, cast
+from typing import Any
 
-from digital_twin.config.constants import BLURB, METADATA, SEMANTIC_IDENTIFIER, SOURCE_LINKS
+from digital_twin.config.constants import (
+    BLURB,
+    CHUNK_ID,
+    CONTENT,
+    DOCUMENT_ID,
+    METADATA,
+    NUM_TOKENS,
+    SECTION_CONTINUATION,
+    SEMANTIC_IDENTIFIER,
+    SOURCE_LINKS,
+    SOURCE_TYPE,
+    TOKENIZER,
+)
 from digital_twin.connectors.model import Document
 from digital_twin.utils.logging import setup_logger
 
@@ -16,7 +27,8 @@ class IndexType(Enum):
     TYPESENSE = "typesense"
 
 
-@dataclass
+# Slots keep the per-chunk memory and attribute access cheap, search builds ~100 InferenceChunks per query
+@dataclass(slots=True)
 class BaseChunk:
     chunk_id: int
     blurb: str  # The first sentence(s) of the first Section of the chunk
@@ -36,14 +48,27 @@ class EmbeddedIndexChunk(IndexChunk):
     embeddings: list[list[float]]
 
 
-@dataclass
+@dataclass(slots=True)
 class InferenceChunk(BaseChunk):
     document_id: str
     source_type: str
     semantic_identifier: str
-    metadata: dict[str, Any]
+    # JSON string as stored in the index until metadata is first accessed, most hits never need it
+    raw_metadata: str | dict[str, Any] | None
     score_info: dict[str, Any]
     index_type: IndexType
+    # Token count of the content stored at index time and the tokenizer it was counted with,
+    # None for chunks indexed before the counts were stored
+    num_tokens: int | None = None
+    tokenizer: str | None = None
+
+    @property
+    def metadata(self) -> dict[str, Any]:
+        if isinstance(self.raw_metadata, dict):
+            return self.raw_metadata
+        metadata: dict[str, Any] = json.loads(self.raw_metadata) if self.raw_metadata is not None else {}
+        self.raw_metadata = metadata
+        return metadata
 
     @classmethod
     def from_dict(
@@ -52,24 +77,30 @@ class InferenceChunk(BaseChunk):
         score_info: dict[str, Any],
         index_type: str,
     ) -> "InferenceChunk":
-        init_kwargs = {k: v for k, v in init_dict.items() if k in inspect.signature(cls).parameters}
-        if SOURCE_LINKS in init_kwargs:
-            source_links = init_kwargs[SOURCE_LINKS]
-            source_links_dict = json.loads(source_links) if isinstance(source_links, str) else source_links
-            init_kwargs[SOURCE_LINKS] = {
-                int(k): v for k, v in cast(dict[str, str], source_links_dict).items()
-            }
-        from digital_twin.utils.logging import setup_logger
-
-        if METADATA in init_kwargs:
-            init_kwargs[METADATA] = json.loads(init_kwargs[METADATA])
-        else:
-            init_kwargs[METADATA] = {}
-        if init_kwargs.get(SEMANTIC_IDENTIFIER) is None:
+        source_links = init_dict.get(SOURCE_LINKS)
+        if isinstance(source_links, str):
+            source_links = json.loads(source_links)
+        if source_links is not None:
+            source_links = {int(k): v for k, v in source_links.items()}
+
+        semantic_identifier = init_dict.get(SEMANTIC_IDENTIFIER)
+        if semantic_identifier is None:
             logger.error(
-                f"Chunk with blurb: {init_kwargs.get(BLURB, 'Unknown')[:50]}... has no Semantic Identifier"
+                f"Chunk with blurb: {init_dict.get(BLURB, 'Unknown')[:50]}... has no Semantic Identifier"
             )
 
-        init_kwargs["score_info"] = score_info
-        init_kwargs["index_type"] = index_type
-        return cls(**init_kwargs)
+        return cls(
+            chunk_id=init_dict[CHUNK_ID],
+            blurb=init_dict[BLURB],
+            content=init_dict[CONTENT],
+            source_links=source_links,
+            section_continuation=init_dict[SECTION_CONTINUATION],
+            document_id=init_dict[DOCUMENT_ID],
+            source_type=init_dict[SOURCE_TYPE],
+            semantic_identifier=semantic_identifier,  # type: ignore
+            raw_metadata=init_dict.get(METADATA),
+            score_info=score_info,
+            index_type=index_type,  # type: ignore
+            num_tokens=init_dict.get(NUM_TOKENS),
+            tokenizer=init_dict.get(TOKENIZER),
+        )
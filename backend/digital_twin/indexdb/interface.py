@@ -1,5 +1,6 @@
 import abc
-from typing import Generic, TypeVar
+import asyncio
+from typing import Any, Generic, TypeVar
 from uuid import UUID
 
 from digital_twin.indexdb.chunking.models import BaseChunk, EmbeddedIndexChunk, IndexChunk, InferenceChunk
@@ -9,6 +10,9 @@ IndexDBFilter = dict[str, str | list[str] | None]
 
 
 class DocumentIndex(Generic[T], abc.ABC):
+    # Name of the collection the chunks are stored in
+    collection: str
+
     @abc.abstractmethod
     def index(self, chunks: list[T], user_id: UUID | None) -> int:
         """Indexes document chunks into the Document Index and return the number of new documents"""
@@ -16,6 +20,12 @@ class DocumentIndex(Generic[T], abc.ABC):
 
 
 class VectorIndexDB(DocumentIndex[EmbeddedIndexChunk], abc.ABC):
+    def get_reusable_embeddings(self, chunks: list[IndexChunk]) -> dict[int, list[list[float]]]:
+        """Returns the already indexed embeddings of the chunks whose content hasn't changed,
+        keyed by the position of the chunk in the list. Stores that can't look these up
+        return nothing, meaning every chunk gets embedded again"""
+        return {}
+
     @abc.abstractmethod
     def semantic_retrieval(
         self,
@@ -26,8 +36,29 @@ class VectorIndexDB(DocumentIndex[EmbeddedIndexChunk], abc.ABC):
     ) -> list[InferenceChunk]:
         raise NotImplementedError
 
+    async def async_semantic_retrieval(
+        self,
+        query: str,
+        user_id: UUID | None,
+        filters: list[IndexDBFilter] | None,
+        num_to_retrieve: int,
+    ) -> list[InferenceChunk]:
+        """Stores without an async client run the synchronous retrieval in the default executor"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.semantic_retrieval, query, user_id, filters, num_to_retrieve
+        )
+
 
 class KeywordIndex(DocumentIndex[IndexChunk], abc.ABC):
+    @abc.abstractmethod
+    def get_chunk_payloads(self, chunk_ids: list[str]) -> dict[str, dict[str, Any]]:
+        """Returns the stored fields of the chunks keyed by chunk id (the UUID of the full chunk), for
+        vector indices that only store ids to read the chunk contents from. Missing chunks are left out"""
+        raise NotImplementedError
+
+    async def async_get_chunk_payloads(self, chunk_ids: list[str]) -> dict[str, dict[str, Any]]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_chunk_payloads, chunk_ids)
+
     @abc.abstractmethod
     def keyword_search(
         self,
@@ -37,3 +68,15 @@ class KeywordIndex(DocumentIndex[IndexChunk], abc.ABC):
         num_to_retrieve: int,
     ) -> list[InferenceChunk]:
         raise NotImplementedError
+
+    async def async_keyword_search(
+        self,
+        query: str,
+        user_id: UUID | None,
+        filters: list[IndexDBFilter] | None,
+        num_to_retrieve: int,
+    ) -> list[InferenceChunk]:
+        """Stores without an async client run the synchronous search in the default executor"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.keyword_search, query, user_id, filters, num_to_retrieve
+        )
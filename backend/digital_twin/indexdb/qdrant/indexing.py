@@ -4,17 +4,37 @@ from uuid import UUID
 
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
-from qdrant_client.http.exceptions import ResponseHandlingException
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
 from qdrant_client.http.models.models import UpdateResult
-from qdrant_client.models import CollectionsResponse, Distance, PointStruct, VectorParams
+from qdrant_client.models import (
+    CollectionsResponse,
+    CompressionRatio,
+    Distance,
+    HnswConfigDiff,
+    PayloadSchemaType,
+    PointStruct,
+    ProductQuantization,
+    ProductQuantizationConfig,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    VectorParams,
+)
 
-from digital_twin.config.app_config import DOC_EMBEDDING_DIM
+from digital_twin.config.app_config import (
+    ENABLE_MINI_CHUNK,
+    QDRANT_HNSW_EF_CONSTRUCT,
+    QDRANT_HNSW_M,
+    QDRANT_ON_DISK_PAYLOAD,
+    QDRANT_QUANTIZATION,
+)
 from digital_twin.config.constants import (
     ALLOWED_GROUPS,
     ALLOWED_USERS,
     BLURB,
     CHUNK_ID,
     CONTENT,
+    CONTENT_HASH,
     DOCUMENT_ID,
     METADATA,
     PUBLIC_DOC_PAT,
@@ -23,72 +43,194 @@ from digital_twin.config.constants import (
     SOURCE_LINKS,
     SOURCE_TYPE,
 )
-from digital_twin.indexdb.chunking.models import EmbeddedIndexChunk
-from digital_twin.indexdb.utils import DEFAULT_BATCH_SIZE, get_uuid_from_chunk, update_doc_user_map
+from digital_twin.indexdb.chunking.models import EmbeddedIndexChunk, IndexChunk
+from digital_twin.indexdb.utils import (
+    DEFAULT_BATCH_SIZE,
+    get_chunk_content_hash,
+    get_chunk_token_count_fields,
+    get_doc_user_map,
+    get_uuid_from_chunk,
+)
+from digital_twin.search.utils import get_default_embedding_dim, split_chunk_text_into_mini_chunks
 from digital_twin.utils.clients import get_qdrant_client
 from digital_twin.utils.logging import setup_logger
 
 logger = setup_logger()
 
+# Every search filters on the ACLs, document ids are used to delete the chunks of a document
+QDRANT_INDEXED_PAYLOAD_FIELDS = [ALLOWED_USERS, ALLOWED_GROUPS, DOCUMENT_ID, SOURCE_TYPE]
+# Fields kept in the points of slim payload collections, everything else is read from the content index
+SLIM_PAYLOAD_FIELDS = {DOCUMENT_ID, CHUNK_ID, CONTENT_HASH, SOURCE_TYPE, ALLOWED_USERS, ALLOWED_GROUPS}
+
+# Collection name to whether its vectors are quantized, collection configs don't change once created
+_COLLECTION_QUANTIZED: dict[str, bool] = {}
+# Collections whose vector size matches the embedding model, checked once per collection
+_COLLECTION_DIM_CHECKED: set[str] = set()
+
 
 def list_qdrant_collections() -> CollectionsResponse:
     return get_qdrant_client().get_collections()
 
 
-def create_qdrant_collection(collection_name: str, embedding_dim: int = DOC_EMBEDDING_DIM) -> None:
+def get_quantization_config(quantization: str) -> ScalarQuantization | ProductQuantization | None:
+    if quantization == "none":
+        return None
+    if quantization == "scalar":
+        # Clip the 1% outlier values so the int8 range covers the bulk of the values
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if quantization == "product":
+        return ProductQuantization(
+            product=ProductQuantizationConfig(compression=CompressionRatio.X16, always_ram=True)
+        )
+    raise ValueError(f"Invalid Qdrant quantization: {quantization}")
+
+
+def _get_collection_config(
+    embedding_dim: int | None,
+    quantization: str,
+    hnsw_m: int,
+    hnsw_ef_construct: int,
+    on_disk_payload: bool,
+) -> dict:
+    if embedding_dim is None:
+        embedding_dim = get_default_embedding_dim()
+    quantization_config = get_quantization_config(quantization)
+    return {
+        "vectors_config": VectorParams(
+            size=embedding_dim,
+            distance=Distance.COSINE,
+            # With quantization, searches run on the quantized vectors in RAM and the originals
+            # are only read to rescore the top candidates
+            on_disk=quantization_config is not None,
+        ),
+        "hnsw_config": HnswConfigDiff(m=hnsw_m, ef_construct=hnsw_ef_construct),
+        "quantization_config": quantization_config,
+        "on_disk_payload": on_disk_payload,
+    }
+
+
+def create_qdrant_payload_indexes(collection_name: str) -> None:
+    """Keyword indexes on the fields searches filter on and documents are deleted by,
+    without them Qdrant checks the filters against the payload of every candidate point"""
+    for field_name in QDRANT_INDEXED_PAYLOAD_FIELDS:
+        get_qdrant_client().create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=PayloadSchemaType.KEYWORD,
+        )
+
+
+def create_qdrant_collection(
+    collection_name: str,
+    embedding_dim: int | None = None,
+    quantization: str = QDRANT_QUANTIZATION,
+    hnsw_m: int = QDRANT_HNSW_M,
+    hnsw_ef_construct: int = QDRANT_HNSW_EF_CONSTRUCT,
+    on_disk_payload: bool = QDRANT_ON_DISK_PAYLOAD,
+) -> None:
     logger.info(f"Attempting to create collection {collection_name}")
     result = get_qdrant_client().create_collection(
         collection_name=collection_name,
-        vectors_config=VectorParams(size=embedding_dim, distance=Distance.COSINE),
+        **_get_collection_config(embedding_dim, quantization, hnsw_m, hnsw_ef_construct, on_disk_payload),
     )
     if not result:
         raise RuntimeError("Could not create Qdrant collection")
+    create_qdrant_payload_indexes(collection_name)
 
 
-def recreate_collection(collection_name: str, embedding_dim: int = DOC_EMBEDDING_DIM) -> None:
+def recreate_collection(
+    collection_name: str,
+    embedding_dim: int | None = None,
+    quantization: str = QDRANT_QUANTIZATION,
+    hnsw_m: int = QDRANT_HNSW_M,
+    hnsw_ef_construct: int = QDRANT_HNSW_EF_CONSTRUCT,
+    on_disk_payload: bool = QDRANT_ON_DISK_PAYLOAD,
+) -> None:
     logger.info(f"Attempting to recreate collection {collection_name}")
+    _COLLECTION_QUANTIZED.pop(collection_name, None)
+    _COLLECTION_DIM_CHECKED.discard(collection_name)
     result = get_qdrant_client().recreate_collection(
         collection_name=collection_name,
-        vectors_config=VectorParams(size=embedding_dim, distance=Distance.COSINE),
+        **_get_collection_config(embedding_dim, quantization, hnsw_m, hnsw_ef_construct, on_disk_payload),
     )
     if not result:
         raise RuntimeError("Could not create Qdrant collection")
+    create_qdrant_payload_indexes(collection_name)
 
 
-def delete_doc_chunks(document_id: str, collection_name: str, q_client: QdrantClient) -> None:
-    q_client.delete(
-        collection_name=collection_name,
-        points_selector=models.FilterSelector(
-            filter=models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key=DOCUMENT_ID,
-                        match=models.MatchValue(value=document_id),
-                    ),
-                ],
-            )
-        ),
-    )
+def is_qdrant_collection_quantized(collection_name: str) -> bool:
+    """Whether searches on the collection need oversampling, looked up once per collection"""
+    if collection_name not in _COLLECTION_QUANTIZED:
+        try:
+            collection_config = get_qdrant_client().get_collection(collection_name).config
+        except (ResponseHandlingException, UnexpectedResponse) as e:
+            # Not cached, the search itself reports the failure
+            logger.warning(f"Failed to get the config of Qdrant collection {collection_name} due to {e}")
+            return False
+        vectors_config = collection_config.params.vectors
+        _COLLECTION_QUANTIZED[collection_name] = collection_config.quantization_config is not None or (
+            isinstance(vectors_config, VectorParams) and vectors_config.quantization_config is not None
+        )
+    return _COLLECTION_QUANTIZED[collection_name]
+
 
+def get_qdrant_collection_dim(collection_name: str) -> int | None:
+    vectors_config = get_qdrant_client().get_collection(collection_name).config.params.vectors
+    return vectors_config.size if isinstance(vectors_config, VectorParams) else None
+
+
+def check_qdrant_collection_dim(collection_name: str) -> None:
+    """Raises if the collection holds vectors of another size than the embedding model produces,
+    e.g. after EMBEDDING_BACKEND changed. Qdrant would otherwise reject every upsert and search"""
+    if collection_name in _COLLECTION_DIM_CHECKED:
+        return
+    try:
+        collection_dim = get_qdrant_collection_dim(collection_name)
+    except (ResponseHandlingException, UnexpectedResponse) as e:
+        # Not cached, the indexing or search itself reports the failure
+        logger.warning(f"Failed to get the config of Qdrant collection {collection_name} due to {e}")
+        return
+    embedding_dim = get_default_embedding_dim()
+    if collection_dim is not None and collection_dim != embedding_dim:
+        raise ValueError(
+            f"Qdrant collection {collection_name} has vectors of size {collection_dim} but the "
+            f"embedding model produces {embedding_dim}, was EMBEDDING_BACKEND changed?"
+        )
+    _COLLECTION_DIM_CHECKED.add(collection_name)
 
-def get_qdrant_document_whitelists(
-    doc_chunk_id: str, collection_name: str, q_client: QdrantClient
-) -> tuple[bool, list[str], list[str]]:
-    """Get whether a document is found and the existing whitelists"""
+
+def get_qdrant_documents_whitelists(
+    doc_chunk_ids: list[str], collection_name: str, q_client: QdrantClient
+) -> dict[str, tuple[list[str], list[str]]]:
+    """Get the existing whitelists of a batch of documents with a single retrieve, keyed by chunk id.
+    Documents that are not found are left out."""
     results = q_client.retrieve(
         collection_name=collection_name,
-        ids=[doc_chunk_id],
+        ids=doc_chunk_ids,
         with_payload=[ALLOWED_USERS, ALLOWED_GROUPS],
     )
-    if len(results) == 0:
-        return False, [], []
-    payload = results[0].payload
-    if not payload:
-        raise RuntimeError("Qdrant Index is corrupted, Document found with no access lists.")
-    return True, payload[ALLOWED_USERS], payload[ALLOWED_GROUPS]
+    whitelists: dict[str, tuple[list[str], list[str]]] = {}
+    for result in results:
+        if not result.payload:
+            raise RuntimeError("Qdrant Index is corrupted, Document found with no access lists.")
+        whitelists[str(result.id)] = (result.payload[ALLOWED_USERS], result.payload[ALLOWED_GROUPS])
+    return whitelists
 
 
-def delete_qdrant_doc_chunks(document_id: str, collection_name: str, q_client: QdrantClient) -> bool:
+def delete_qdrant_docs_chunks(
+    doc_keep_point_ids: dict[str, list[str]],
+    collection_name: str,
+    q_client: QdrantClient,
+) -> bool:
+    """Deletes the orphaned chunks of a batch of documents with a single filtered delete.
+    doc_keep_point_ids maps each document id to the points its new version is about to overwrite"""
+    if not doc_keep_point_ids:
+        return False
+    # Point ids are derived from the document id, so the union of the kept ids only protects each
+    # document's own points
+    keep_point_ids = [point_id for point_ids in doc_keep_point_ids.values() for point_id in point_ids]
     q_client.delete(
         collection_name=collection_name,
         points_selector=models.FilterSelector(
@@ -96,21 +238,68 @@ def delete_qdrant_doc_chunks(document_id: str, collection_name: str, q_client: Q
                 must=[
                     models.FieldCondition(
                         key=DOCUMENT_ID,
-                        match=models.MatchValue(value=document_id),
+                        match=models.MatchAny(any=list(doc_keep_point_ids.keys())),
                     ),
                 ],
+                must_not=[models.HasIdCondition(has_id=keep_point_ids)] if keep_point_ids else None,
             )
         ),
     )
     return True
 
 
+def get_qdrant_chunk_embeddings(
+    chunks: list[IndexChunk],
+    collection_name: str,
+    q_client: QdrantClient,
+    enable_mini_chunk: bool = ENABLE_MINI_CHUNK,
+) -> dict[int, list[list[float]]]:
+    """Returns the stored embeddings of the chunks whose (document_id, chunk_id) point exists with
+    the same content hash, keyed by the chunk's position in the list"""
+    # Every embedding of a chunk (full chunk + mini chunks) is its own point
+    chunk_point_ids: list[list[str]] = []
+    for chunk in chunks:
+        num_embeddings = 1 + (
+            len(split_chunk_text_into_mini_chunks(chunk.content)) if enable_mini_chunk else 0
+        )
+        chunk_point_ids.append(
+            [str(get_uuid_from_chunk(chunk, minichunk_ind)) for minichunk_ind in range(num_embeddings)]
+        )
+
+    all_point_ids = [point_id for point_ids in chunk_point_ids for point_id in point_ids]
+    stored_points = {}
+    for start in range(0, len(all_point_ids), DEFAULT_BATCH_SIZE):
+        records = q_client.retrieve(
+            collection_name=collection_name,
+            ids=all_point_ids[start : start + DEFAULT_BATCH_SIZE],
+            with_payload=[CONTENT_HASH],
+            with_vectors=True,
+        )
+        stored_points.update({str(record.id): record for record in records})
+
+    reusable_embeddings: dict[int, list[list[float]]] = {}
+    for chunk_ind, (chunk, point_ids) in enumerate(zip(chunks, chunk_point_ids)):
+        content_hash = get_chunk_content_hash(chunk.content)
+        points = [stored_points.get(point_id) for point_id in point_ids]
+        # Points indexed before content hashes were stored never match, they get embedded once more
+        if all(
+            point is not None
+            and point.payload
+            and point.payload.get(CONTENT_HASH) == content_hash
+            and isinstance(point.vector, list)
+            for point in points
+        ):
+            reusable_embeddings[chunk_ind] = [point.vector for point in points]  # type: ignore
+    return reusable_embeddings
+
+
 def index_qdrant_chunks(
     chunks: list[EmbeddedIndexChunk],
     user_id: UUID | None,
     collection: str,
     client: QdrantClient | None = None,
     batch_upsert: bool = True,
+    slim_payload: bool = False,
 ) -> int:
     # Public documents will have the PUBLIC string in ALLOWED_USERS
     # If credential that kicked this off has no user associated, either Auth is off or the doc is public
@@ -118,50 +307,55 @@ def index_qdrant_chunks(
     q_client: QdrantClient = client if client else get_qdrant_client()
 
     point_structs: list[PointStruct] = []
-    # Maps document id to dict of whitelists for users/groups each containing list of users/groups as strings
-    doc_user_map: dict[str, dict[str, list[str]]] = {}
-    docs_deleted = 0
+    # Points that the new version of each document writes, anything else of the document is orphaned
+    doc_point_ids: dict[str, list[str]] = {}
     for chunk in chunks:
-        document = chunk.source_document
-        doc_user_map, delete_doc = update_doc_user_map(
-            chunk,
-            doc_user_map,
-            partial(
-                get_qdrant_document_whitelists,
-                collection_name=collection,
-                q_client=q_client,
-            ),
-            user_str,
+        doc_point_ids.setdefault(chunk.source_document.id, []).extend(
+            str(get_uuid_from_chunk(chunk, minichunk_ind)) for minichunk_ind in range(len(chunk.embeddings))
         )
-
-        if delete_doc:
-            # Processing the first chunk of the doc and the doc exists
-            docs_deleted += 1
-            delete_qdrant_doc_chunks(document.id, collection, q_client)
-
+    # Maps document id to dict of whitelists for users/groups each containing list of users/groups as strings
+    doc_user_map, existing_doc_ids = get_doc_user_map(
+        chunks,
+        partial(
+            get_qdrant_documents_whitelists,
+            collection_name=collection,
+            q_client=q_client,
+        ),
+        user_str,
+    )
+    # Orphaned chunks of the documents that already exist are deleted in one go before the upsert
+    docs_to_delete = {doc_id: doc_point_ids[doc_id] for doc_id in existing_doc_ids}
+    chunk_token_count_fields = get_chunk_token_count_fields([chunk.content for chunk in chunks])
+    for chunk, token_count_fields in zip(chunks, chunk_token_count_fields):
+        document = chunk.source_document
+        payload = {
+            DOCUMENT_ID: document.id,
+            CHUNK_ID: chunk.chunk_id,
+            BLURB: chunk.blurb,
+            CONTENT: chunk.content,
+            CONTENT_HASH: get_chunk_content_hash(chunk.content),
+            SOURCE_TYPE: str(document.source.value),
+            SOURCE_LINKS: chunk.source_links,
+            SEMANTIC_IDENTIFIER: document.semantic_identifier,
+            SECTION_CONTINUATION: chunk.section_continuation,
+            ALLOWED_USERS: doc_user_map[document.id][ALLOWED_USERS],
+            ALLOWED_GROUPS: doc_user_map[document.id][ALLOWED_GROUPS],
+            METADATA: json.dumps(document.metadata),
+            **token_count_fields,
+        }
+        if slim_payload:
+            payload = {key: value for key, value in payload.items() if key in SLIM_PAYLOAD_FIELDS}
         point_structs.extend(
             [
                 PointStruct(
-                    id=str(get_uuid_from_chunk(chunk, minichunk_ind)),
-                    payload={
-                        DOCUMENT_ID: document.id,
-                        CHUNK_ID: chunk.chunk_id,
-                        BLURB: chunk.blurb,
-                        CONTENT: chunk.content,
-                        SOURCE_TYPE: str(document.source.value),
-                        SOURCE_LINKS: chunk.source_links,
-                        SEMANTIC_IDENTIFIER: document.semantic_identifier,
-                        SECTION_CONTINUATION: chunk.section_continuation,
-                        ALLOWED_USERS: doc_user_map[document.id][ALLOWED_USERS],
-                        ALLOWED_GROUPS: doc_user_map[document.id][ALLOWED_GROUPS],
-                        METADATA: json.dumps(document.metadata),
-                    },
-                    vector=embedding,
+                    id=str(get_uuid_from_chunk(chunk, minichunk_ind)), payload=payload, vector=embedding
                 )
                 for minichunk_ind, embedding in enumerate(chunk.embeddings)
             ]
         )
 
+    delete_qdrant_docs_chunks(docs_to_delete, collection, q_client)
+
     if batch_upsert:
         point_struct_batches = [
             point_structs[x : x + DEFAULT_BATCH_SIZE]
@@ -187,4 +381,4 @@ def index_qdrant_chunks(
         index_results = q_client.upsert(collection_name=collection, points=point_structs)
         logger.info(f"Document batch of size {len(point_structs)} indexing status: {index_results.status}")
 
-    return len(doc_user_map.keys()) - docs_deleted
+    return len(doc_user_map.keys()) - len(docs_to_delete)
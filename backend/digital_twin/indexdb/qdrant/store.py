@@ -1,26 +1,53 @@
+import asyncio
+import math
+from collections.abc import Sequence
+from typing import Any
 from uuid import UUID
 
-from langchain.embeddings.base import Embeddings
 from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
-from qdrant_client.http.models import FieldCondition, Filter, MatchAny, MatchValue
+from qdrant_client.http.models import (
+    FieldCondition,
+    Filter,
+    MatchAny,
+    MatchValue,
+    QuantizationSearchParams,
+    Record,
+    ScoredPoint,
+    SearchParams,
+    SearchRequest,
+)
 
 from digital_twin.config.app_config import (
+    CHUNK_SIZE,
+    ENABLE_MINI_CHUNK,
+    MINI_CHUNK_SIZE,
     NUM_RETURNED_HITS,
     QDRANT_DEFAULT_COLLECTION,
+    QDRANT_QUANTIZATION_OVERSAMPLING,
+    QDRANT_QUANTIZATION_RESCORE,
+    QDRANT_SLIM_PAYLOAD,
     SEARCH_DISTANCE_CUTOFF,
 )
-from digital_twin.config.constants import ALLOWED_USERS, PUBLIC_DOC_PAT
-from digital_twin.indexdb.chunking.models import EmbeddedIndexChunk, IndexType, InferenceChunk
-from digital_twin.indexdb.interface import IndexDBFilter, VectorIndexDB
-from digital_twin.indexdb.qdrant.indexing import index_qdrant_chunks
-from digital_twin.indexdb.utils import get_uuid_from_chunk
-from digital_twin.search.interface import get_default_embedding_model
-from digital_twin.utils.clients import get_qdrant_client
+from digital_twin.config.constants import ALLOWED_USERS, CHUNK_ID, CONTENT, DOCUMENT_ID, PUBLIC_DOC_PAT
+from digital_twin.indexdb.chunking.models import EmbeddedIndexChunk, IndexChunk, IndexType, InferenceChunk
+from digital_twin.indexdb.interface import IndexDBFilter, KeywordIndex, VectorIndexDB
+from digital_twin.indexdb.qdrant.indexing import (
+    check_qdrant_collection_dim,
+    get_qdrant_chunk_embeddings,
+    index_qdrant_chunks,
+    is_qdrant_collection_quantized,
+)
+from digital_twin.indexdb.utils import get_uuid_from_ids
+from digital_twin.search.interface import async_embed_query, embed_query
+from digital_twin.utils.clients import get_async_qdrant_client, get_qdrant_client
 from digital_twin.utils.logging import setup_logger
 from digital_twin.utils.timing import log_function_time
 
 logger = setup_logger()
 
+# Every chunk is stored as the full chunk point plus one point per mini chunk
+POINTS_PER_CHUNK = 1 + math.ceil(CHUNK_SIZE / MINI_CHUNK_SIZE) if ENABLE_MINI_CHUNK else 1
+
 
 def _build_qdrant_filters(user_id: UUID | None, filters: list[IndexDBFilter] | None) -> list[FieldCondition]:
     filter_conditions: list[FieldCondition] = []
@@ -65,17 +92,118 @@ def _build_qdrant_filters(user_id: UUID | None, filters: list[IndexDBFilter] | N
     return filter_conditions
 
 
+def _get_search_params(quantized: bool) -> tuple[SearchParams | None, float]:
+    """Search params for the collection, along with the factor by which to over-fetch candidates"""
+    if not quantized:
+        return None, 1
+    # Quantized scores are approximate, so more candidates are fetched than needed and (with rescore) the
+    # best of them are re-ranked with the original vectors before the top ones are returned
+    return (
+        SearchParams(
+            quantization=QuantizationSearchParams(ignore=False, rescore=QDRANT_QUANTIZATION_RESCORE)
+        ),
+        QDRANT_QUANTIZATION_OVERSAMPLING,
+    )
+
+
+def _get_unique_hits(hits: list[ScoredPoint], num_to_retrieve: int) -> list[ScoredPoint]:
+    unique_hits: list[ScoredPoint] = []
+    found_chunk_keys: set[tuple[str, int]] = set()
+    for hit in hits:
+        if hit.payload is None:
+            continue
+        # Remove duplicate chunks which happen if minichunks are used, before paying for the parsing
+        chunk_key = (hit.payload[DOCUMENT_ID], hit.payload[CHUNK_ID])
+        if chunk_key in found_chunk_keys:
+            continue
+        found_chunk_keys.add(chunk_key)
+        unique_hits.append(hit)
+        if len(unique_hits) == num_to_retrieve:
+            break
+    return unique_hits
+
+
+def _get_content_chunk_ids(hits: Sequence[ScoredPoint | Record]) -> list[str]:
+    """Ids, in the content index, of the hits whose points only store ids and compact fields"""
+    return [
+        str(get_uuid_from_ids(hit.payload[DOCUMENT_ID], hit.payload[CHUNK_ID]))
+        for hit in hits
+        if hit.payload is not None and CONTENT not in hit.payload
+    ]
+
+
+def _hits_to_inference_chunks(
+    hits: list[ScoredPoint], content_payloads: dict[str, dict[str, Any]] | None = None
+) -> list[InferenceChunk]:
+    inference_chunks: list[InferenceChunk] = []
+    for hit in hits:
+        payload = hit.payload or {}
+        if CONTENT not in payload:
+            content_chunk_id = str(get_uuid_from_ids(payload[DOCUMENT_ID], payload[CHUNK_ID]))
+            content_payload = (content_payloads or {}).get(content_chunk_id)
+            if content_payload is None:
+                # Deleted from the content index after the search, or the indices are out of sync
+                logger.warning(f"Chunk {content_chunk_id} not found in the content index, skipping it")
+                continue
+            # The ACL and ids of the vector index take precedence
+            payload = {**content_payload, **payload}
+        inference_chunks.append(
+            InferenceChunk.from_dict(
+                payload,
+                score_info={
+                    "score": hit.score,
+                },
+                index_type=IndexType.QDRANT.value,
+            )
+        )
+    return inference_chunks
+
+
 class QdrantVectorDB(VectorIndexDB):
-    def __init__(self, collection: str = QDRANT_DEFAULT_COLLECTION) -> None:
+    def __init__(
+        self, collection: str = QDRANT_DEFAULT_COLLECTION, content_index: KeywordIndex | None = None
+    ) -> None:
+        """content_index is where the contents of chunks indexed with slim payloads are read from"""
         self.collection = collection
+        self.content_index = content_index
         self.client = get_qdrant_client()
+        self.async_client = get_async_qdrant_client()
 
     def index(self, chunks: list[EmbeddedIndexChunk], user_id: UUID | None) -> int:
+        check_qdrant_collection_dim(self.collection)
         return index_qdrant_chunks(
             chunks=chunks,
             user_id=user_id,
             collection=self.collection,
             client=self.client,
+            slim_payload=QDRANT_SLIM_PAYLOAD,
+        )
+
+    def _get_content_payloads(self, hits: Sequence[ScoredPoint | Record]) -> dict[str, dict[str, Any]] | None:
+        content_chunk_ids = _get_content_chunk_ids(hits)
+        if not content_chunk_ids:
+            return None
+        if self.content_index is None:
+            raise ValueError(f"Qdrant collection {self.collection} has slim payloads but no content index")
+        return self.content_index.get_chunk_payloads(content_chunk_ids)
+
+    async def _async_get_content_payloads(self, hits: list[ScoredPoint]) -> dict[str, dict[str, Any]] | None:
+        content_chunk_ids = _get_content_chunk_ids(hits)
+        if not content_chunk_ids:
+            return None
+        if self.content_index is None:
+            raise ValueError(f"Qdrant collection {self.collection} has slim payloads but no content index")
+        return await self.content_index.async_get_chunk_payloads(content_chunk_ids)
+
+    def _get_collection_search_params(self) -> tuple[SearchParams | None, float]:
+        check_qdrant_collection_dim(self.collection)
+        return _get_search_params(is_qdrant_collection_quantized(self.collection))
+
+    def get_reusable_embeddings(self, chunks: list[IndexChunk]) -> dict[int, list[list[float]]]:
+        return get_qdrant_chunk_embeddings(
+            chunks=chunks,
+            collection_name=self.collection,
+            q_client=self.client,
         )
 
     @log_function_time()
@@ -87,61 +215,120 @@ class QdrantVectorDB(VectorIndexDB):
         num_to_retrieve: int = NUM_RETURNED_HITS,
         page_size: int = NUM_RETURNED_HITS,
         distance_cutoff: float | None = SEARCH_DISTANCE_CUTOFF,
+        use_pagination: bool = False,
     ) -> list[InferenceChunk]:
-        embedding_model = get_default_embedding_model()
+        query_embedding = embed_query(query)
+
+        filter_conditions = _build_qdrant_filters(user_id, filters)
+        search_params, oversampling = self._get_collection_search_params()
 
-        if isinstance(embedding_model, Embeddings):
-            query_embedding = embedding_model.embed_query(query)
+        if use_pagination:
+            hits = self._paginated_search(
+                query_embedding, filter_conditions, num_to_retrieve, page_size, distance_cutoff, search_params
+            )
         else:
-            query_embedding = embedding_model.encode(query)  # TODO: make this part of the embedder interface
+            # Every chunk can match through all of its points, over-fetching by that factor guarantees
+            # num_to_retrieve unique chunks from a single search
+            hits = self._search(
+                query_embedding,
+                filter_conditions,
+                math.ceil(num_to_retrieve * POINTS_PER_CHUNK * oversampling),
+                0,
+                distance_cutoff,
+                search_params,
+            )
+
+        unique_hits = _get_unique_hits(hits, num_to_retrieve)
+        return _hits_to_inference_chunks(unique_hits, self._get_content_payloads(unique_hits))
 
-        if not isinstance(query_embedding, list):
-            query_embedding = query_embedding.tolist()
+    @log_function_time()
+    async def async_semantic_retrieval(
+        self,
+        query: str,
+        user_id: UUID | None,
+        filters: list[IndexDBFilter] | None,
+        num_to_retrieve: int = NUM_RETURNED_HITS,
+        distance_cutoff: float | None = SEARCH_DISTANCE_CUTOFF,
+    ) -> list[InferenceChunk]:
+        query_embedding = await async_embed_query(query)
 
         filter_conditions = _build_qdrant_filters(user_id, filters)
+        # Only blocks on the first search of the collection in the process, afterwards it's cached
+        search_params, oversampling = await asyncio.get_running_loop().run_in_executor(
+            None, self._get_collection_search_params
+        )
+        try:
+            response = await self.async_client.points_api.search_points(
+                collection_name=self.collection,
+                search_request=SearchRequest(
+                    vector=query_embedding,
+                    filter=Filter(must=list(filter_conditions)),
+                    params=search_params,
+                    limit=math.ceil(num_to_retrieve * POINTS_PER_CHUNK * oversampling),
+                    with_payload=True,
+                    score_threshold=distance_cutoff,
+                ),
+            )
+        except ResponseHandlingException as e:
+            logger.exception(f'Qdrant querying failed due to: "{e}", is Qdrant set up?')
+            return []
+        except UnexpectedResponse as e:
+            logger.exception(f'Qdrant querying failed due to: "{e}", has ingestion been run?')
+            return []
+
+        unique_hits = _get_unique_hits(response.result or [], num_to_retrieve)
+        return _hits_to_inference_chunks(unique_hits, await self._async_get_content_payloads(unique_hits))
+
+    def _search(
+        self,
+        query_embedding: list[float],
+        filter_conditions: list[FieldCondition],
+        limit: int,
+        offset: int,
+        distance_cutoff: float | None,
+        search_params: SearchParams | None = None,
+    ) -> list[ScoredPoint]:
+        try:
+            return self.client.search(
+                collection_name=self.collection,
+                query_vector=query_embedding,
+                query_filter=Filter(must=list(filter_conditions)),
+                search_params=search_params,
+                limit=limit,
+                offset=offset,
+                score_threshold=distance_cutoff,
+            )
+        except ResponseHandlingException as e:
+            logger.exception(f'Qdrant querying failed due to: "{e}", is Qdrant set up?')
+        except UnexpectedResponse as e:
+            logger.exception(f'Qdrant querying failed due to: "{e}", has ingestion been run?')
+        return []
 
+    def _paginated_search(
+        self,
+        query_embedding: list[float],
+        filter_conditions: list[FieldCondition],
+        num_to_retrieve: int,
+        page_size: int,
+        distance_cutoff: float | None,
+        search_params: SearchParams | None = None,
+    ) -> list[ScoredPoint]:
+        """Pages through the results until num_to_retrieve unique chunks are found, one search per page"""
         page_offset = 0
-        found_inference_chunks: list[InferenceChunk] = []
-        found_chunk_uuids: set[UUID] = set()
-        while len(found_inference_chunks) < num_to_retrieve:
-            try:
-                hits = self.client.search(
-                    collection_name=self.collection,
-                    query_vector=query_embedding,
-                    query_filter=Filter(must=list(filter_conditions)),
-                    limit=page_size,
-                    offset=page_offset,
-                    score_threshold=distance_cutoff,
-                )
-                page_offset += page_size
-                if not hits:
-                    break
-            except ResponseHandlingException as e:
-                logger.exception(f'Qdrant querying failed due to: "{e}", is Qdrant set up?')
-                break
-            except UnexpectedResponse as e:
-                logger.exception(f'Qdrant querying failed due to: "{e}", has ingestion been run?')
+        all_hits: list[ScoredPoint] = []
+        found_chunk_keys: set[tuple[str, int]] = set()
+        while len(found_chunk_keys) < num_to_retrieve:
+            hits = self._search(
+                query_embedding, filter_conditions, page_size, page_offset, distance_cutoff, search_params
+            )
+            page_offset += page_size
+            if not hits:
                 break
-
-            inference_chunks_from_hits = [
-                InferenceChunk.from_dict(
-                    hit.payload,
-                    score_info={
-                        "score": hit.score,
-                    },
-                    index_type=IndexType.QDRANT.value,
-                )
-                for hit in hits
-                if hit.payload is not None
-            ]
-            for inf_chunk in inference_chunks_from_hits:
-                # remove duplicate chunks which happen if minichunks are used
-                inf_chunk_id = get_uuid_from_chunk(inf_chunk)
-                if inf_chunk_id not in found_chunk_uuids:
-                    found_inference_chunks.append(inf_chunk)
-                    found_chunk_uuids.add(inf_chunk_id)
-
-        return found_inference_chunks
+            all_hits.extend(hits)
+            found_chunk_keys.update(
+                (hit.payload[DOCUMENT_ID], hit.payload[CHUNK_ID]) for hit in hits if hit.payload is not None
+            )
+        return all_hits
 
     def get_from_id(self, object_id: str) -> InferenceChunk | None:
         matches, _ = self.client.scroll(
@@ -157,9 +344,18 @@ class QdrantVectorDB(VectorIndexDB):
         match = matches[0]
         if not match.payload:
             return None
+        payload = match.payload
+        if CONTENT not in payload:
+            content_chunk_id = str(get_uuid_from_ids(payload[DOCUMENT_ID], payload[CHUNK_ID]))
+            content_payload = (self._get_content_payloads([match]) or {}).get(content_chunk_id)
+            if content_payload is None:
+                logger.warning(f"Chunk {content_chunk_id} not found in the content index")
+                return None
+            # The ACL and ids of the vector index take precedence
+            payload = {**content_payload, **payload}
 
         return InferenceChunk.from_dict(
-            match.payload,
+            payload,
             # Not applicable here
             score_info={},
             index_type=IndexType.QDRANT.value,
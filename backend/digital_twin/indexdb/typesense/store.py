@@ -15,20 +15,31 @@ from digital_twin.config.constants import (
     CONTENT,
     DOCUMENT_ID,
     METADATA,
+    NUM_TOKENS,
     PUBLIC_DOC_PAT,
     SECTION_CONTINUATION,
     SEMANTIC_IDENTIFIER,
     SOURCE_LINKS,
     SOURCE_TYPE,
+    TOKENIZER,
 )
 from digital_twin.indexdb.chunking.models import EmbeddedIndexChunk, IndexChunk, IndexType, InferenceChunk
 from digital_twin.indexdb.interface import IndexDBFilter, KeywordIndex
-from digital_twin.indexdb.utils import DEFAULT_BATCH_SIZE, get_uuid_from_chunk, update_doc_user_map
-from digital_twin.utils.clients import get_typesense_client
+from digital_twin.indexdb.utils import (
+    DEFAULT_BATCH_SIZE,
+    get_chunk_token_count_fields,
+    get_doc_user_map,
+    get_uuid_from_chunk,
+)
+from digital_twin.utils.clients import get_async_typesense_client, get_typesense_client
 from digital_twin.utils.logging import setup_logger
+from digital_twin.utils.timing import log_function_time
 
 logger = setup_logger()
 
+# Documents whose orphaned chunks are deleted by a single filtered delete
+_DELETE_BATCH_SIZE = 100
+
 
 def check_typesense_collection_exist(
     collection_name: str = TYPESENSE_DEFAULT_COLLECTION,
@@ -61,31 +72,63 @@ def create_typesense_collection(
             {"name": ALLOWED_USERS, "type": "string[]"},
             {"name": ALLOWED_GROUPS, "type": "string[]"},
             {"name": METADATA, "type": "string"},
+            {"name": NUM_TOKENS, "type": "int32", "optional": True},
+            {"name": TOKENIZER, "type": "string", "optional": True},
         ],
     }
     ts_client.collections.create(collection_schema)
 
 
-def get_typesense_document_whitelists(
-    doc_chunk_id: str, collection_name: str, ts_client: typesense.Client
-) -> tuple[bool, list[str], list[str]]:
-    """Returns whether the document already exists and the users/group whitelists"""
-    try:
-        document = ts_client.collections[collection_name].documents[doc_chunk_id].retrieve()
-    except ObjectNotFound:
-        return False, [], []
-    if document[ALLOWED_USERS] is None or document[ALLOWED_GROUPS] is None:
-        raise RuntimeError("Typesense Index is corrupted, Document found with no access lists.")
-    return True, document[ALLOWED_USERS], document[ALLOWED_GROUPS]
+def get_typesense_documents_whitelists(
+    doc_chunk_ids: list[str], collection_name: str, ts_client: typesense.Client
+) -> dict[str, tuple[list[str], list[str]]]:
+    """Returns the users/group whitelists of the documents that already exist, keyed by chunk id.
+    Fetched with a single filtered search instead of one retrieve per document."""
+    whitelists: dict[str, tuple[list[str], list[str]]] = {}
+    # Typesense caps the page size at 250
+    for start in range(0, len(doc_chunk_ids), 250):
+        id_batch = doc_chunk_ids[start : start + 250]
+        results = ts_client.collections[collection_name].documents.search(
+            {
+                "q": "*",
+                "filter_by": f"id:[{','.join(id_batch)}]",
+                "include_fields": f"id,{ALLOWED_USERS},{ALLOWED_GROUPS}",
+                "per_page": len(id_batch),
+            }
+        )
+        for hit in results["hits"]:
+            document = hit["document"]
+            if document.get(ALLOWED_USERS) is None or document.get(ALLOWED_GROUPS) is None:
+                raise RuntimeError("Typesense Index is corrupted, Document found with no access lists.")
+            whitelists[document["id"]] = (document[ALLOWED_USERS], document[ALLOWED_GROUPS])
+    return whitelists
 
 
-def delete_typesense_doc_chunks(document_id: str, collection_name: str, ts_client: typesense.Client) -> bool:
-    doc_id_filter = {"filter_by": f"{DOCUMENT_ID}:'{document_id}'"}
+def _quote_filter_value(value: str) -> str:
+    """Backtick quotes a filter value so commas, parentheses and operators in it are taken literally"""
+    escaped_value = value.replace("`", "\\`")
+    return f"`{escaped_value}`"
 
-    # Typesense doesn't seem to prioritize individual deletions, problem not seen with this approach
-    # Point to consider if we see instances of number of Typesense and Qdrant docs not matching
-    del_result = ts_client.collections[collection_name].documents.delete(doc_id_filter)
-    return del_result["num_deleted"] != 0
+
+def delete_typesense_docs_chunks(
+    doc_chunk_counts: dict[str, int],
+    collection_name: str,
+    ts_client: typesense.Client,
+) -> bool:
+    """Deletes the orphaned chunks of a batch of documents with one filtered delete per _DELETE_BATCH_SIZE
+    documents. doc_chunk_counts maps each document id to the number of chunks of its new version"""
+    num_deleted = 0
+    doc_chunk_count_items = list(doc_chunk_counts.items())
+    # The filter is sent in the query string, documents are deleted in batches to bound its length
+    for start in range(0, len(doc_chunk_count_items), _DELETE_BATCH_SIZE):
+        # Each document only loses the chunks past its own new chunk count
+        filter_str = " || ".join(
+            f"({DOCUMENT_ID}:={_quote_filter_value(doc_id)} && {CHUNK_ID}:>={num_chunks})"
+            for doc_id, num_chunks in doc_chunk_count_items[start : start + _DELETE_BATCH_SIZE]
+        )
+        del_result = ts_client.collections[collection_name].documents.delete({"filter_by": filter_str})
+        num_deleted += del_result["num_deleted"]
+    return num_deleted != 0
 
 
 def index_typesense_chunks(
@@ -99,26 +142,25 @@ def index_typesense_chunks(
     ts_client: typesense.Client = client if client else get_typesense_client()
 
     new_documents: list[dict[str, Any]] = []
-    doc_user_map: dict[str, dict[str, list[str]]] = {}
-    docs_deleted = 0
+    # Number of chunks in the new version of each document, anything past it is orphaned
+    doc_chunk_counts: dict[str, int] = {}
     for chunk in chunks:
+        doc_id = chunk.source_document.id
+        doc_chunk_counts[doc_id] = max(doc_chunk_counts.get(doc_id, 0), chunk.chunk_id + 1)
+    doc_user_map, existing_doc_ids = get_doc_user_map(
+        chunks,
+        partial(
+            get_typesense_documents_whitelists,
+            collection_name=collection,
+            ts_client=ts_client,
+        ),
+        user_str,
+    )
+    # Orphaned chunks of the documents that already exist are deleted in one go before the upsert
+    docs_to_delete = {doc_id: doc_chunk_counts[doc_id] for doc_id in existing_doc_ids}
+    chunk_token_count_fields = get_chunk_token_count_fields([chunk.content for chunk in chunks])
+    for chunk, token_count_fields in zip(chunks, chunk_token_count_fields):
         document = chunk.source_document
-        doc_user_map, delete_doc = update_doc_user_map(
-            chunk,
-            doc_user_map,
-            partial(
-                get_typesense_document_whitelists,
-                collection_name=collection,
-                ts_client=ts_client,
-            ),
-            user_str,
-        )
-
-        if delete_doc:
-            # Processing the first chunk of the doc and the doc exists
-            docs_deleted += 1
-            delete_typesense_doc_chunks(document.id, collection, ts_client)
-
         new_documents.append(
             {
                 "id": str(get_uuid_from_chunk(chunk)),  # No minichunks for typesense
@@ -133,9 +175,12 @@ def index_typesense_chunks(
                 ALLOWED_USERS: doc_user_map[document.id][ALLOWED_USERS],
                 ALLOWED_GROUPS: doc_user_map[document.id][ALLOWED_GROUPS],
                 METADATA: json.dumps(document.metadata),
+                **token_count_fields,
             }
         )
 
+    delete_typesense_docs_chunks(docs_to_delete, collection, ts_client)
+
     if batch_upsert:
         doc_batches = [
             new_documents[x : x + DEFAULT_BATCH_SIZE]
@@ -151,7 +196,7 @@ def index_typesense_chunks(
     else:
         [ts_client.collections[collection].documents.upsert(document) for document in new_documents]
 
-    return len(doc_user_map.keys()) - docs_deleted
+    return len(doc_user_map.keys()) - len(docs_to_delete)
 
 
 def _build_typesense_filters(user_id: UUID | None, filters: list[IndexDBFilter] | None) -> str:
@@ -180,10 +225,54 @@ def _build_typesense_filters(user_id: UUID | None, filters: list[IndexDBFilter]
     return filter_str
 
 
+def _build_typesense_search_query(
+    query: str, user_id: UUID | None, filters: list[IndexDBFilter] | None, num_to_retrieve: int
+) -> dict[str, Any]:
+    return {
+        "q": query,
+        # Often, data_source semantic identifiers are file names or title or summaries
+        "query_by": f"{CONTENT}, {SEMANTIC_IDENTIFIER}",
+        "query_by_weight": "1,3",
+        "filter_by": _build_typesense_filters(user_id, filters),
+        "per_page": num_to_retrieve,
+        "limit_hits": num_to_retrieve,
+        "num_typos": 2,
+        "prefix": "false",
+        # below is required to allow proper partial matching of a query
+        # (partial matching = only some of the terms in the query match)
+        # more info here: https://typesense-community.slack.com/archives/C01P749MET0/p1688083239192799
+        "exhaustive_search": "true",
+    }
+
+
+def _build_typesense_id_queries(chunk_ids: list[str]) -> list[dict[str, Any]]:
+    # Typesense caps the page size at 250
+    return [
+        {
+            "q": "*",
+            "filter_by": f"id:[{','.join(chunk_ids[start : start + 250])}]",
+            "per_page": len(chunk_ids[start : start + 250]),
+        }
+        for start in range(0, len(chunk_ids), 250)
+    ]
+
+
+def _hits_to_inference_chunks(hits: list[dict[str, Any]]) -> list[InferenceChunk]:
+    return [
+        InferenceChunk.from_dict(
+            hit["document"],
+            hit.get("text_match_info", None),
+            IndexType.TYPESENSE.value,
+        )
+        for hit in hits
+    ]
+
+
 class TypesenseIndex(KeywordIndex):
     def __init__(self, collection: str = TYPESENSE_DEFAULT_COLLECTION) -> None:
         self.collection = collection
         self.ts_client = get_typesense_client()
+        self.async_client = get_async_typesense_client()
 
     def index(self, chunks: list[IndexChunk], user_id: UUID | None) -> int:
         return index_typesense_chunks(
@@ -200,34 +289,38 @@ class TypesenseIndex(KeywordIndex):
         filters: list[IndexDBFilter] | None,
         num_to_retrieve: int = NUM_RETURNED_HITS,
     ) -> list[InferenceChunk]:
-        filters_str = _build_typesense_filters(user_id, filters)
-
-        search_query = {
-            "q": query,
-            # Often, data_source semantic identifiers are file names or title or summaries
-            "query_by": f"{CONTENT}, {SEMANTIC_IDENTIFIER}",
-            "query_by_weight": "1,3",
-            "filter_by": filters_str,
-            "per_page": num_to_retrieve,
-            "limit_hits": num_to_retrieve,
-            "num_typos": 2,
-            "prefix": "false",
-            # below is required to allow proper partial matching of a query
-            # (partial matching = only some of the terms in the query match)
-            # more info here: https://typesense-community.slack.com/archives/C01P749MET0/p1688083239192799
-            "exhaustive_search": "true",
-        }
-
+        search_query = _build_typesense_search_query(query, user_id, filters, num_to_retrieve)
         search_results = self.ts_client.collections[self.collection].documents.search(search_query)
+        return _hits_to_inference_chunks(search_results["hits"])
 
-        hits = search_results["hits"]
-        inference_chunks = [
-            InferenceChunk.from_dict(
-                hit["document"],
-                hit.get("text_match_info", None),
-                IndexType.TYPESENSE.value,
-            )
-            for hit in hits
-        ]
+    @log_function_time()
+    async def async_keyword_search(
+        self,
+        query: str,
+        user_id: UUID | None,
+        filters: list[IndexDBFilter] | None,
+        num_to_retrieve: int = NUM_RETURNED_HITS,
+    ) -> list[InferenceChunk]:
+        search_query = _build_typesense_search_query(query, user_id, filters, num_to_retrieve)
+        response = await self.async_client.get(
+            f"/collections/{self.collection}/documents/search", params=search_query
+        )
+        response.raise_for_status()
+        return _hits_to_inference_chunks(response.json()["hits"])
 
-        return inference_chunks
+    def get_chunk_payloads(self, chunk_ids: list[str]) -> dict[str, dict[str, Any]]:
+        payloads: dict[str, dict[str, Any]] = {}
+        for id_query in _build_typesense_id_queries(chunk_ids):
+            results = self.ts_client.collections[self.collection].documents.search(id_query)
+            payloads.update({hit["document"]["id"]: hit["document"] for hit in results["hits"]})
+        return payloads
+
+    async def async_get_chunk_payloads(self, chunk_ids: list[str]) -> dict[str, dict[str, Any]]:
+        payloads: dict[str, dict[str, Any]] = {}
+        for id_query in _build_typesense_id_queries(chunk_ids):
+            response = await self.async_client.get(
+                f"/collections/{self.collection}/documents/search", params=id_query
+            )
+            response.raise_for_status()
+            payloads.update({hit["document"]["id"]: hit["document"] for hit in response.json()["hits"]})
+        return payloads
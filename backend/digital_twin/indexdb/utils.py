@@ -1,60 +1,104 @@
+import hashlib
 import uuid
 from collections.abc import Callable
-from copy import deepcopy
+from typing import Any
 
-from digital_twin.config.constants import ALLOWED_GROUPS, ALLOWED_USERS
+from digital_twin.config.constants import ALLOWED_GROUPS, ALLOWED_USERS, NUM_TOKENS, TOKENIZER
 from digital_twin.indexdb.chunking.models import EmbeddedIndexChunk, IndexChunk, InferenceChunk
+from digital_twin.llm.interface import get_selected_model_type
+from digital_twin.search.embedding_executor import get_token_encoder
 
 DEFAULT_BATCH_SIZE = 30
 
 
+def get_chunk_identifier_from_ids(document_id: str, chunk_id: int, mini_chunk_ind: int = 0) -> str:
+    # Web parsing URL duplicate catching
+    if document_id and document_id[-1] == "/":
+        document_id = document_id[:-1]
+    return "_".join([document_id, str(chunk_id), str(mini_chunk_ind)])
+
+
+def get_chunk_identifier(
+    chunk: IndexChunk | EmbeddedIndexChunk | InferenceChunk, mini_chunk_ind: int = 0
+) -> str:
+    """The string the chunk UUID is derived from, equally unique and cheaper when the UUID isn't needed"""
+    doc_str = chunk.document_id if isinstance(chunk, InferenceChunk) else chunk.source_document.id
+    return get_chunk_identifier_from_ids(doc_str, chunk.chunk_id, mini_chunk_ind)
+
+
+def get_uuid_from_ids(document_id: str, chunk_id: int, mini_chunk_ind: int = 0) -> uuid.UUID:
+    """Same as get_uuid_from_chunk, for when only the stored ids of the chunk are at hand"""
+    return uuid.uuid5(
+        uuid.NAMESPACE_X500, get_chunk_identifier_from_ids(document_id, chunk_id, mini_chunk_ind)
+    )
+
+
 def get_uuid_from_chunk(
     chunk: IndexChunk | EmbeddedIndexChunk | InferenceChunk, mini_chunk_ind: int = 0
 ) -> uuid.UUID:
-    doc_str = chunk.document_id if isinstance(chunk, InferenceChunk) else chunk.source_document.id
-    # Web parsing URL duplicate catching
-    if doc_str and doc_str[-1] == "/":
-        doc_str = doc_str[:-1]
-    unique_identifier_string = "_".join([doc_str, str(chunk.chunk_id), str(mini_chunk_ind)])
-    return uuid.uuid5(uuid.NAMESPACE_X500, unique_identifier_string)
+    return uuid.uuid5(uuid.NAMESPACE_X500, get_chunk_identifier(chunk, mini_chunk_ind))
 
 
-# Takes the chunk identifier returns whether the chunk exists and the user/group whitelists
-WhitelistCallable = Callable[[str], tuple[bool, list[str], list[str]]]
+def get_chunk_content_hash(content: str) -> str:
+    """Stored alongside the chunk vectors so an edited document can reuse the vectors of
+    the chunks whose content didn't change"""
+    return hashlib.sha256(content.encode()).hexdigest()
 
 
-def update_doc_user_map(
-    chunk: IndexChunk | EmbeddedIndexChunk,
-    doc_whitelist_map: dict[str, dict[str, list[str]]],
-    doc_store_whitelist_fnc: WhitelistCallable,
+def get_chunk_token_count_fields(contents: list[str]) -> list[dict[str, Any]]:
+    """The token count of each chunk content, stored with the chunk so that the QA prompts are budgeted
+    without tokenizing the chunks again. Counted with the tokenizer of the QA model, nothing is stored
+    for models without a tiktoken tokenizer"""
+    tokenizer = get_selected_model_type().tokenizer
+    if tokenizer is None:
+        return [{} for _ in contents]
+    encoder = get_token_encoder(tokenizer)
+    return [
+        {NUM_TOKENS: len(tokens), TOKENIZER: tokenizer} for tokens in encoder.encode_ordinary_batch(contents)
+    ]
+
+
+# Takes the first chunk ids of a batch of documents, returns the user/group whitelists of the existing ones
+BatchWhitelistCallable = Callable[[list[str]], dict[str, tuple[list[str], list[str]]]]
+
+
+def get_doc_user_map(
+    chunks: list[IndexChunk] | list[EmbeddedIndexChunk],
+    doc_store_whitelists_fnc: BatchWhitelistCallable,
     user_str: str,
-) -> tuple[dict[str, dict[str, list[str]]], bool]:
-    """Returns an updated document id to whitelists mapping and if the document's chunks need to be wiped."""
-    doc_whitelist_map = deepcopy(doc_whitelist_map)
-    first_chunk_uuid = str(get_uuid_from_chunk(chunk))
-    document = chunk.source_document
-    if document.id not in doc_whitelist_map:
-        first_chunk_found, whitelist_users, whitelist_groups = doc_store_whitelist_fnc(first_chunk_uuid)
-
-        if not first_chunk_found:
-            doc_whitelist_map[document.id] = {
+) -> tuple[dict[str, dict[str, list[str]]], set[str]]:
+    """Returns the document id to whitelists mapping for a batch of chunks and the ids of the documents
+    that already exist in the document store, whose orphaned chunks need to be wiped.
+    Computed once per document, the whitelists of every document are fetched with a single call."""
+    first_chunk_uuids: dict[str, str] = {}
+    for chunk in chunks:
+        document_id = chunk.source_document.id
+        if document_id not in first_chunk_uuids:
+            first_chunk_uuids[document_id] = str(get_uuid_from_chunk(chunk))
+
+    existing_whitelists = (
+        doc_store_whitelists_fnc(list(first_chunk_uuids.values())) if first_chunk_uuids else {}
+    )
+
+    doc_whitelist_map: dict[str, dict[str, list[str]]] = {}
+    existing_doc_ids: set[str] = set()
+    for document_id, first_chunk_uuid in first_chunk_uuids.items():
+        if first_chunk_uuid not in existing_whitelists:
+            # First chunk does not exist so document does not exist, no need for deletion
+            doc_whitelist_map[document_id] = {
                 ALLOWED_USERS: [user_str],
                 # TODO introduce groups logic here
-                ALLOWED_GROUPS: whitelist_groups,
+                ALLOWED_GROUPS: [],
             }
-            # First chunk does not exist so document does not exist, no need for deletion
-            return doc_whitelist_map, False
-        else:
-            if user_str not in whitelist_users:
-                whitelist_users.append(user_str)
-            # TODO introduce groups logic here
-            doc_whitelist_map[document.id] = {
-                ALLOWED_USERS: whitelist_users,
-                ALLOWED_GROUPS: whitelist_groups,
-            }
-            # First chunk exists, but with update, there may be less total chunks now
-            # Must delete rest of document chunks
-            return doc_whitelist_map, True
+            continue
+
+        whitelist_users, whitelist_groups = existing_whitelists[first_chunk_uuid]
+        # TODO introduce groups logic here
+        doc_whitelist_map[document_id] = {
+            ALLOWED_USERS: whitelist_users if user_str in whitelist_users else [*whitelist_users, user_str],
+            ALLOWED_GROUPS: list(whitelist_groups),
+        }
+        # First chunk exists, but with update, there may be less total chunks now
+        existing_doc_ids.add(document_id)
 
-    # If document is already in the mapping, don't delete again
-    return doc_whitelist_map, False
+    return doc_whitelist_map, existing_doc_ids
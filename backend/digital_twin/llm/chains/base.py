@@ -1,9 +1,17 @@
-from typing import Optional
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional
 
 from langchain import PromptTemplate
 from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.base import BaseCallbackHandler
 
-from digital_twin.llm.interface import get_seleted_model_n_context_len
+from digital_twin.config.app_config import PROMPT_TOKEN_CACHE_SIZE
+from digital_twin.llm.interface import (
+    get_selected_model_type,
+    get_seleted_model_n_context_len,
+    use_shared_llm_session,
+)
 from digital_twin.utils.logging import setup_logger
 from digital_twin.utils.timing import log_function_time
 
@@ -17,6 +25,26 @@ QUOTE_PAT = "Quote:"
 STOP_PAT = "[STOP]"
 UNCERTAIN_PAT = "?[STOP]"
 
+# (model name, prompt section) -> number of tokens, the same chunks and examples are stuffed in many prompts
+_SECTION_TOKEN_COUNTS: OrderedDict[tuple[str, str], int] = OrderedDict()
+_SECTION_TOKEN_COUNTS_LOCK = threading.Lock()
+
+
+def get_num_section_tokens(llm: BaseLanguageModel, section: str) -> int:
+    key = (get_selected_model_type().name, section)
+    with _SECTION_TOKEN_COUNTS_LOCK:
+        num_tokens = _SECTION_TOKEN_COUNTS.get(key)
+        if num_tokens is not None:
+            _SECTION_TOKEN_COUNTS.move_to_end(key)
+            return num_tokens
+
+    num_tokens = llm.get_num_tokens(section)
+    with _SECTION_TOKEN_COUNTS_LOCK:
+        _SECTION_TOKEN_COUNTS[key] = num_tokens
+        while len(_SECTION_TOKEN_COUNTS) > PROMPT_TOKEN_CACHE_SIZE:
+            _SECTION_TOKEN_COUNTS.popitem(last=False)
+    return num_tokens
+
 
 class BaseChain:
     """
@@ -27,9 +55,12 @@ class BaseChain:
         self,
         llm: BaseLanguageModel,
         prompt: Optional[PromptTemplate] = None,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
     ):
         self.llm = llm
         self.prompt = prompt or self.default_prompt
+        # The llm is shared between requests, the callbacks of this chain are passed to each call instead
+        self.callbacks = callbacks
 
     @property
     def default_prompt(self) -> PromptTemplate:
@@ -40,11 +71,53 @@ class BaseChain:
         """Create a formatted prompt with the given arguments."""
         return self.prompt.format_prompt(**kwargs).to_string()
 
+    def predict(self, formatted_prompt: str) -> str:
+        """Run the llm on the formatted prompt."""
+        return self.llm.predict(formatted_prompt, callbacks=self.callbacks)
+
+    async def apredict(self, formatted_prompt: str) -> str:
+        """Run the llm on the formatted prompt, through the pooled async HTTP session."""
+        use_shared_llm_session()
+        return await self.llm.apredict(formatted_prompt, callbacks=self.callbacks)
+
     def log_filled_prompt(self, formatted_prompt: str) -> None:
         """Log the filled prompt."""
         logger.debug(f"Filled prompt:\n{formatted_prompt}")
 
+    def get_prompt_token_limit(self) -> int:
+        """Number of tokens left for the prompt once the completion tokens are reserved."""
+        return get_seleted_model_n_context_len() - self.llm.dict()["max_tokens"]
+
     def tokens_within_limit(self, formatted_prompt: str) -> bool:
         """Check if the number of tokens is within the allowed limit."""
         num_tokens_in_prompt = self.llm.get_num_tokens(formatted_prompt)
-        return num_tokens_in_prompt <= get_seleted_model_n_context_len() - self.llm.dict()["max_tokens"]
+        return num_tokens_in_prompt <= self.get_prompt_token_limit()
+
+    def get_num_sections_within_limit(
+        self,
+        section_token_counts: Iterable[int],
+        sections_variable: str,
+        *,
+        prompt_template: Optional[PromptTemplate] = None,
+        **kwargs,
+    ) -> int:
+        """
+        Number of leading sections that fit in the prompt once joined into `sections_variable`, given
+        their token counts (lazily, the sections past the limit are not counted). kwargs fill the other
+        variables of prompt_template, the chain's prompt by default.
+        The rest of the prompt is only tokenized once, instead of re-tokenizing the whole prompt after
+        adding each section. Sections end with a newline, where the tokenizers split, so their token
+        counts add up.
+        """
+        # Filled in with the question, so tokenized directly instead of taking a section cache entry
+        prompt_template = prompt_template or self.prompt
+        token_budget = self.get_prompt_token_limit() - self.llm.get_num_tokens(
+            prompt_template.format_prompt(**{sections_variable: ""}, **kwargs).to_string()
+        )
+        num_sections = 0
+        for num_section_tokens in section_token_counts:
+            token_budget -= num_section_tokens
+            if token_budget < 0:
+                break
+            num_sections += 1
+        return num_sections
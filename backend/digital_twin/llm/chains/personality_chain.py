@@ -2,7 +2,7 @@ from typing import List, Optional, Tuple
 
 from langchain import PromptTemplate
 
-from digital_twin.llm.chains.base import BaseChain
+from digital_twin.llm.chains.base import BaseChain, get_num_section_tokens
 from digital_twin.utils.logging import setup_logger
 from digital_twin.utils.timing import log_function_time
 
@@ -33,27 +33,27 @@ class BasePersonalityChain(BaseChain):
             kwargs["examples"] = NULL_EXAMPLE_TOKEN
             formatted_prompt = self.create_prompt(**kwargs)
         else:
-            # Create a copy to avoid altering the original list
-            examples = list(examples)
-            # Keep adding more examples until we hit the token limit
-            for idx, _ in enumerate(examples):
-                kwargs["examples"] = self.format_examples(examples[: idx + 1])
-                formatted_prompt = self.create_prompt(**kwargs)
-                if not self.tokens_within_limit(formatted_prompt):
-                    examples.pop(idx)
-                    break
+            # Keep as many examples as the token limit allows
+            num_examples = self.get_num_sections_within_limit(
+                (get_num_section_tokens(self.llm, f"{EXAMPLE_SEP_PAT}\n{example}\n") for example in examples),
+                "examples",
+                **kwargs,
+            )
+            examples = examples[:num_examples]
+            kwargs["examples"] = self.format_examples(examples) if examples else NULL_EXAMPLE_TOKEN
+            formatted_prompt = self.create_prompt(**kwargs)
             logger.debug(f"Stuffed {len(examples)} examples in the context")
         return formatted_prompt
 
     @log_function_time()
     def run(self, examples: Optional[List[Tuple[str, str]]] = None, **kwargs) -> str:
         formatted_prompt = self.get_filled_prompt(examples, **kwargs)
-        return self.llm.predict(formatted_prompt)
+        return self.predict(formatted_prompt)
 
     @log_function_time()
     async def async_run(self, examples: Optional[List[Tuple[str, str]]] = None, **kwargs) -> str:
         formatted_prompt = self.get_filled_prompt(examples, **kwargs)
-        return await self.llm.apredict(formatted_prompt)
+        return await self.apredict(formatted_prompt)
 
 
 class PersonalityChain(BasePersonalityChain):
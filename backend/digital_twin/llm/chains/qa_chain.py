@@ -3,10 +3,20 @@ from typing import List, Optional
 
 from langchain import PromptTemplate
 from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.base import BaseCallbackHandler
 
 from digital_twin.indexdb.chunking.models import InferenceChunk
-from digital_twin.llm.chains.base import DOC_SEP_PAT, QUESTION_PAT, UNCERTAIN_PAT, BaseChain
-from digital_twin.llm.chains.utils import add_metadata_section
+from digital_twin.llm.chains.base import (
+    DOC_SEP_PAT,
+    QUESTION_PAT,
+    UNCERTAIN_PAT,
+    BaseChain,
+)
+from digital_twin.llm.chains.utils import (
+    format_context_document,
+    get_chunk_num_tokens,
+    get_context_document_num_tokens,
+)
 from digital_twin.utils.logging import setup_logger
 from digital_twin.utils.timing import log_function_time
 
@@ -46,8 +56,13 @@ QA_MODEL_SETTINGS = {"temperature": 0.0, "max_output_tokens": 2000}
 class BaseQA(BaseChain):
     """Base class for Question-Answering."""
 
-    def __init__(self, llm: BaseLanguageModel, prompt: PromptTemplate = None) -> None:
-        super().__init__(llm, prompt)
+    def __init__(
+        self,
+        llm: BaseLanguageModel,
+        prompt: PromptTemplate = None,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
+    ) -> None:
+        super().__init__(llm, prompt, callbacks)
 
     def get_filled_prompt(self, query: str, context_docs: Optional[List[InferenceChunk]]) -> str:
         raise NotImplementedError("This method should be overridden in subclasses.")
@@ -59,7 +74,7 @@ class BaseQA(BaseChain):
         context_docs: Optional[List[InferenceChunk]],
     ) -> str:
         formatted_prompt = self.get_filled_prompt(query, context_docs)
-        return self.llm.predict(formatted_prompt)
+        return self.predict(formatted_prompt)
 
     @log_function_time()
     async def async_run(
@@ -68,7 +83,7 @@ class BaseQA(BaseChain):
         context_docs: Optional[List[InferenceChunk]],
     ) -> str:
         formatted_prompt = self.get_filled_prompt(query, context_docs)
-        return await self.llm.apredict(formatted_prompt)
+        return await self.apredict(formatted_prompt)
 
 
 class StuffQA(BaseQA):
@@ -95,29 +110,20 @@ class StuffQA(BaseQA):
 
     def format_documents(self, documents: List[InferenceChunk]) -> str:
         """Format the documents for the prompt."""
-        formatted_docs = ""
-        for ranked_document in documents:
-            formatted_docs += f"{DOC_SEP_PAT}\n"
-            formatted_docs += add_metadata_section(ranked_document)
-            formatted_docs += f"{ranked_document.content}\n"
-        return formatted_docs.strip()
+        return "".join(format_context_document(document) for document in documents).strip()
 
     def get_filled_prompt(
         self,
         input_str: str,
         context_docs: Optional[List[InferenceChunk]],
     ) -> str:
-        documents = []
-        if context_docs:
-            for ranked_doc in context_docs:
-                documents.append(ranked_doc)
-                formatted_prompt = self.create_prompt(
-                    question=input_str,
-                    context=self.format_documents(documents),
-                )
-                if not self.tokens_within_limit(formatted_prompt):
-                    documents.pop()
-                    break
+        documents = context_docs or []
+        num_documents = self.get_num_sections_within_limit(
+            (get_context_document_num_tokens(self.llm, document) for document in documents),
+            "context",
+            question=input_str,
+        )
+        documents = documents[:num_documents]
 
         logger.info(f"Stuffed {len(documents)} documents in the context")
         formatted_prompt = self.create_prompt(question=input_str, context=self.format_documents(documents))
@@ -151,7 +157,7 @@ class RefineQA(BaseQA):
         prompt = (
             "HUMAN:\n"
             "Refine the original answer to the question using the new (possibly irrelevant) document extract.\n"
-            "f{BASE_PROMPT}"
+            f"{BASE_PROMPT}"
             f"{QUESTION_PAT}\n---------------\n"
             "{question}\n\n"
             "Original answer:\n-----------------\n"
@@ -176,20 +182,32 @@ class RefineQA(BaseQA):
     def run(self, input_str: str, context_doc: Optional[List[InferenceChunk]]) -> str:
         """Ask a question."""
         last_answer = ""
+        formatted_prompt: Optional[str] = None
         if context_doc is None:
             context_doc = []
 
         for i, ranked_doc in enumerate(context_doc):
             print(f"Refining from document {i + 1}/{len(context_doc)}")
-            prompt = self.default_prompt if i == 0 else self.refine_prompt
-            if i == 0:
-                formatted_prompt = self.create_prompt(question=input_str, context=ranked_doc.content)
+            # The first document that fits is answered from, the next ones refine its answer
+            if formatted_prompt is None:
+                prompt, prompt_kwargs = self.prompt, {"question": input_str}
             else:
-                formatted_prompt = self.create_prompt(
-                    question=input_str,
-                    context=ranked_doc.content,
-                    previous_answer=last_answer,
-                )
-            last_answer = self.llm.predict(formatted_prompt)
-        self.log_filled_prompt(formatted_prompt)
+                prompt, prompt_kwargs = self.refine_prompt, {
+                    "question": input_str,
+                    "previous_answer": last_answer,
+                }
+            # The document is budgeted from its token count, the rest of the prompt is tokenized
+            if not self.get_num_sections_within_limit(
+                [get_chunk_num_tokens(self.llm, ranked_doc)],
+                "context",
+                prompt_template=prompt,
+                **prompt_kwargs,
+            ):
+                logger.warning(f"Document {i + 1} does not fit in the context, skipping it")
+                continue
+            filled_prompt = prompt.format_prompt(context=ranked_doc.content, **prompt_kwargs).to_string()
+            last_answer = self.predict(filled_prompt)
+            formatted_prompt = filled_prompt
+        if formatted_prompt is not None:
+            self.log_filled_prompt(formatted_prompt)
         return last_answer
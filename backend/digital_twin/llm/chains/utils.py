@@ -1,6 +1,10 @@
+from langchain.base_language import BaseLanguageModel
+
 from digital_twin.config.constants import DocumentSource
 from digital_twin.connectors.factory import identify_connector_class
 from digital_twin.indexdb.chunking.models import InferenceChunk
+from digital_twin.llm.chains.base import DOC_SEP_PAT, get_num_section_tokens
+from digital_twin.llm.interface import get_selected_model_type
 from digital_twin.utils.logging import setup_logger
 
 logger = setup_logger()
@@ -18,3 +22,29 @@ def add_metadata_section(
             prompt += f"\t{metadata_line}\n"
         prompt += "\n\n"
     return prompt
+
+
+def format_context_document_header(chunk: InferenceChunk) -> str:
+    return f"{DOC_SEP_PAT}\n{add_metadata_section(chunk)}"
+
+
+def format_context_document(chunk: InferenceChunk) -> str:
+    """Prompt section of a context document, the sections are concatenated to fill the context"""
+    return f"{format_context_document_header(chunk)}{chunk.content}\n"
+
+
+def get_chunk_num_tokens(llm: BaseLanguageModel, chunk: InferenceChunk) -> int:
+    """Uses the token count stored at index time when it was counted with the tokenizer of the model,
+    the content is only tokenized for chunks indexed before the counts were stored"""
+    if chunk.num_tokens is not None and chunk.tokenizer == get_selected_model_type().tokenizer:
+        return chunk.num_tokens
+    return get_num_section_tokens(llm, chunk.content)
+
+
+def get_context_document_num_tokens(llm: BaseLanguageModel, chunk: InferenceChunk) -> int:
+    # The header is shared by the chunks of a source and cached, the content ends with a newline token
+    return (
+        get_num_section_tokens(llm, format_context_document_header(chunk))
+        + get_chunk_num_tokens(llm, chunk)
+        + 1
+    )
@@ -3,10 +3,11 @@ from typing import Dict, List, Optional
 
 from langchain import PromptTemplate
 from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.base import BaseCallbackHandler
 
 from digital_twin.indexdb.chunking.models import InferenceChunk
 from digital_twin.llm.chains.base import DOC_SEP_PAT, QUESTION_PAT, BaseChain
-from digital_twin.llm.chains.utils import add_metadata_section
+from digital_twin.llm.chains.utils import format_context_document, get_context_document_num_tokens
 from digital_twin.utils.logging import setup_logger
 from digital_twin.utils.timing import log_function_time
 
@@ -45,8 +46,13 @@ VERIFY_MODEL_SETTINGS = {"temperature": 0.0, "max_output_tokens": 100}
 class BaseVerify(BaseChain):
     """Base class for Verifing whether the question can be answered with the internal knowledge."""
 
-    def __init__(self, llm: BaseLanguageModel, prompt: PromptTemplate = None) -> None:
-        super().__init__(llm, prompt)
+    def __init__(
+        self,
+        llm: BaseLanguageModel,
+        prompt: PromptTemplate = None,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
+    ) -> None:
+        super().__init__(llm, prompt, callbacks)
 
     def get_filled_prompt(self, query: str, context_docs: Optional[List[InferenceChunk]]) -> str:
         raise NotImplementedError("Implement in subclass")
@@ -54,12 +60,12 @@ class BaseVerify(BaseChain):
     @log_function_time()
     def run(self, query: str, context_docs: Optional[List[InferenceChunk]]) -> str:
         formatted_prompt = self.get_filled_prompt(query, context_docs)
-        return self.llm.predict(formatted_prompt)
+        return self.predict(formatted_prompt)
 
     @log_function_time()
     async def async_run(self, query: str, context_docs: Optional[List[InferenceChunk]]) -> str:
         formatted_prompt = self.get_filled_prompt(query, context_docs)
-        return await self.llm.apredict(formatted_prompt)
+        return await self.apredict(formatted_prompt)
 
 
 class StuffVerify(BaseVerify):
@@ -86,24 +92,16 @@ class StuffVerify(BaseVerify):
 
     def format_documents(self, documents: List[InferenceChunk]) -> str:
         """Format the documents for the prompt."""
-        formatted_docs = ""
-        for ranked_document in documents:
-            formatted_docs += f"{DOC_SEP_PAT}\n"
-            formatted_docs += add_metadata_section(ranked_document)
-            formatted_docs += f"{ranked_document.content}\n"
-        return formatted_docs.strip()
+        return "".join(format_context_document(document) for document in documents).strip()
 
     def get_filled_prompt(self, query: str, context_doc: Optional[List[InferenceChunk]]) -> str:
-        documents = []
-        if context_doc:
-            for ranked_doc in context_doc:
-                documents.append(ranked_doc)
-                formatted_prompt = self.create_prompt(
-                    question=query, context=self.format_documents(documents)
-                )
-                if not self.tokens_within_limit(formatted_prompt):
-                    documents.pop()
-                    break
+        documents = context_doc or []
+        num_documents = self.get_num_sections_within_limit(
+            (get_context_document_num_tokens(self.llm, document) for document in documents),
+            "context",
+            question=query,
+        )
+        documents = documents[:num_documents]
 
         print(f"Stuffed {len(documents)} documents in the context")
         formatted_prompt = self.create_prompt(question=query, context=self.format_documents(documents))
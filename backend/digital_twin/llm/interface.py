@@ -1,18 +1,24 @@
-from typing import List, Optional
+import threading
+from typing import Any, Optional
 
+import openai
 import promptlayer
 from langchain.callbacks import PromptLayerCallbackHandler
-from langchain.callbacks.base import BaseCallbackHandler
 from langchain.llms.base import BaseLanguageModel
 
 from digital_twin.config.app_config import DEFAULT_MODEL_TYPE, MODEL_API_KEY, PROMPTLAYER_API_KEY
 from digital_twin.config.model_config import SupportedModelType
+from digital_twin.utils.clients import get_async_llm_session
 from digital_twin.utils.logging import setup_logger
 
 logger = setup_logger()
 COMMON_CALLBACK_HANDLER = [PromptLayerCallbackHandler(pl_tags=["Azure"])]
 promptlayer.api_key = PROMPTLAYER_API_KEY
 
+# (model, temperature, max output tokens, streaming, timeout) -> LLM client shared by all the requests
+_LLM_CLIENTS: dict[tuple[str, float, Optional[int], bool, int], BaseLanguageModel] = {}
+_LLM_CLIENTS_LOCK = threading.Lock()
+
 
 def get_selected_model_type() -> SupportedModelType:
     return SupportedModelType[DEFAULT_MODEL_TYPE]
@@ -22,24 +28,48 @@ def get_seleted_model_n_context_len() -> int:
     return get_selected_model_type().n_context_len
 
 
+def use_shared_llm_session() -> None:
+    """Makes the async OpenAI / Azure requests of the current context go through the pooled session,
+    call from the event loop before the request"""
+    if openai.aiosession.get() is None:
+        openai.aiosession.set(get_async_llm_session())
+
+
 def get_llm(
     temperature: float,
     max_output_tokens: Optional[int] = None,
     streaming: bool = False,
-    callback_handler: List[BaseCallbackHandler] = [],
-    **kwargs,
-) -> Optional[BaseLanguageModel]:
+    **kwargs: Any,
+) -> BaseLanguageModel:
+    """
+    LLM clients are built once per model and settings then shared by every request, which keeps their
+    HTTP clients and connections. Callbacks that belong to a single call (e.g. streaming the tokens)
+    are passed to the call, see BaseChain.
+    """
+    selected_model_type = get_selected_model_type()
+    model_timeout = kwargs.get("model_timeout", 10)
+    key = (selected_model_type.name, temperature, max_output_tokens, streaming, model_timeout)
+    with _LLM_CLIENTS_LOCK:
+        if key not in _LLM_CLIENTS:
+            _LLM_CLIENTS[key] = _build_llm(temperature, max_output_tokens, streaming, model_timeout)
+        return _LLM_CLIENTS[key]
+
+
+def _build_llm(
+    temperature: float,
+    max_output_tokens: Optional[int],
+    streaming: bool,
+    model_timeout: int,
+) -> BaseLanguageModel:
     selected_model_type = get_selected_model_type()
     llm: BaseLanguageModel = None
     api_key = MODEL_API_KEY
     if not api_key:
         raise ValueError("API key wasn't set for {selected_model_type.platform}}")
-    if streaming and not callback_handler:
-        raise ValueError("Need to pass callback_handler for streaming")
     if not PROMPTLAYER_API_KEY:
         raise ValueError("API key wasn't set for PromptLayer")
 
-    callback_handler = callback_handler + COMMON_CALLBACK_HANDLER
+    callback_handler = COMMON_CALLBACK_HANDLER
     if selected_model_type.name.startswith("gpt"):
         from langchain.chat_models import ChatOpenAI
 
@@ -50,7 +80,7 @@ def get_llm(
             max_tokens=max_output_tokens,
             streaming=streaming,
             callbacks=callback_handler,
-            request_timeout=kwargs.get("model_timeout", 10),
+            request_timeout=model_timeout,
         )
 
     elif selected_model_type.name.startswith("claude"):
@@ -63,7 +93,7 @@ def get_llm(
             max_tokens=max_output_tokens,
             streaming=streaming,
             callbacks=callback_handler,
-            request_timeout=kwargs.get("model_timeout", 10),
+            request_timeout=model_timeout,
         )
     elif selected_model_type.name.startswith("azure"):
         from langchain.chat_models import AzureChatOpenAI
@@ -79,7 +109,7 @@ def get_llm(
             max_tokens=max_output_tokens,
             streaming=streaming,
             callbacks=callback_handler,
-            request_timeout=kwargs.get("model_timeout", 10),
+            request_timeout=model_timeout,
             # We want to use the same encoding as GPT3.5, somehow this error out
             # when we put `gpt-35-turbo` eventho the mapping is there.
             tiktoken_model_name="gpt-3.5-turbo",
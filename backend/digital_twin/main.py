@@ -1,4 +1,3 @@
-import nltk
 import uvicorn
 from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
@@ -35,26 +34,50 @@ def get_application() -> FastAPI:
     def startup_event() -> None:
         # To avoid circular imports
         from digital_twin.config.app_config import QDRANT_DEFAULT_COLLECTION, TYPESENSE_DEFAULT_COLLECTION
-        from digital_twin.indexdb.qdrant.indexing import create_qdrant_collection, list_qdrant_collections
+        from digital_twin.db.connectors.document_fingerprint import delete_document_fingerprints
+        from digital_twin.db.engine import get_session
+        from digital_twin.indexdb.qdrant.indexing import (
+            check_qdrant_collection_dim,
+            create_qdrant_collection,
+            list_qdrant_collections,
+        )
         from digital_twin.indexdb.typesense.store import (
             check_typesense_collection_exist,
             create_typesense_collection,
         )
+        from digital_twin.search.keyword_utils import ensure_nltk_resources, warm_up_keyword_processing
+        from digital_twin.search.reranking import CrossEncoderReranker, get_default_reranker
 
-        nltk.download("stopwords")
-        nltk.download("wordnet")
-        nltk.download("punkt")
+        ensure_nltk_resources()
+        warm_up_keyword_processing()
 
         if QDRANT_DEFAULT_COLLECTION not in {
             collection.name for collection in list_qdrant_collections().collections
         }:
             logger.info(f"Creating collection with name: {QDRANT_DEFAULT_COLLECTION}")
             create_qdrant_collection(collection_name=QDRANT_DEFAULT_COLLECTION)
+            # Fingerprints left from a previous collection of the same name would skip its documents
+            with get_session() as db_session:
+                delete_document_fingerprints(QDRANT_DEFAULT_COLLECTION, db_session)
+
+        # Refuse to start rather than fail every indexing run and search of the default collection
+        check_qdrant_collection_dim(QDRANT_DEFAULT_COLLECTION)
 
         if not check_typesense_collection_exist(TYPESENSE_DEFAULT_COLLECTION):
             logger.info(f"Creating Typesense collection with name: {TYPESENSE_DEFAULT_COLLECTION}")
             create_typesense_collection(collection_name=TYPESENSE_DEFAULT_COLLECTION)
 
+        reranker = get_default_reranker()
+        if isinstance(reranker, CrossEncoderReranker):
+            # Load the model now instead of on the first question
+            reranker.warm_up()
+
+    @application.on_event("shutdown")
+    async def shutdown_event() -> None:
+        from digital_twin.utils.clients import close_async_clients
+
+        await close_async_clients()
+
     return application
 
 
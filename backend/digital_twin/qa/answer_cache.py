@@ -0,0 +1,191 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from digital_twin.config.app_config import (
+    QA_ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    QA_ANSWER_CACHE_SIZE,
+    QA_ANSWER_CACHE_TTL_SECONDS,
+)
+from digital_twin.indexdb.chunking.models import InferenceChunk
+from digital_twin.llm.interface import get_selected_model_type
+from digital_twin.search.interface import async_embed_query
+from digital_twin.search.result_cache import async_get_collection_generations
+from digital_twin.utils.logging import setup_logger
+
+logger = setup_logger()
+
+_QA_ANSWER_CACHE: "QAAnswerCache | None" = None
+
+
+def get_answer_context_key(context_docs: list[InferenceChunk], prompt_template: Optional[str] = None) -> str:
+    """Answers are only shared between queries answered by the same model and prompt from the same chunks"""
+    chunk_ids = [(doc.document_id, doc.chunk_id) for doc in context_docs]
+    key_parts = [get_selected_model_type().name, prompt_template, chunk_ids]
+    return hashlib.sha256(json.dumps(key_parts, default=str).encode()).hexdigest()
+
+
+@dataclass
+class CachedAnswer:
+    answer: Optional[str]
+    quotes: Optional[dict[str, dict[str, str | int | None]]]
+    is_docs_relevant: Optional[bool]
+    confidence_score: Optional[float]
+
+
+@dataclass
+class _CachedAnswerEntry:
+    query_embedding: np.ndarray  # Normalized, so the dot product is the cosine similarity
+    generations: tuple[int, ...]
+    expires_at: float
+    answer: CachedAnswer
+
+
+class QAAnswerCache:
+    """
+    In-memory cache of the verified answers to queries. Entries are grouped by the chunks the answer was
+    generated from, a query is served the answer of the most similar cached query of its group if its
+    embedding is at least `similarity_threshold` similar. An entry is only served while the generations of
+    its collections are the ones it was answered at, so re-indexing any chunk invalidates it
+    """
+
+    def __init__(
+        self,
+        max_entries: int = QA_ANSWER_CACHE_SIZE,
+        ttl_seconds: float = QA_ANSWER_CACHE_TTL_SECONDS,
+        similarity_threshold: float = QA_ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._num_entries = 0
+        # LRU over the groups, a group holds few entries since paraphrases rarely retrieve the same chunks
+        self._entries: OrderedDict[str, list[_CachedAnswerEntry]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, context_key: str, query_embedding: list[float], generations: tuple[int, ...]
+    ) -> CachedAnswer | None:
+        normalized_embedding = _normalize(query_embedding)
+        with self._lock:
+            entries = self._entries.get(context_key, [])
+            now = time.monotonic()
+            valid_entries = [
+                entry for entry in entries if entry.generations == generations and entry.expires_at >= now
+            ]
+            self._set_group(context_key, valid_entries)
+
+            best_entry, best_similarity = None, -1.0
+            for entry in valid_entries:
+                similarity = float(np.dot(entry.query_embedding, normalized_embedding))
+                if similarity > best_similarity:
+                    best_entry, best_similarity = entry, similarity
+            if best_entry is None or best_similarity < self.similarity_threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(context_key)
+            self.hits += 1
+        logger.info(f"Serving QA answer from the answer cache, query similarity {best_similarity:.3f}")
+        return best_entry.answer
+
+    def put(
+        self,
+        context_key: str,
+        query_embedding: list[float],
+        generations: tuple[int, ...],
+        answer: CachedAnswer,
+    ) -> None:
+        entry = _CachedAnswerEntry(
+            query_embedding=_normalize(query_embedding),
+            generations=generations,
+            expires_at=time.monotonic() + self.ttl_seconds,
+            answer=answer,
+        )
+        with self._lock:
+            # Entries answered at older generations can't be served anymore
+            entries = [
+                cached for cached in self._entries.get(context_key, []) if cached.generations == generations
+            ]
+            self._set_group(context_key, entries + [entry])
+            self._entries.move_to_end(context_key)
+            while self._num_entries > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._num_entries -= len(evicted)
+
+    def get_hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _set_group(self, context_key: str, entries: list[_CachedAnswerEntry]) -> None:
+        self._num_entries += len(entries) - len(self._entries.get(context_key, []))
+        if entries:
+            self._entries[context_key] = entries
+        else:
+            self._entries.pop(context_key, None)
+
+
+def _normalize(embedding: list[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@dataclass
+class AnswerCacheLookup:
+    """Result of a cache lookup, the answer generated on a miss is stored under the same key"""
+
+    cache: QAAnswerCache
+    context_key: str
+    query_embedding: list[float]
+    generations: tuple[int, ...]
+    cached_answer: CachedAnswer | None
+
+    def store(self, answer: CachedAnswer) -> None:
+        # An answer the model failed to produce for relevant documents is not worth serving again
+        if answer.answer is None and answer.is_docs_relevant:
+            return
+        self.cache.put(self.context_key, self.query_embedding, self.generations, answer)
+
+
+async def async_lookup_answer(
+    query: str,
+    context_docs: list[InferenceChunk],
+    collections: list[str],
+    prompt_template: Optional[str] = None,
+) -> AnswerCacheLookup | None:
+    """None if the cache is disabled or can't be used right now, the answer is then generated as usual"""
+    answer_cache = get_qa_answer_cache()
+    if answer_cache is None or not context_docs:
+        return None
+    # Read before answering, so answers generated while a collection is re-indexed are never served
+    generations = await async_get_collection_generations(collections)
+    if generations is None:
+        return None
+    try:
+        # Retrieval just embedded the query, it is usually served from the query embedding cache
+        query_embedding = await async_embed_query(query)
+    except Exception as e:
+        logger.warning(f"Failed to embed the query, bypassing the answer cache due to {e}")
+        return None
+
+    context_key = get_answer_context_key(context_docs, prompt_template)
+    cached_answer = answer_cache.get(context_key, query_embedding, generations)
+    logger.info(f"QA answer cache hit rate: {answer_cache.get_hit_rate():.2f}")
+    return AnswerCacheLookup(answer_cache, context_key, query_embedding, generations, cached_answer)
+
+
+def get_qa_answer_cache(max_entries: int = QA_ANSWER_CACHE_SIZE) -> QAAnswerCache | None:
+    global _QA_ANSWER_CACHE
+    if max_entries <= 0:
+        return None
+    if _QA_ANSWER_CACHE is None:
+        _QA_ANSWER_CACHE = QAAnswerCache(max_entries=max_entries)
+    return _QA_ANSWER_CACHE
@@ -1,8 +1,10 @@
 import abc
-from collections.abc import AsyncIterable
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass
 from typing import Dict, List, Optional, Tuple, Union
 
 from langchain import PromptTemplate
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.llms.base import BaseLanguageModel
 
 from digital_twin.indexdb.chunking.models import InferenceChunk
@@ -12,15 +14,30 @@ from digital_twin.utils.logging import setup_logger
 logger = setup_logger()
 
 
+@dataclass
+class QAUpdate:
+    """Results of the QA stages so far, rephrased_response is set on the last update.
+    stage_timings holds the seconds from the start of the QA to the end of each stage"""
+
+    answer: Optional[str]
+    quotes: Optional[Dict[str, Dict[str, Union[str, int, None]]]]
+    is_docs_relevant: Optional[bool]
+    confidence_score: Optional[float]
+    rephrased_response: Optional[str]
+    stage_timings: Dict[str, float]
+
+
 class QAModel:
     def _pick_qa_chain(
         self,
         llm: BaseLanguageModel,
         prompt: PromptTemplate = None,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
     ) -> BaseQA:
         return StuffQA(
             llm=llm,
             prompt=prompt,
+            callbacks=callbacks,
         )
 
     @abc.abstractmethod
@@ -47,14 +64,26 @@ class QAModel:
         query: str,
         context_docs: List[InferenceChunk],
         prompt: PromptTemplate = None,
+        collections: Optional[List[str]] = None,
     ) -> Tuple[
         Optional[str],
-        Optional[Dict[str, Optional[Dict[str, str | int | None]]]],
+        Optional[Dict[str, Dict[str, str | int | None]]],
         Optional[bool],
         Optional[float],
     ]:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def async_stream_answer_verify_and_rephrase(
+        self,
+        query: str,
+        context_docs: List[InferenceChunk],
+        rephrase: Callable[[str], Awaitable[str]],
+        prompt: PromptTemplate = None,
+        collections: Optional[List[str]] = None,
+    ) -> AsyncIterator[QAUpdate]:
+        raise NotImplementedError
+
     @abc.abstractmethod
     def answer_question_stream(
         self,
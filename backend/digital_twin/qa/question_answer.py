@@ -1,19 +1,22 @@
 import asyncio
 import json
 import re
-from collections.abc import AsyncIterable, Awaitable
+import time
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 from langchain import PromptTemplate
 from langchain.callbacks import AsyncIteratorCallbackHandler
 
+from digital_twin.config.app_config import QA_SPECULATIVE_REPHRASE
 from digital_twin.config.constants import BLURB, DOCUMENT_ID, SEMANTIC_IDENTIFIER, SOURCE_LINK, SOURCE_TYPE
 from digital_twin.indexdb.chunking.models import InferenceChunk
 from digital_twin.llm.chains.base import ANSWER_PAT, QUOTE_PAT
 from digital_twin.llm.chains.qa_chain import QA_MODEL_SETTINGS, BaseQA
 from digital_twin.llm.chains.verify_chain import VERIFY_MODEL_SETTINGS, StuffVerify
 from digital_twin.llm.interface import get_llm
-from digital_twin.qa.interface import QAModel
+from digital_twin.qa.answer_cache import CachedAnswer, async_lookup_answer
+from digital_twin.qa.interface import QAModel, QAUpdate
 from digital_twin.utils.logging import setup_logger
 from digital_twin.utils.text_processing import clean_model_quote, shared_precompare_cleanup
 from digital_twin.utils.timing import log_function_time
@@ -145,6 +148,41 @@ def stream_answer_end(answer_so_far: str, next_token: str) -> bool:
     return False
 
 
+class AnswerStreamTracker:
+    """Follows the answer field of the JSON output of the QA model as its tokens are streamed"""
+
+    def __init__(self) -> None:
+        self.model_output = ""
+        self.found_answer_start = False
+        self.found_answer_end = False
+
+    def add(self, token: str) -> str | None:
+        """Returns the token if it is part of the answer"""
+        model_previous = self.model_output
+        self.model_output += token
+        if not self.found_answer_start:
+            if '{"answer":"' in self.model_output.replace(" ", "").replace("\n", ""):
+                self.found_answer_start = True
+            return None
+        if self.found_answer_end:
+            return None
+        if stream_answer_end(model_previous, token):
+            self.found_answer_end = True
+            return None
+        return token
+
+    def get_answer(self) -> str | None:
+        """The unescaped answer, once its field is complete"""
+        match = re.search(r'"answer"\s*:\s*', self.model_output)
+        if match is None:
+            return None
+        try:
+            answer, _ = json.JSONDecoder().raw_decode(self.model_output, match.end())
+        except ValueError:
+            return None
+        return answer if isinstance(answer, str) else None
+
+
 def process_verify_answer(answer_raw: str) -> tuple[bool, float]:
     def _determine_answerable(answer_str: str | None) -> bool:
         if answer_str is None:
@@ -269,18 +307,34 @@ class QA(QAModel):
         query: str,
         context_docs: List[InferenceChunk],
         prompt: PromptTemplate = None,
+        collections: Optional[List[str]] = None,
     ) -> Tuple[
         Optional[str],
-        Optional[Dict[str, Optional[Dict[str, str | int | None]]]],
+        Optional[Dict[str, Dict[str, str | int | None]]],
         Optional[bool],
         Optional[float],
     ]:
         """
          Runs both qa_response and verify chain async.
          If documents are irrelevant, returns None for answer and quotes_dict
+         Given the collections the context_docs come from, answers are cached until they are re-indexed
+         and served to similar queries answered from the same documents
 
         :return Tuple[answer, quotes_dict]
         """
+        answer_lookup = (
+            await async_lookup_answer(query, context_docs, collections, prompt.template if prompt else None)
+            if collections
+            else None
+        )
+        if answer_lookup is not None and answer_lookup.cached_answer is not None:
+            cached_answer = answer_lookup.cached_answer
+            return (
+                cached_answer.answer,
+                cached_answer.quotes,
+                cached_answer.is_docs_relevant,
+                cached_answer.confidence_score,
+            )
 
         async def execute_tasks() -> List[Any]:
             tasks = {
@@ -303,8 +357,126 @@ class QA(QAModel):
         answer, quotes_dict = qa_response
         is_docs_relevant, confidence_score = relevancy_resp
 
+        if answer_lookup is not None:
+            answer_lookup.store(CachedAnswer(answer, quotes_dict, is_docs_relevant, confidence_score))
         return answer, quotes_dict, is_docs_relevant, confidence_score
 
+    async def async_stream_answer_verify_and_rephrase(
+        self,
+        query: str,
+        context_docs: List[InferenceChunk],
+        rephrase: Callable[[str], Awaitable[str]],
+        prompt: PromptTemplate = None,
+        collections: Optional[List[str]] = None,
+        *,
+        speculative_rephrase: bool = QA_SPECULATIVE_REPHRASE,
+    ) -> AsyncIterator[QAUpdate]:
+        """
+        Runs the QA and the verify chains concurrently, then rephrases the answer with `rephrase`.
+        Yields an update once the answer and the relevancy are known, and the final one with the
+        rephrased response.
+
+        With speculative_rephrase, the rephrasing starts as soon as the answer field is streamed, while
+        the model still writes the quotes and the documents are verified. It is started again if the
+        final answer differs (e.g. no quote could be extracted). If the documents are irrelevant the
+        answer and its rephrasing are cancelled and the empty answer is rephrased instead, like when
+        the QA finds no answer.
+
+        Given the collections the context_docs come from, the answer and relevancy of a similar query
+        answered from the same documents are served from the answer cache, only the rephrasing runs.
+        """
+        start_time = time.perf_counter()
+        stage_timings: dict[str, float] = {}
+        rephrase_task: asyncio.Task | None = None
+        rephrased_answer: str | None = None
+
+        async def timed(stage: str, awaitable: Awaitable) -> Any:
+            result = await awaitable
+            stage_timings[stage] = time.perf_counter() - start_time
+            return result
+
+        def start_rephrase(answer: str) -> None:
+            nonlocal rephrase_task, rephrased_answer
+            if rephrase_task is not None:
+                rephrase_task.cancel()
+            rephrased_answer = answer
+            rephrase_task = asyncio.create_task(timed("rephrase", rephrase(answer)))
+
+        async def answer_question() -> tuple[str | None, dict[str, dict[str, str | int | None]] | None]:
+            answer_tracker = AnswerStreamTracker()
+            async for token in self._stream_model_output(query, context_docs, prompt):
+                answer_tracker.add(token)
+                if answer_tracker.found_answer_end and "qa_answer" not in stage_timings:
+                    stage_timings["qa_answer"] = time.perf_counter() - start_time
+                    speculative_answer = answer_tracker.get_answer()
+                    if speculative_rephrase and speculative_answer:
+                        start_rephrase(speculative_answer)
+            stage_timings["qa"] = time.perf_counter() - start_time
+            return process_answer(answer_tracker.model_output, context_docs)
+
+        answer_lookup = None
+        if collections:
+            answer_lookup = await timed(
+                "answer_cache",
+                async_lookup_answer(query, context_docs, collections, prompt.template if prompt else None),
+            )
+        cached_answer = answer_lookup.cached_answer if answer_lookup is not None else None
+        qa_task: asyncio.Task | None = None
+        verify_task: asyncio.Task | None = None
+        try:
+            if cached_answer is not None:
+                answer, quotes_dict = cached_answer.answer, cached_answer.quotes
+                is_docs_relevant, confidence_score = (
+                    cached_answer.is_docs_relevant,
+                    cached_answer.confidence_score,
+                )
+            else:
+                qa_task = asyncio.create_task(answer_question())
+                verify_task = asyncio.create_task(
+                    timed("verify", async_verify_if_docs_are_relevant(query, context_docs=context_docs))
+                )
+                pending: set[asyncio.Task] = {qa_task, verify_task}
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    if verify_task in done and not verify_task.result()[0]:
+                        qa_task.cancel()
+                        break
+
+                is_docs_relevant, confidence_score = verify_task.result()
+                answer, quotes_dict = qa_task.result() if is_docs_relevant else (None, None)
+                if answer_lookup is not None:
+                    answer_lookup.store(CachedAnswer(answer, quotes_dict, is_docs_relevant, confidence_score))
+
+            if rephrase_task is None or rephrased_answer != (answer or ""):
+                start_rephrase(answer or "")
+            yield QAUpdate(
+                answer=answer,
+                quotes=quotes_dict,
+                is_docs_relevant=is_docs_relevant,
+                confidence_score=confidence_score,
+                rephrased_response=None,
+                stage_timings=dict(stage_timings),
+            )
+
+            rephrased_response = await rephrase_task  # type: ignore
+            stage_timings["total"] = time.perf_counter() - start_time
+            logger.info(
+                "QA stage timings: "
+                + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stage_timings.items())
+            )
+            yield QAUpdate(
+                answer=answer,
+                quotes=quotes_dict,
+                is_docs_relevant=is_docs_relevant,
+                confidence_score=confidence_score,
+                rephrased_response=rephrased_response,
+                stage_timings=dict(stage_timings),
+            )
+        finally:
+            for task in (qa_task, verify_task, rephrase_task):
+                if task is not None:
+                    task.cancel()
+
     @log_function_time()
     async def answer_question_stream(
         self,
@@ -312,10 +484,38 @@ class QA(QAModel):
         context_docs: List[InferenceChunk],
         prompt: PromptTemplate = None,
     ) -> AsyncIterable[str]:
+        answer_tracker = AnswerStreamTracker()
+        async for token in self._stream_model_output(query, context_docs, prompt):
+            found_answer_end = answer_tracker.found_answer_end
+            answer_token = answer_tracker.add(token)
+            if answer_token is not None:
+                yield get_json_line({"answer_data": answer_token})
+            elif answer_tracker.found_answer_end and not found_answer_end:
+                yield get_json_line({"answer_finished": True})
+
+        # Post-processing: Extract answer and quotes from the model output
+        answer, quotes_dict = process_answer(answer_tracker.model_output, context_docs)
+        if answer:
+            logger.info(answer)
+        else:
+            logger.warning("Answer extraction from model output failed, most likely no quotes provided")
+
+        if quotes_dict is None:
+            yield get_json_line({})
+        else:
+            yield get_json_line(quotes_dict)
+
+    async def _stream_model_output(
+        self,
+        query: str,
+        context_docs: List[InferenceChunk],
+        prompt: PromptTemplate = None,
+    ) -> AsyncIterator[str]:
+        """Tokens of the QA model output as they are generated, the model call is cancelled if the
+        iteration stops early"""
         callback = AsyncIteratorCallbackHandler()
         self.llm_streaming = get_llm(
             streaming=True,
-            callback_handler=[callback],
             model_timeout=self.model_timeout,
             temperature=QA_MODEL_SETTINGS["temperature"],
             max_output_tokens=int(QA_MODEL_SETTINGS["max_output_tokens"]),
@@ -323,6 +523,7 @@ class QA(QAModel):
         qa_system: BaseQA = self._pick_qa_chain(
             llm=self.llm_streaming,
             prompt=prompt,
+            callbacks=[callback],
         )
 
         async def wrap_done(fn: Awaitable, event: asyncio.Event):
@@ -339,41 +540,9 @@ class QA(QAModel):
         task = asyncio.create_task(
             wrap_done(qa_system.async_run(query, context_docs), callback.done),
         )
-
-        # Initialize variables
-        model_output: str = ""
-        found_answer_start = False
-        found_answer_end = False
-
-        # Iterate through the stream of tokens
-        async for token in callback.aiter():
-            # Accumulate model output
-            event_text = token
-            model_previous = model_output
-            model_output += event_text
-
-            # Check for answer boundaries
-            if not found_answer_start and '{"answer":"' in model_output.replace(" ", "").replace("\n", ""):
-                found_answer_start = True
-                continue
-
-            if found_answer_start and not found_answer_end:
-                if stream_answer_end(model_previous, event_text):
-                    found_answer_end = True
-                    yield get_json_line({"answer_finished": True})
-                    continue
-                yield get_json_line({"answer_data": event_text})
-
-        await task
-
-        # Post-processing: Extract answer and quotes from the model output
-        answer, quotes_dict = process_answer(model_output, context_docs)
-        if answer:
-            logger.info(answer)
-        else:
-            logger.warning("Answer extraction from model output failed, most likely no quotes provided")
-
-        if quotes_dict is None:
-            yield get_json_line({})
-        else:
-            yield get_json_line(quotes_dict)
+        try:
+            async for token in callback.aiter():
+                yield token
+            await task
+        finally:
+            task.cancel()
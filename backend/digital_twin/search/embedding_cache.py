@@ -0,0 +1,223 @@
+import abc
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from digital_twin.config.app_config import (
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_TYPE,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+)
+from digital_twin.utils.logging import setup_logger
+
+logger = setup_logger()
+
+_EMBEDDING_CACHE: "EmbeddingCache | None" = None
+# Set once the cache failed to open, so it isn't retried (and warned about) on every embedding call
+_EMBEDDING_CACHE_UNAVAILABLE = False
+_QUERY_EMBEDDING_CACHE: "LRUEmbeddingCache | None" = None
+
+
+def get_embedding_cache_key(model_name: str, text: str) -> str:
+    # Whitespace differences don't change what the text means, so they shouldn't cost an embedding call
+    normalized_text = " ".join(text.split())
+    return f"{model_name}:{hashlib.sha256(normalized_text.encode()).hexdigest()}"
+
+
+class EmbeddingCache(abc.ABC):
+    """Maps (embedding model name, normalized text) to the embedding of the text,
+    so identical texts are only ever sent to the embedding model once."""
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _get(self, keys: list[str]) -> dict[str, list[float]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _put(self, entries: dict[str, list[float]]) -> None:
+        raise NotImplementedError
+
+    def get_many(self, model_name: str, texts: list[str]) -> dict[int, list[float]]:
+        """Returns the cached embeddings keyed by the position of the text in the list"""
+        if not texts:
+            return {}
+        keys = [get_embedding_cache_key(model_name, text) for text in texts]
+        try:
+            cached = self._get(list(set(keys)))
+        except Exception as e:
+            # The cache is an optimization, never fail the embedding because of it
+            logger.warning(f"Failed to read from embedding cache due to {e}")
+            cached = {}
+        found = {text_ind: cached[key] for text_ind, key in enumerate(keys) if key in cached}
+        with self._counter_lock:
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, model_name: str, texts: list[str], embeddings: list[list[float]]) -> None:
+        entries = {get_embedding_cache_key(model_name, text): emb for text, emb in zip(texts, embeddings)}
+        try:
+            self._put(entries)
+        except Exception as e:
+            logger.warning(f"Failed to write to embedding cache due to {e}")
+
+    def get_hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class SqliteEmbeddingCache(EmbeddingCache):
+    """Embedding cache in a local SQLite file, shared by every process on the machine.
+    Once more than max_entries embeddings are stored, the least recently used ones are evicted."""
+
+    def __init__(
+        self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES
+    ) -> None:
+        super().__init__()
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Indexing pipeline stages embed from separate threads, sqlite3 calls are serialized by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._num_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _get(self, keys: list[str]) -> dict[str, list[float]]:
+        found: dict[str, list[float]] = {}
+        # Stay under SQLite's limit on the number of bound parameters
+        for start in range(0, len(keys), 500):
+            key_batch = keys[start : start + 500]
+            placeholders = ",".join("?" * len(key_batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})", key_batch
+                ).fetchall()
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [time.time(), *[row[0] for row in rows]],
+                    )
+            found.update({key: np.frombuffer(blob, dtype=np.float32).tolist() for key, blob in rows})
+        return found
+
+    def _put(self, entries: dict[str, list[float]]) -> None:
+        if not entries:
+            return
+        now = time.time()
+        rows = [(key, np.asarray(emb, dtype=np.float32).tobytes(), now) for key, emb in entries.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            # Only count the rows that weren't stored yet, another process may have just written the same keys
+            num_inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)", rows
+            ).rowcount
+            if num_inserted < len(rows):
+                self._conn.executemany(
+                    "UPDATE embeddings SET embedding = ?, last_used = ? WHERE key = ?",
+                    [(embedding, last_used, key) for key, embedding, last_used in rows],
+                )
+            self._conn.execute("COMMIT")
+            self._num_entries += num_inserted
+            if self._num_entries > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Evict down to 90% so we don't run an eviction on every write once the cache is full
+        num_to_keep = int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (num_to_keep,),
+        )
+        self._num_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.info(f"Evicted embeddings from cache, {self._num_entries} embeddings left")
+
+
+class LRUEmbeddingCache(EmbeddingCache):
+    """In-memory embedding cache of the process, entries expire after ttl_seconds and the least recently
+    used ones are evicted once max_entries is reached"""
+
+    def __init__(
+        self,
+        max_entries: int = QUERY_EMBEDDING_CACHE_SIZE,
+        ttl_seconds: float = QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+    ) -> None:
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Key to (expiry time, embedding), ordered from least to most recently used
+        self._entries: OrderedDict[str, tuple[float, list[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, keys: list[str]) -> dict[str, list[float]]:
+        found: dict[str, list[float]] = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires_at, embedding = entry
+                if expires_at < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = embedding
+        return found
+
+    def _put(self, entries: dict[str, list[float]]) -> None:
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for key, embedding in entries.items():
+                self._entries[key] = (expires_at, embedding)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def get_default_embedding_cache(cache_type: str = EMBEDDING_CACHE_TYPE) -> EmbeddingCache | None:
+    global _EMBEDDING_CACHE, _EMBEDDING_CACHE_UNAVAILABLE
+    if _EMBEDDING_CACHE is None:
+        if _EMBEDDING_CACHE_UNAVAILABLE:
+            return None
+        if cache_type == "sqlite":
+            try:
+                _EMBEDDING_CACHE = SqliteEmbeddingCache()
+            except (OSError, sqlite3.Error) as e:
+                # The cache is an optimization, embed without it rather than fail indexing and search
+                logger.warning(f"Failed to open embedding cache at {EMBEDDING_CACHE_PATH} due to {e}")
+                _EMBEDDING_CACHE_UNAVAILABLE = True
+                return None
+        elif cache_type == "none":
+            return None
+        else:
+            raise ValueError(f"Invalid embedding cache setting: {cache_type}")
+    return _EMBEDDING_CACHE
+
+
+def get_query_embedding_cache(max_entries: int = QUERY_EMBEDDING_CACHE_SIZE) -> LRUEmbeddingCache | None:
+    global _QUERY_EMBEDDING_CACHE
+    if max_entries <= 0:
+        return None
+    if _QUERY_EMBEDDING_CACHE is None:
+        _QUERY_EMBEDDING_CACHE = LRUEmbeddingCache(max_entries=max_entries)
+    return _QUERY_EMBEDDING_CACHE
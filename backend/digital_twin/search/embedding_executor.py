@@ -0,0 +1,163 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import tiktoken
+from langchain.embeddings.base import Embeddings
+from openai.error import RateLimitError
+
+from digital_twin.config.app_config import (
+    EMBEDDING_BATCH_MAX_TEXTS,
+    EMBEDDING_BATCH_MAX_TOKENS,
+    EMBEDDING_MAX_IN_FLIGHT_REQUESTS,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_TOKENS_PER_MINUTE,
+)
+from digital_twin.utils.logging import setup_logger
+
+logger = setup_logger()
+
+_TOKEN_ENCODERS: dict[str, tiktoken.Encoding] = {}
+_EMBEDDING_RATE_LIMITER: "TokenBucket | None" = None
+# id of an embedding model -> (the model, kept alive so its id isn't reused, its single attempt copy)
+_SINGLE_ATTEMPT_MODELS: dict[int, tuple[Embeddings, Embeddings]] = {}
+
+# Longest wait between two attempts of a rate limited request
+_MAX_BACKOFF_SECONDS = 60
+
+
+class TokenBucket:
+    """Tokens per minute budget shared by every embedding request of the process.
+    A rate limit response pauses all requests, not just the one that received it."""
+
+    def __init__(self, tokens_per_minute: int) -> None:
+        self.capacity = tokens_per_minute
+        self._tokens = float(tokens_per_minute)
+        self._refill_per_second = tokens_per_minute / 60
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, num_tokens: int) -> None:
+        # A request larger than the bucket would otherwise wait forever
+        num_tokens = min(num_tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._last_refill) * self._refill_per_second
+                )
+                self._last_refill = now
+                if now >= self._paused_until and self._tokens >= num_tokens:
+                    self._tokens -= num_tokens
+                    return
+                wait_seconds = max(
+                    self._paused_until - now, (num_tokens - self._tokens) / self._refill_per_second
+                )
+            time.sleep(wait_seconds)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            # Start from empty after the pause so the waiting requests don't all fire at once
+            self._tokens = 0
+
+
+def get_token_encoder(encoding_name: str = "cl100k_base") -> tiktoken.Encoding:
+    if encoding_name not in _TOKEN_ENCODERS:
+        _TOKEN_ENCODERS[encoding_name] = tiktoken.get_encoding(encoding_name)
+    return _TOKEN_ENCODERS[encoding_name]
+
+
+def get_embedding_rate_limiter() -> TokenBucket:
+    global _EMBEDDING_RATE_LIMITER
+    if _EMBEDDING_RATE_LIMITER is None:
+        _EMBEDDING_RATE_LIMITER = TokenBucket(EMBEDDING_TOKENS_PER_MINUTE)
+    return _EMBEDDING_RATE_LIMITER
+
+
+def get_single_attempt_model(embedding_model: Embeddings) -> Embeddings:
+    """Rate limits of the executor's requests are retried with the backoff shared by all of them, instead
+    of each request's own retry loop. The model itself keeps its retries for the query embeddings"""
+    if getattr(embedding_model, "max_retries", 1) <= 1:
+        return embedding_model
+    model_id = id(embedding_model)
+    if model_id not in _SINGLE_ATTEMPT_MODELS:
+        single_attempt_model = embedding_model.copy(update={"max_retries": 1})  # type: ignore
+        _SINGLE_ATTEMPT_MODELS[model_id] = (embedding_model, single_attempt_model)
+    return _SINGLE_ATTEMPT_MODELS[model_id][1]
+
+
+def get_token_batches(
+    token_counts: list[int],
+    max_batch_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+    max_batch_texts: int = EMBEDDING_BATCH_MAX_TEXTS,
+) -> list[list[int]]:
+    """Groups consecutive texts into batches of at most max_batch_tokens tokens, returns the text indices
+    of each batch. A text longer than max_batch_tokens gets a batch of its own."""
+    batches: list[list[int]] = []
+    current_batch: list[int] = []
+    current_tokens = 0
+    for text_ind, num_tokens in enumerate(token_counts):
+        if current_batch and (
+            current_tokens + num_tokens > max_batch_tokens or len(current_batch) >= max_batch_texts
+        ):
+            batches.append(current_batch)
+            current_batch, current_tokens = [], 0
+        current_batch.append(text_ind)
+        current_tokens += num_tokens
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+
+def embed_texts_concurrently(
+    texts: list[str],
+    embedding_model: Embeddings,
+    max_in_flight: int = EMBEDDING_MAX_IN_FLIGHT_REQUESTS,
+    max_batch_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+    max_batch_texts: int = EMBEDDING_BATCH_MAX_TEXTS,
+    rate_limiter: TokenBucket | None = None,
+    max_retries: int = EMBEDDING_MAX_RETRIES,
+) -> list[list[float]]:
+    """Embeds the texts with up to max_in_flight concurrent requests to the embedding API,
+    the embeddings are returned in the same order as the texts"""
+    if not texts:
+        return []
+    bucket = rate_limiter if rate_limiter is not None else get_embedding_rate_limiter()
+    embedding_model = get_single_attempt_model(embedding_model)
+
+    encoder = get_token_encoder()
+    token_counts = [len(encoder.encode(text, disallowed_special=())) for text in texts]
+    batches = get_token_batches(token_counts, max_batch_tokens, max_batch_texts)
+    embeddings: list[list[float] | None] = [None] * len(texts)
+
+    def embed_batch(text_inds: list[int]) -> None:
+        batch_texts = [texts[text_ind] for text_ind in text_inds]
+        batch_tokens = sum(token_counts[text_ind] for text_ind in text_inds)
+        for attempt in range(max_retries + 1):
+            bucket.acquire(batch_tokens)
+            try:
+                batch_embeddings = embedding_model.embed_documents(batch_texts)
+                break
+            except RateLimitError as e:
+                if attempt == max_retries:
+                    raise
+                backoff = min(_MAX_BACKOFF_SECONDS, 2**attempt) * (1 + random.random())
+                logger.warning(f"Embedding request rate limited, backing off for {backoff:.1f}s: {e}")
+                bucket.pause(backoff)
+        for text_ind, embedding in zip(text_inds, batch_embeddings):
+            embeddings[text_ind] = embedding
+
+    with ThreadPoolExecutor(max_workers=min(max_in_flight, len(batches))) as executor:
+        futures = [executor.submit(embed_batch, text_inds) for text_inds in batches]
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in not_done:
+            future.cancel()
+        for future in done:
+            # Raises the first failure, embeddings can't be partially returned
+            future.result()
+
+    logger.debug(f"Embedded {len(texts)} texts in {len(batches)} requests")
+    return embeddings  # type: ignore
@@ -1,27 +1,43 @@
 import asyncio
 import json
+from collections.abc import AsyncIterator
+from functools import partial
 from typing import List, Optional
 from uuid import UUID
 
-import cohere
 import numpy as np
-from cohere.responses.rerank import RerankResult
 from langchain.embeddings.base import Embeddings
 from sentence_transformers import SentenceTransformer
 
 from digital_twin.config.app_config import (
     BATCH_SIZE_ENCODE_CHUNKS,
-    COHERE_KEY,
     ENABLE_MINI_CHUNK,
+    KEYWORD_RRF_WEIGHT,
+    NUM_RERANK_CANDIDATES,
     NUM_RERANKED_RESULTS,
     NUM_RETURNED_HITS,
+    SEMANTIC_RRF_WEIGHT,
 )
 from digital_twin.indexdb.chunking.models import EmbeddedIndexChunk, IndexChunk, InferenceChunk
 from digital_twin.indexdb.interface import IndexDBFilter, KeywordIndex, VectorIndexDB
+from digital_twin.search.embedding_cache import (
+    EmbeddingCache,
+    get_default_embedding_cache,
+    get_query_embedding_cache,
+)
+from digital_twin.search.embedding_executor import embed_texts_concurrently
 from digital_twin.search.keyword_utils import keyword_search_query_processing
-from digital_twin.search.models import Embedder
+from digital_twin.search.local_embedding import LocalEmbeddings
+from digital_twin.search.models import Embedder, RetrievalUpdate
+from digital_twin.search.reranking import get_default_reranker
+from digital_twin.search.result_cache import (
+    async_get_collection_generations,
+    get_retrieval_cache_key,
+    get_retrieval_result_cache,
+)
 from digital_twin.search.utils import (
     get_default_embedding_model,
+    get_embedding_model_name,
     perform_reciprocal_rank_fusion,
     split_chunk_text_into_mini_chunks,
 )
@@ -43,18 +59,22 @@ def semantic_reranking(
     """
     Rerank the chunks based on the semantic similarity between the query and the chunks
     """
-    co = cohere.Client(COHERE_KEY)
-    _documents = [chunk.content for chunk in chunks]
+    return get_default_reranker().rerank(query, chunks, num_rerank)
 
-    results: List[RerankResult] = co.rerank(
-        query=query, documents=_documents, top_n=num_rerank, model="rerank-english-v2.0"
-    )
-    reranked_chunks = []
-    for r in results:
-        doc = chunks[r.index]
-        doc.score_info["rerank_score"] = r.relevance_score
-        reranked_chunks.append(doc)
-    return reranked_chunks
+
+@log_function_time()
+async def async_semantic_reranking(
+    query: str, chunks: list[InferenceChunk], num_rerank: int = NUM_RERANKED_RESULTS
+) -> list[InferenceChunk]:
+    return await get_default_reranker().async_rerank(query, chunks, num_rerank)
+
+
+def _get_unranked_chunks(
+    top_chunks: list[InferenceChunk], ranked_chunks: list[InferenceChunk]
+) -> list[InferenceChunk]:
+    # Candidates the reranker cut off are kept, in retrieval order, ahead of the chunks it never scored
+    ranked_chunk_ids = {id(chunk) for chunk in ranked_chunks}
+    return [chunk for chunk in top_chunks if id(chunk) not in ranked_chunk_ids]
 
 
 @log_function_time()
@@ -110,6 +130,7 @@ def retrieve_semantic_reranked_documents(
     vectordb: VectorIndexDB,
     num_hits: int = NUM_RETURNED_HITS,
     num_rerank: int = NUM_RERANKED_RESULTS,
+    num_candidates: int = NUM_RERANK_CANDIDATES,
 ) -> tuple[list[InferenceChunk] | None, list[InferenceChunk] | None] | None:
     """
     This is for semantic serach + reranking
@@ -122,7 +143,7 @@ def retrieve_semantic_reranked_documents(
         logger.warning(f"Semantic search returned no results with filters: {filters_log_msg}")
         return None
 
-    ranked_chunks = semantic_reranking(query, top_chunks[:num_rerank], num_rerank)
+    ranked_chunks = semantic_reranking(query, top_chunks[:num_candidates], num_rerank)
 
     top_docs = [
         ranked_chunk.source_links[0]
@@ -132,11 +153,45 @@ def retrieve_semantic_reranked_documents(
     files_log_msg = f"Top links from semantic search: {', '.join(top_docs)}"
     logger.info(files_log_msg)
 
-    return ranked_chunks, top_chunks[num_rerank:]
+    return ranked_chunks, _get_unranked_chunks(top_chunks, ranked_chunks)
 
 
 @log_function_time()
-async def async_retrieve_hybrid_reranked_documents(
+async def async_retrieve_semantic_documents(
+    query: str,
+    user_id: UUID | None,
+    filters: Optional[List[IndexDBFilter]],
+    vectordb: VectorIndexDB,
+    num_hits: int = NUM_RETURNED_HITS,
+) -> List[InferenceChunk] | None:
+    top_chunks = await vectordb.async_semantic_retrieval(query, user_id, filters, num_hits)
+    if not top_chunks:
+        filters_log_msg = json.dumps(filters, separators=(",", ":")).replace("\n", "")
+        logger.warning(f"Semantic search returned no results with filters: {filters_log_msg}")
+        return None
+    return top_chunks
+
+
+@log_function_time()
+async def async_retrieve_keyword_documents(
+    query: str,
+    user_id: UUID | None,
+    filters: list[IndexDBFilter] | None,
+    datastore: KeywordIndex,
+    num_hits: int = NUM_RETURNED_HITS,
+) -> list[InferenceChunk] | None:
+    edited_query = keyword_search_query_processing(query)
+    top_chunks = await datastore.async_keyword_search(edited_query, user_id, filters, num_hits)
+    if not top_chunks:
+        filters_log_msg = json.dumps(filters, separators=(",", ":")).replace("\n", "")
+        logger.warning(
+            f"Keyword search returned no results...\nfilters: {filters_log_msg}\nedited query: {edited_query}"
+        )
+        return None
+    return top_chunks
+
+
+async def async_stream_hybrid_reranked_documents(
     query: str,
     user_id: UUID | None,
     filters: Optional[List[IndexDBFilter]],
@@ -144,45 +199,59 @@ async def async_retrieve_hybrid_reranked_documents(
     keywordb: KeywordIndex,
     num_hits: int = NUM_RETURNED_HITS,
     num_rerank: int = NUM_RERANKED_RESULTS,
-) -> tuple[list[InferenceChunk] | None, list[InferenceChunk] | None]:
+    num_candidates: int = NUM_RERANK_CANDIDATES,
+    use_result_cache: bool = True,
+) -> AsyncIterator[RetrievalUpdate]:
     """
-    This is for hybrid (semantic serach + keyword) with reranking
-
-    :return: tuple of (re-ranked chunks, the rest of the top chunks)
+    Hybrid (semantic serach + keyword) with reranking, yielding results as they get better so they can be
+    shown before the whole retrieval is done. Whichever search answers first is yielded as is, the last
+    update is the fused and reranked result, flagged with is_final.
+    Results are cached until either collection is re-indexed, unless use_result_cache is False
     """
-    # Typesense and qdrant clients are not co-routines,
-    # they don't expose an async connection
-    # So, we will perform async by running them in separate threads.
-    loop = asyncio.get_event_loop()
-    edited_query = keyword_search_query_processing(query)
-    semantic_top_chunks_future = loop.run_in_executor(
-        None, retrieve_semantic_documents, query, user_id, filters, vectordb, num_hits
-    )
-    keyword_top_chunks_future = loop.run_in_executor(
-        None,
-        retrieve_keyword_documents,
-        edited_query,
-        user_id,
-        filters,
-        keywordb,
-        num_hits,
+    result_cache = get_retrieval_result_cache() if use_result_cache else None
+    generations: tuple[int, ...] | None = None
+    if result_cache is not None:
+        collections = [vectordb.collection, keywordb.collection]
+        cache_key = get_retrieval_cache_key(
+            query, collections, user_id, filters, num_hits, num_rerank, num_candidates
+        )
+        # Read before retrieving, so results of a retrieval that raced an index write are never served
+        generations = await async_get_collection_generations(collections)
+        cached_result = result_cache.get(cache_key, generations) if generations is not None else None
+        if cached_result is not None:
+            logger.info("Serving hybrid retrieval from the result cache")
+            yield RetrievalUpdate(*cached_result, is_final=True)
+            return
+
+    # Both searches go through the async clients of the stores, sharing their pooled connections
+    semantic_task = asyncio.create_task(
+        async_retrieve_semantic_documents(query, user_id, filters, vectordb, num_hits)
     )
-
-    semantic_top_chunks, keyword_top_chunks = await asyncio.gather(
-        semantic_top_chunks_future,
-        keyword_top_chunks_future,
+    keyword_task = asyncio.create_task(
+        async_retrieve_keyword_documents(query, user_id, filters, keywordb, num_hits)
     )
-    if not semantic_top_chunks and not keyword_top_chunks:
-        logger.warning("Both semantic_top_chunks and keyword_top_chunks are empty.")
-        return None, None
+    try:
+        done, pending = await asyncio.wait({semantic_task, keyword_task}, return_when=asyncio.FIRST_COMPLETED)
+        if pending:
+            first_top_chunks = done.pop().result()
+            if first_top_chunks:
+                yield RetrievalUpdate(
+                    first_top_chunks[:num_rerank], first_top_chunks[num_rerank:], is_final=False
+                )
+        semantic_top_chunks, keyword_top_chunks = await asyncio.gather(semantic_task, keyword_task)
+    finally:
+        # The consumer may stop iterating early, don't leave the searches running
+        semantic_task.cancel()
+        keyword_task.cancel()
 
     rrf_combined_chunks = perform_reciprocal_rank_fusion(
-        semantic_top_chunks, keyword_top_chunks, keyword_weight=0.3
+        [semantic_top_chunks, keyword_top_chunks], weights=[SEMANTIC_RRF_WEIGHT, KEYWORD_RRF_WEIGHT]
     )
     if rrf_combined_chunks is None:
         logger.warning("Both semantic_top_chunks and keyword_top_chunks are empty.")
-        return None, None
-    ranked_chunks = semantic_reranking(query, rrf_combined_chunks[:num_rerank], num_rerank)
+        yield RetrievalUpdate(None, None, is_final=True)
+        return
+    ranked_chunks = await async_semantic_reranking(query, rrf_combined_chunks[:num_candidates], num_rerank)
 
     top_docs = [
         ranked_chunk.source_links[0]
@@ -192,7 +261,115 @@ async def async_retrieve_hybrid_reranked_documents(
     files_log_msg = f"Top links from semantic search: {', '.join(top_docs)}"
     logger.info(files_log_msg)
 
-    return ranked_chunks, rrf_combined_chunks[len(ranked_chunks) :]
+    unranked_chunks = _get_unranked_chunks(rrf_combined_chunks, ranked_chunks)
+    if result_cache is not None and generations is not None:
+        result_cache.put(cache_key, generations, ranked_chunks, unranked_chunks)
+    yield RetrievalUpdate(ranked_chunks, unranked_chunks, is_final=True)
+
+
+@log_function_time()
+async def async_retrieve_hybrid_reranked_documents(
+    query: str,
+    user_id: UUID | None,
+    filters: Optional[List[IndexDBFilter]],
+    vectordb: VectorIndexDB,
+    keywordb: KeywordIndex,
+    num_hits: int = NUM_RETURNED_HITS,
+    num_rerank: int = NUM_RERANKED_RESULTS,
+    num_candidates: int = NUM_RERANK_CANDIDATES,
+    use_result_cache: bool = True,
+) -> tuple[list[InferenceChunk] | None, list[InferenceChunk] | None]:
+    """
+    This is for hybrid (semantic serach + keyword) with reranking
+    Results are cached until either collection is re-indexed, unless use_result_cache is False
+
+    :return: tuple of (re-ranked chunks, the rest of the top chunks)
+    """
+    async for update in async_stream_hybrid_reranked_documents(
+        query, user_id, filters, vectordb, keywordb, num_hits, num_rerank, num_candidates, use_result_cache
+    ):
+        if update.is_final:
+            return update.ranked_chunks, update.unranked_chunks
+    return None, None
+
+
+def _embed_texts(
+    texts: list[str], embedding_model: Embeddings | SentenceTransformer, batch_size: int
+) -> list[list[float]]:
+    embeddings: list[list[float]] = []
+    if isinstance(embedding_model, LocalEmbeddings):
+        # Batched by padded token count in-process, no rate limits to respect
+        embeddings = embedding_model.embed_documents(texts)
+    elif isinstance(embedding_model, Embeddings):
+        # API requests are batched by tokens instead of batch_size and sent concurrently
+        embeddings = embed_texts_concurrently(texts, embedding_model)
+    elif isinstance(embedding_model, SentenceTransformer):
+        text_batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+        embeddings_np: list[np.ndarray] = []
+        for text_batch in text_batches:
+            embeddings_np.extend(embedding_model.encode(text_batch))
+        embeddings = [embedding.tolist() for embedding in embeddings_np]
+    else:
+        raise ValueError(f"Unknown embedding model type: {type(embedding_model)}")
+    return embeddings
+
+
+def embed_query(
+    query: str,
+    embedding_model: Embeddings | SentenceTransformer | None = None,
+    embedding_cache: EmbeddingCache | None = None,
+    query_embedding_cache: EmbeddingCache | None = None,
+    use_query_embedding_cache: bool = True,
+) -> list[float]:
+    if embedding_model is None:
+        embedding_model = get_default_embedding_model()
+    if embedding_cache is None:
+        embedding_cache = get_default_embedding_cache()
+    if query_embedding_cache is None and use_query_embedding_cache:
+        query_embedding_cache = get_query_embedding_cache()
+
+    model_name = get_embedding_model_name(embedding_model)
+    # The in-memory cache avoids even the embedding cache lookup for queries repeated within the process
+    if query_embedding_cache is not None:
+        cached = query_embedding_cache.get_many(model_name, [query])
+        logger.debug(f"Query embedding cache hit rate: {query_embedding_cache.get_hit_rate():.2f}")
+        if cached:
+            return cached[0]
+
+    cached = embedding_cache.get_many(model_name, [query]) if embedding_cache is not None else {}
+    if cached:
+        query_embedding = cached[0]
+    else:
+        if isinstance(embedding_model, Embeddings):
+            query_embedding = embedding_model.embed_query(query)
+        else:
+            # TODO: make this part of the embedder interface
+            query_embedding = embedding_model.encode(query).tolist()
+
+        if embedding_cache is not None:
+            embedding_cache.put_many(model_name, [query], [query_embedding])
+
+    if query_embedding_cache is not None:
+        query_embedding_cache.put_many(model_name, [query], [query_embedding])
+    return query_embedding
+
+
+async def async_embed_query(query: str) -> list[float]:
+    """Queries repeated within the process are served from memory, anything else needs the embedding
+    model or the embedding cache, which are blocking, so it runs in the default executor"""
+    query_embedding_cache = get_query_embedding_cache()
+    if query_embedding_cache is None:
+        return await asyncio.get_running_loop().run_in_executor(None, embed_query, query)
+
+    model_name = get_embedding_model_name(get_default_embedding_model())
+    cached = query_embedding_cache.get_many(model_name, [query])
+    if cached:
+        return cached[0]
+    query_embedding = await asyncio.get_running_loop().run_in_executor(
+        None, partial(embed_query, query, use_query_embedding_cache=False)
+    )
+    query_embedding_cache.put_many(model_name, [query], [query_embedding])
+    return query_embedding
 
 
 @log_function_time()
@@ -201,10 +378,13 @@ def encode_chunks(
     embedding_model: Embeddings | None = None,
     batch_size: int = BATCH_SIZE_ENCODE_CHUNKS,
     enable_mini_chunk: bool = ENABLE_MINI_CHUNK,  # To Support Re-ranker model
+    embedding_cache: EmbeddingCache | None = None,
 ) -> list[EmbeddedIndexChunk]:
     embedded_chunks: list[EmbeddedIndexChunk] = []
     if embedding_model is None:
         embedding_model = get_default_embedding_model()
+    if embedding_cache is None:
+        embedding_cache = get_default_embedding_cache()
 
     chunk_texts = []
     chunk_mini_chunks_count = {}
@@ -214,18 +394,27 @@ def encode_chunks(
         chunk_texts.extend(mini_chunk_texts)
         chunk_mini_chunks_count[chunk_ind] = 1 + len(mini_chunk_texts)
 
-    text_batches = [chunk_texts[i : i + batch_size] for i in range(0, len(chunk_texts), batch_size)]
-    embeddings: list[list[float]] = []
-    if isinstance(embedding_model, Embeddings):
-        for text_batch in text_batches:
-            embeddings.extend(embedding_model.embed_documents(text_batch))
-    elif isinstance(embedding_model, SentenceTransformer):
-        embeddings_np: list[np.ndarray] = []
-        for text_batch in text_batches:
-            embeddings_np.extend(embedding_model.encode(text_batch))
-        embeddings = [embedding.tolist() for embedding in embeddings_np]
-    else:
-        raise ValueError(f"Unknown embedding model type: {type(embedding_model)}")
+    model_name = get_embedding_model_name(embedding_model)
+    cached_embeddings = embedding_cache.get_many(model_name, chunk_texts) if embedding_cache else {}
+
+    # Identical texts within the batch (boilerplate, duplicated files) are also only embedded once
+    texts_to_embed = list(
+        dict.fromkeys(text for text_ind, text in enumerate(chunk_texts) if text_ind not in cached_embeddings)
+    )
+    new_embeddings = dict(zip(texts_to_embed, _embed_texts(texts_to_embed, embedding_model, batch_size)))
+    if embedding_cache is not None and texts_to_embed:
+        embedding_cache.put_many(
+            model_name, texts_to_embed, [new_embeddings[text] for text in texts_to_embed]
+        )
+        logger.info(
+            f"Embedded {len(texts_to_embed)} texts, reused {len(cached_embeddings)} cached embeddings. "
+            f"Embedding cache hits: {embedding_cache.hits}, misses: {embedding_cache.misses}"
+        )
+
+    embeddings = [
+        cached_embeddings[text_ind] if text_ind in cached_embeddings else new_embeddings[text]
+        for text_ind, text in enumerate(chunk_texts)
+    ]
 
     embedding_ind_start = 0
     for chunk_ind, chunk in enumerate(chunks):
@@ -1,6 +1,4 @@
-import json
-from uuid import UUID
-
+import nltk  # type:ignore
 from nltk.corpus import stopwords  # type:ignore
 from nltk.stem import WordNetLemmatizer  # type:ignore
 from nltk.tokenize import word_tokenize  # type:ignore
@@ -9,20 +7,51 @@ from digital_twin.utils.logging import setup_logger
 
 logger = setup_logger()
 
+# Resource name to its path in the NLTK data directory, the Docker image downloads them at build time
+NLTK_RESOURCES = {
+    "stopwords": "corpora/stopwords",
+    "wordnet": "corpora/wordnet",
+    "punkt": "tokenizers/punkt",
+}
+
+_STOP_WORDS: frozenset[str] | None = None
+_LEMMATIZER: WordNetLemmatizer | None = None
+
+
+def ensure_nltk_resources() -> None:
+    """Downloads only the resources missing from the NLTK data path, outside of the Docker image
+    (e.g. local development) this goes to the network once and is a no-op afterwards"""
+    for resource, resource_path in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource_path)
+        except LookupError:
+            logger.info(f"NLTK resource {resource} not found, downloading it")
+            nltk.download(resource, quiet=True)
+
+
+def get_stop_words() -> frozenset[str]:
+    global _STOP_WORDS
+    if _STOP_WORDS is None:
+        _STOP_WORDS = frozenset(stopwords.words("english"))
+    return _STOP_WORDS
+
 
-def lemmatize_text(text: str) -> list[str]:
-    lemmatizer = WordNetLemmatizer()
-    word_tokens = word_tokenize(text)
-    return [lemmatizer.lemmatize(word) for word in word_tokens]
+def get_lemmatizer() -> WordNetLemmatizer:
+    global _LEMMATIZER
+    if _LEMMATIZER is None:
+        _LEMMATIZER = WordNetLemmatizer()
+    return _LEMMATIZER
 
 
-def remove_stop_words(text: str) -> list[str]:
-    stop_words = set(stopwords.words("english"))
-    word_tokens = word_tokenize(text)
-    return [word for word in word_tokens if word.casefold() not in stop_words]
+def warm_up_keyword_processing() -> None:
+    """WordNet and the punkt model are loaded on first use, this keeps that off the first query"""
+    keyword_search_query_processing("How were the documents indexed?")
 
 
 def keyword_search_query_processing(query: str) -> str:
-    query = " ".join(remove_stop_words(query))
-    query = " ".join(lemmatize_text(query))
-    return query
+    # Tokenized once, stop words are dropped and the remaining words lemmatized in the same pass
+    stop_words = get_stop_words()
+    lemmatizer = get_lemmatizer()
+    return " ".join(
+        lemmatizer.lemmatize(word) for word in word_tokenize(query) if word.casefold() not in stop_words
+    )
@@ -0,0 +1,137 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import torch
+from langchain.embeddings.base import Embeddings
+from transformers import AutoModel, AutoTokenizer
+
+from digital_twin.config.app_config import (
+    LOCAL_EMBEDDING_BATCH_MAX_TOKENS,
+    LOCAL_EMBEDDING_MAX_LENGTH,
+    LOCAL_EMBEDDING_MODEL,
+    LOCAL_EMBEDDING_MODEL_DIR,
+    LOCAL_EMBEDDING_QUANTIZE,
+    LOCAL_EMBEDDING_TOKENIZER_THREADS,
+    LOCAL_EMBEDDING_USE_ONNX,
+)
+from digital_twin.utils.logging import setup_logger
+
+logger = setup_logger()
+
+
+def _load_onnx_model(model_name: str, quantize: bool, model_dir: str) -> Any:
+    # Optional dependency, only needed for the ONNX Runtime backend
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    export_dir = os.path.join(model_dir, model_name.replace("/", "__"))
+    if not os.path.exists(os.path.join(export_dir, "model.onnx")):
+        logger.info(f"Exporting {model_name} to ONNX in {export_dir}")
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(export_dir)
+    if not quantize:
+        return ORTModelForFeatureExtraction.from_pretrained(export_dir)
+
+    quantized_dir = f"{export_dir}-int8"
+    if not os.path.exists(os.path.join(quantized_dir, "model_quantized.onnx")):
+        logger.info(f"Quantizing {model_name} to int8 in {quantized_dir}")
+        # Dynamic quantization, avx2 instructions are available on any commodity x86 CPU
+        ORTQuantizer.from_pretrained(export_dir).quantize(
+            save_dir=quantized_dir,
+            quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False),
+        )
+    return ORTModelForFeatureExtraction.from_pretrained(quantized_dir, file_name="model_quantized.onnx")
+
+
+def get_padded_batches(
+    lengths: list[int], batch_max_tokens: int = LOCAL_EMBEDDING_BATCH_MAX_TOKENS
+) -> list[list[int]]:
+    """Groups texts of similar token length so that little compute is spent on padding.
+    Each batch is padded to its longest text and holds at most batch_max_tokens tokens including padding.
+    Returns the text indices of each batch."""
+    batches: list[list[int]] = []
+    current_batch: list[int] = []
+    for text_ind in sorted(range(len(lengths)), key=lambda ind: lengths[ind]):
+        # Sorted ascending, so the text being added is the longest of its batch
+        if current_batch and (len(current_batch) + 1) * lengths[text_ind] > batch_max_tokens:
+            batches.append(current_batch)
+            current_batch = []
+        current_batch.append(text_ind)
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+
+class LocalEmbeddings(Embeddings):
+    """Sentence embedding model running in-process on CPU, mean pooled and normalized.
+    With ONNX enabled the model is exported and int8 quantized once, then loaded from model_dir."""
+
+    def __init__(
+        self,
+        model_name: str = LOCAL_EMBEDDING_MODEL,
+        use_onnx: bool = LOCAL_EMBEDDING_USE_ONNX,
+        quantize: bool = LOCAL_EMBEDDING_QUANTIZE,
+        model_dir: str = LOCAL_EMBEDDING_MODEL_DIR,
+        max_length: int = LOCAL_EMBEDDING_MAX_LENGTH,
+        batch_max_tokens: int = LOCAL_EMBEDDING_BATCH_MAX_TOKENS,
+        tokenizer_threads: int = LOCAL_EMBEDDING_TOKENIZER_THREADS,
+    ) -> None:
+        self.model_name = model_name
+        self.max_length = max_length
+        self.batch_max_tokens = batch_max_tokens
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self._tokenizer_pool = ThreadPoolExecutor(max_workers=tokenizer_threads)
+        self._num_tokenizer_threads = tokenizer_threads
+
+        runtime = "torch"
+        if use_onnx:
+            try:
+                self._model = _load_onnx_model(model_name, quantize, model_dir)
+                runtime = "onnx-int8" if quantize else "onnx"
+            except ImportError:
+                logger.warning(
+                    "optimum[onnxruntime] is not installed, running the local embedding model in torch"
+                )
+        if runtime == "torch":
+            self._model = AutoModel.from_pretrained(model_name).eval()
+
+        # Quantized weights give slightly different vectors, they must not share cached or stored embeddings
+        self.model = f"{model_name}/{runtime}"
+        self.dimension: int = self._model.config.hidden_size
+        logger.info(f"Loaded local embedding model {self.model} with dimension {self.dimension}")
+
+    def _tokenize(self, texts: list[str]) -> list[dict[str, list[int]]]:
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        return [{key: encoded[key][text_ind] for key in encoded.keys()} for text_ind in range(len(texts))]
+
+    @torch.inference_mode()
+    def _encode_batch(self, features: list[dict[str, list[int]]]) -> list[list[float]]:
+        inputs = self.tokenizer.pad(features, return_tensors="pt")
+        token_embeddings = self._model(**inputs).last_hidden_state
+        # Mean pooling over the real tokens only, padding positions are masked out
+        mask = inputs["attention_mask"].unsqueeze(-1).to(token_embeddings.dtype)
+        embeddings = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        return torch.nn.functional.normalize(embeddings, p=2, dim=1).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        # Fast tokenizers release the GIL, so tokenizing slices of the texts in threads runs in parallel
+        slice_size = -(-len(texts) // self._num_tokenizer_threads)
+        text_slices = [texts[i : i + slice_size] for i in range(0, len(texts), slice_size)]
+        features = [
+            text_features
+            for slice_features in self._tokenizer_pool.map(self._tokenize, text_slices)
+            for text_features in slice_features
+        ]
+
+        embeddings: list[list[float]] = [[] for _ in texts]
+        lengths = [len(text_features["input_ids"]) for text_features in features]
+        for batch in get_padded_batches(lengths, self.batch_max_tokens):
+            batch_embeddings = self._encode_batch([features[text_ind] for text_ind in batch])
+            for text_ind, embedding in zip(batch, batch_embeddings):
+                embeddings[text_ind] = embedding
+        return embeddings
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
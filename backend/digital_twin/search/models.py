@@ -1,6 +1,17 @@
-from digital_twin.indexdb.chunking.models import EmbeddedIndexChunk, IndexChunk
+from dataclasses import dataclass
+
+from digital_twin.indexdb.chunking.models import EmbeddedIndexChunk, IndexChunk, InferenceChunk
 
 
 class Embedder:
     def embed(self, chunks: list[IndexChunk]) -> list[EmbeddedIndexChunk]:
         raise NotImplementedError
+
+
+@dataclass
+class RetrievalUpdate:
+    """Results of a streaming retrieval so far, only the update with is_final set is fused and reranked"""
+
+    ranked_chunks: list[InferenceChunk] | None
+    unranked_chunks: list[InferenceChunk] | None
+    is_final: bool
@@ -0,0 +1,149 @@
+import abc
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cohere
+from sentence_transformers import CrossEncoder  # type: ignore
+
+from digital_twin.config.app_config import (
+    COHERE_KEY,
+    LOCAL_RERANK_BATCH_SIZE,
+    LOCAL_RERANK_CACHE_SIZE,
+    LOCAL_RERANK_MODEL,
+    LOCAL_RERANK_WORKERS,
+    RERANKER_BACKEND,
+)
+from digital_twin.indexdb.chunking.models import InferenceChunk
+from digital_twin.indexdb.utils import get_chunk_identifier
+from digital_twin.utils.logging import setup_logger
+
+logger = setup_logger()
+
+_RERANKER: "Reranker | None" = None
+
+# https://www.sbert.net/docs/pretrained-models/ce-msmarco.html
+CROSS_EMBED_CONTEXT_SIZE = 512
+
+
+def _apply_scores(chunks: list[InferenceChunk], scores: list[float], num_rerank: int) -> list[InferenceChunk]:
+    scored_chunks = sorted(zip(scores, range(len(chunks))), key=lambda item: item[0], reverse=True)
+    reranked_chunks = []
+    for score, chunk_ind in scored_chunks[:num_rerank]:
+        chunk = chunks[chunk_ind]
+        if chunk.score_info is None:
+            chunk.score_info = {}
+        chunk.score_info["rerank_score"] = score
+        reranked_chunks.append(chunk)
+    return reranked_chunks
+
+
+class Reranker(abc.ABC):
+    @abc.abstractmethod
+    def rerank(self, query: str, chunks: list[InferenceChunk], num_rerank: int) -> list[InferenceChunk]:
+        """Returns the num_rerank chunks most relevant to the query, most relevant first"""
+        raise NotImplementedError
+
+    async def async_rerank(
+        self, query: str, chunks: list[InferenceChunk], num_rerank: int
+    ) -> list[InferenceChunk]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.rerank, query, chunks, num_rerank)
+
+
+class CohereReranker(Reranker):
+    def __init__(self, api_key: str = COHERE_KEY, model: str = "rerank-english-v2.0") -> None:
+        self.model = model
+        # Kept for the lifetime of the process so their connections are reused across requests
+        self.client = cohere.Client(api_key)
+        self.async_client = cohere.AsyncClient(api_key)
+
+    def rerank(self, query: str, chunks: list[InferenceChunk], num_rerank: int) -> list[InferenceChunk]:
+        results = self.client.rerank(
+            query=query, documents=[chunk.content for chunk in chunks], top_n=num_rerank, model=self.model
+        )
+        return _apply_scores(
+            [chunks[result.index] for result in results],
+            [result.relevance_score for result in results],
+            num_rerank,
+        )
+
+    async def async_rerank(
+        self, query: str, chunks: list[InferenceChunk], num_rerank: int
+    ) -> list[InferenceChunk]:
+        results = await self.async_client.rerank(
+            query=query, documents=[chunk.content for chunk in chunks], top_n=num_rerank, model=self.model
+        )
+        return _apply_scores(
+            [chunks[result.index] for result in results],
+            [result.relevance_score for result in results],
+            num_rerank,
+        )
+
+
+class CrossEncoderReranker(Reranker):
+    """Scores query / chunk pairs with a cross-encoder on CPU. Pairs are split into batches scored in
+    parallel by a worker pool, torch releases the GIL during inference. Scores are cached per
+    (query, chunk) so re-asked questions only score the chunks they haven't seen yet."""
+
+    def __init__(
+        self,
+        model_name: str = LOCAL_RERANK_MODEL,
+        batch_size: int = LOCAL_RERANK_BATCH_SIZE,
+        num_workers: int = LOCAL_RERANK_WORKERS,
+        cache_size: int = LOCAL_RERANK_CACHE_SIZE,
+    ) -> None:
+        self.model = CrossEncoder(model_name, max_length=CROSS_EMBED_CONTEXT_SIZE)
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._pool = ThreadPoolExecutor(max_workers=num_workers)
+        self._score_cache: OrderedDict[tuple[str, str], float] = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _score(self, query: str, chunks: list[InferenceChunk]) -> list[float]:
+        keys = [(query, get_chunk_identifier(chunk)) for chunk in chunks]
+        with self._cache_lock:
+            cached_scores = {key: self._score_cache[key] for key in keys if key in self._score_cache}
+            for key in cached_scores:
+                self._score_cache.move_to_end(key)
+
+        to_score = [chunk_ind for chunk_ind, key in enumerate(keys) if key not in cached_scores]
+        if to_score:
+            batches = [to_score[i : i + self.batch_size] for i in range(0, len(to_score), self.batch_size)]
+            batch_scores = self._pool.map(
+                lambda batch: self.model.predict(
+                    [(query, chunks[chunk_ind].content) for chunk_ind in batch], batch_size=len(batch)
+                ),
+                batches,
+            )
+            new_scores = {
+                keys[chunk_ind]: float(score)
+                for batch, scores in zip(batches, batch_scores)
+                for chunk_ind, score in zip(batch, scores)
+            }
+            with self._cache_lock:
+                self._score_cache.update(new_scores)
+                while len(self._score_cache) > self.cache_size:
+                    self._score_cache.popitem(last=False)
+            cached_scores.update(new_scores)
+
+        return [cached_scores[key] for key in keys]
+
+    def rerank(self, query: str, chunks: list[InferenceChunk], num_rerank: int) -> list[InferenceChunk]:
+        return _apply_scores(chunks, self._score(query, chunks), num_rerank)
+
+    def warm_up(self) -> None:
+        warm_up_str = "Test stuff"
+        self.model.predict([(warm_up_str, warm_up_str)])
+
+
+def get_default_reranker() -> Reranker:
+    global _RERANKER
+    if _RERANKER is None:
+        if RERANKER_BACKEND == "cohere":
+            _RERANKER = CohereReranker()
+        elif RERANKER_BACKEND == "local":
+            _RERANKER = CrossEncoderReranker()
+        else:
+            raise ValueError(f"Invalid reranker backend: {RERANKER_BACKEND}")
+    return _RERANKER
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from uuid import UUID
+
+from digital_twin.config.app_config import RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL_SECONDS
+from digital_twin.indexdb.chunking.models import InferenceChunk
+from digital_twin.indexdb.interface import IndexDBFilter
+from digital_twin.utils.clients import get_async_redis_client, get_redis_client
+from digital_twin.utils.logging import setup_logger
+
+logger = setup_logger()
+
+_RETRIEVAL_RESULT_CACHE: "RetrievalResultCache | None" = None
+
+# Generations are kept in Redis so the indexing workers can invalidate the caches of every API process
+_GENERATION_KEY_PREFIX = "retrieval_generation"
+
+
+def _get_generation_key(collection: str) -> str:
+    return f"{_GENERATION_KEY_PREFIX}:{collection}"
+
+
+def bump_collection_generation(collection: str) -> None:
+    """Called after chunks are written to a collection, every cached result over it becomes stale"""
+    try:
+        get_redis_client().incr(_get_generation_key(collection))
+    except Exception as e:
+        # Cached results expire after RETRIEVAL_CACHE_TTL_SECONDS, the write itself did succeed
+        logger.error(f"Failed to bump retrieval generation of collection {collection} due to {e}")
+
+
+async def async_get_collection_generations(collections: list[str]) -> tuple[int, ...] | None:
+    """Current generation of each collection, None if they can't be read and the cache must be bypassed"""
+    try:
+        generations = await get_async_redis_client().mget(
+            [_get_generation_key(collection) for collection in collections]
+        )
+    except Exception as e:
+        logger.warning(f"Failed to read retrieval generations, bypassing the result cache due to {e}")
+        return None
+    # Collections that were never written to since Redis was set up have no counter yet
+    return tuple(int(generation) if generation is not None else 0 for generation in generations)
+
+
+def get_retrieval_cache_key(
+    query: str,
+    collections: list[str],
+    user_id: UUID | None,
+    filters: list[IndexDBFilter] | None,
+    *retrieval_params: int,
+) -> str:
+    # Casing and whitespace don't change what is retrieved for the question
+    normalized_query = " ".join(query.lower().split())
+    key_parts = [normalized_query, collections, str(user_id), filters, retrieval_params]
+    return hashlib.sha256(json.dumps(key_parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@dataclass
+class _CachedRetrieval:
+    generations: tuple[int, ...]
+    expires_at: float
+    ranked_chunks: list[InferenceChunk]
+    unranked_chunks: list[InferenceChunk]
+
+
+class RetrievalResultCache:
+    """In-memory cache of the final (reranked, unranked) chunks of a retrieval. An entry is only served
+    while the generations of its collections are the ones it was retrieved at"""
+
+    def __init__(
+        self, max_entries: int = RETRIEVAL_CACHE_SIZE, ttl_seconds: float = RETRIEVAL_CACHE_TTL_SECONDS
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, _CachedRetrieval] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, key: str, generations: tuple[int, ...]
+    ) -> tuple[list[InferenceChunk], list[InferenceChunk]] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.generations != generations or entry.expires_at < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Callers get their own lists, the chunks themselves are treated as read-only
+        return list(entry.ranked_chunks), list(entry.unranked_chunks)
+
+    def put(
+        self,
+        key: str,
+        generations: tuple[int, ...],
+        ranked_chunks: list[InferenceChunk],
+        unranked_chunks: list[InferenceChunk],
+    ) -> None:
+        entry = _CachedRetrieval(
+            generations=generations,
+            expires_at=time.monotonic() + self.ttl_seconds,
+            ranked_chunks=list(ranked_chunks),
+            unranked_chunks=list(unranked_chunks),
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def get_retrieval_result_cache(max_entries: int = RETRIEVAL_CACHE_SIZE) -> RetrievalResultCache | None:
+    global _RETRIEVAL_RESULT_CACHE
+    if max_entries <= 0:
+        return None
+    if _RETRIEVAL_RESULT_CACHE is None:
+        _RETRIEVAL_RESULT_CACHE = RetrievalResultCache(max_entries=max_entries)
+    return _RETRIEVAL_RESULT_CACHE
@@ -1,13 +1,21 @@
 from collections import defaultdict
-from typing import Dict, List, Optional, Union, cast
+from collections.abc import Sequence
+from typing import List, Optional, Union
 
+import numpy as np
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.embeddings.base import Embeddings
-from sentence_transformers import CrossEncoder  # type: ignore
 from sentence_transformers import SentenceTransformer
 
-from digital_twin.config.app_config import EMBEDDING_OPENAI_API_KEY, MINI_CHUNK_SIZE
+from digital_twin.config.app_config import (
+    DOC_EMBEDDING_DIM,
+    EMBEDDING_BACKEND,
+    EMBEDDING_OPENAI_API_KEY,
+    MINI_CHUNK_SIZE,
+)
 from digital_twin.indexdb.chunking.models import InferenceChunk
+from digital_twin.indexdb.utils import get_chunk_identifier
+from digital_twin.search.local_embedding import LocalEmbeddings
 
 _EMBED_MODEL: Optional[Embeddings | SentenceTransformer] = None
 
@@ -64,122 +72,102 @@ def get_default_embedding_model(**kwargs) -> Union[Embeddings, SentenceTransform
     """
     global _EMBED_MODEL
     if _EMBED_MODEL is None:
-        _EMBED_MODEL = OpenAIEmbeddings(openai_api_key=EMBEDDING_OPENAI_API_KEY)
+        if EMBEDDING_BACKEND == "openai":
+            _EMBED_MODEL = OpenAIEmbeddings(openai_api_key=EMBEDDING_OPENAI_API_KEY)
+        elif EMBEDDING_BACKEND == "local":
+            _EMBED_MODEL = LocalEmbeddings()
+        else:
+            raise ValueError(f"Invalid embedding backend: {EMBEDDING_BACKEND}")
     return _EMBED_MODEL
 
 
+def get_default_embedding_dim() -> int:
+    """Vector size of new collections, must match the embedding model that fills them"""
+    embedding_model = get_default_embedding_model()
+    if isinstance(embedding_model, LocalEmbeddings):
+        return embedding_model.dimension
+    if isinstance(embedding_model, SentenceTransformer):
+        return embedding_model.get_sentence_embedding_dimension()
+    return DOC_EMBEDDING_DIM
+
+
+def get_embedding_model_name(embedding_model: Embeddings | SentenceTransformer) -> str:
+    """Identifies the embedding model, embeddings from different models must never be mixed"""
+    model_name = getattr(embedding_model, "model", None) or getattr(embedding_model, "model_name", None)
+    if isinstance(embedding_model, SentenceTransformer) and not model_name:
+        model_name = str(embedding_model._first_module().auto_model.name_or_path)
+    return f"{type(embedding_model).__name__}/{model_name}"
+
+
+def _get_ranking_chunk_inds(
+    rankings: Sequence[Sequence[InferenceChunk] | None],
+) -> tuple[list[InferenceChunk], list[np.ndarray]]:
+    """Assigns each unique chunk a position, so fusion scores can be accumulated in a single array.
+    Returns the unique chunks and, for each ranking, the positions of its chunks"""
+    # Keyed on the identifier the chunk UUID is hashed from, same identity without hashing every candidate
+    chunk_inds: dict[str, int] = {}
+    unique_chunks: list[InferenceChunk] = []
+    ranking_chunk_inds: list[np.ndarray] = []
+    for ranking in rankings:
+        inds = np.empty(len(ranking) if ranking else 0, dtype=np.intp)
+        for rank, chunk in enumerate(ranking or []):
+            chunk_key = get_chunk_identifier(chunk)
+            chunk_ind = chunk_inds.get(chunk_key)
+            if chunk_ind is None:
+                chunk_ind = chunk_inds[chunk_key] = len(unique_chunks)
+                unique_chunks.append(chunk)
+            inds[rank] = chunk_ind
+        ranking_chunk_inds.append(inds)
+    return unique_chunks, ranking_chunk_inds
+
+
 def perform_reciprocal_rank_fusion(
-    semantic_top_chunks: Optional[List[InferenceChunk]],
-    keyword_top_chunks: Optional[List[InferenceChunk]],
-    keyword_weight: float,
+    rankings: Sequence[Sequence[InferenceChunk] | None],
+    weights: Sequence[float],
+    max_chunks_per_doc: int | None = None,
+    rank_offset: int = 1,
 ) -> Optional[List[InferenceChunk]]:
     """
-    Perform Reciprocal Rank Fusion on search results.
-    Note: if one of the search results is None or empty,
-             the other search results will be returned.
+    Perform weighted Reciprocal Rank Fusion over the results of any number of rankers.
+    A chunk found by several rankers gets the sum of its weight / (rank + rank_offset) from each of them,
+    chunks are identified like their chunk UUID so different chunks of the same document stay separate.
 
     Combining search results in a rank-aware manner is better than a simple list merge
     https://arxiv.org/pdf/2010.00200.pdf
     https://plg.uwaterloo.ca/~gvcormac/cormacksigir09-rrf.pdf
 
     Args:
-    semantic_top_chunks (List[InferenceChunk]): List of search results from the semantic search.
-    keyword_top_chunks (List[InferenceChunk]): List of search results from the keyword search.
-    keyword_weight (float): Weight given to the keyword search in the RRF calculation.
+    rankings: The results of each ranker, best first. Empty or None rankings contribute nothing.
+    weights: Weight of each ranker, in the same order as rankings.
+    max_chunks_per_doc: If set, keep at most this many of the top chunks of any single document.
+    rank_offset: Added to the 0-based rank before taking the reciprocal.
 
     Returns:
-    List[InferenceChunk]: List of top reranked search results.
+    List of the fused chunks, best first, or None if no ranker returned anything.
     """
-    if not semantic_top_chunks and not keyword_top_chunks:
-        raise ValueError("Both semantic_top_chunks and keyword_top_chunks cannot be None or empty.")
-    if not semantic_top_chunks:
-        return keyword_top_chunks
-    if not keyword_top_chunks:
-        return semantic_top_chunks
-
-    # Create lists of dicts with document data for RRF.
-    semantic_search_data = [
-        {"id": chunk.document_id, "rank": i, "chunk": chunk} for i, chunk in enumerate(semantic_top_chunks)
-    ]
-    keyword_search_data = [
-        {"id": chunk.document_id, "rank": i, "chunk": chunk} for i, chunk in enumerate(keyword_top_chunks)
-    ]
-
-    # Create mapping from id to chunk
-    id_to_chunk_map = {chunk.document_id: chunk for chunk in semantic_top_chunks + keyword_top_chunks}
-
-    # Perform the Reciprocal Rank Fusion
-    combined_ranks: Dict[str, float] = defaultdict(float)
-
-    # Update the RRF scores for documents in keyword_search_data
-    for item in semantic_search_data:
-        sem_chunk = cast(str, item["id"])
-        sem_rank = cast(int, item["rank"])
-        combined_ranks[sem_chunk] += keyword_weight / (sem_rank + 1)
-
-    # Update the RRF scores for documents in semantic_search_data
-    for item in keyword_search_data:
-        key_chunk = cast(str, item["id"])
-        key_rank = cast(int, item["rank"])
-        combined_ranks[key_chunk] += (1 - keyword_weight) / (key_rank + 1)
-
-    # Sort the combined ranks in descending order
-    combined_ranks_sorted = sorted(combined_ranks.items(), key=lambda item: item[1], reverse=True)
-
-    # Extract the top 'num_rerank' documents
-    top_reranked_chunks = [id_to_chunk_map[item[0]] for item in combined_ranks_sorted]
-
-    return top_reranked_chunks
-
-
-"""" Local Model Experiment, really bad compared to Cohere
-from digital_twin.utils.timing import log_function_time
-from digital_twin.utils.logging import setup_logger
-
-logger = setup_logger()
-_RERANK_MODELS: None | list[CrossEncoder] = None
-
-# https://www.sbert.net/docs/pretrained-models/ce-msmarco.html
-CROSS_ENCODER_MODEL_ENSEMBLE = [
-    "cross-encoder/ms-marco-MiniLM-L-4-v2",
-    "cross-encoder/ms-marco-TinyBERT-L-2-v2",
-]
-
-CROSS_EMBED_CONTEXT_SIZE = 512
-
-def get_default_reranking_model_ensemble() -> list[CrossEncoder]:
-    global _RERANK_MODELS
-    if _RERANK_MODELS is None:
-        _RERANK_MODELS = [
-            CrossEncoder(model_name) for model_name in CROSS_ENCODER_MODEL_ENSEMBLE
-        ]
-        for model in _RERANK_MODELS:
-            model.max_length = CROSS_EMBED_CONTEXT_SIZE
-    return _RERANK_MODELS
-
-
-
-@log_function_time()
-def local_model_test_reranking( 
-    query: str,
-    chunks: list[InferenceChunk],
-) -> list[InferenceChunk]:
-    cross_encoders = get_default_reranking_model_ensemble()
-    sim_scores = sum([encoder.predict([(query, chunk['content']) for chunk in chunks]) for encoder in cross_encoders])  # type: ignore
-    scored_results = list(zip(sim_scores, chunks))
-    scored_results.sort(key=lambda x: x[0], reverse=True)
-    ranked_sim_scores, ranked_chunks = zip(*scored_results)
-    print(f"Reranked similarity scores: {str(ranked_sim_scores)}")
-    logger.debug(f"Reranked similarity scores: {str(ranked_sim_scores)}")
-
-    return ranked_chunks
-
-
-def warm_up_models() -> None:
-    warm_up_str = "Test stuff"
-    cross_encoders = get_default_reranking_model_ensemble()
-    [
-        cross_encoder.predict((warm_up_str, warm_up_str))
-        for cross_encoder in cross_encoders
-    ]
-"""
+    if len(rankings) != len(weights):
+        raise ValueError("Reciprocal rank fusion needs exactly one weight per ranking.")
+
+    unique_chunks, ranking_chunk_inds = _get_ranking_chunk_inds(rankings)
+
+    if not unique_chunks:
+        return None
+
+    scores = np.zeros(len(unique_chunks))
+    for inds, weight in zip(ranking_chunk_inds, weights):
+        # add.at accumulates correctly if a ranker returned the same chunk twice
+        np.add.at(scores, inds, weight / (np.arange(len(inds)) + rank_offset))
+
+    # Stable, so ties keep the order in which the rankers surfaced the chunks
+    fused_order = np.argsort(-scores, kind="stable")
+    if max_chunks_per_doc is None:
+        return [unique_chunks[chunk_ind] for chunk_ind in fused_order]
+
+    fused_chunks: list[InferenceChunk] = []
+    doc_chunk_counts: dict[str, int] = defaultdict(int)
+    for chunk_ind in fused_order:
+        chunk = unique_chunks[chunk_ind]
+        if doc_chunk_counts[chunk.document_id] < max_chunks_per_doc:
+            doc_chunk_counts[chunk.document_id] += 1
+            fused_chunks.append(chunk)
+    return fused_chunks
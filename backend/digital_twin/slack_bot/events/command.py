@@ -20,7 +20,7 @@ from digital_twin.db.user import (
 from digital_twin.indexdb.qdrant.store import QdrantVectorDB
 from digital_twin.indexdb.typesense.store import TypesenseIndex
 from digital_twin.qa import async_get_default_backend_qa_model
-from digital_twin.search.interface import async_retrieve_hybrid_reranked_documents
+from digital_twin.search.interface import async_stream_hybrid_reranked_documents
 from digital_twin.search.utils import chunks_to_search_docs
 from digital_twin.slack_bot.personality import async_handle_user_conversation_style, async_rephrase_response
 from digital_twin.slack_bot.utils import retrieve_sorted_past_messages, view_update_with_appropriate_token
@@ -92,13 +92,42 @@ async def qa_and_response(
     is_using_default_conversation_style = False
     if len(slack_chat_pairs) < MIN_CHAT_PAIRS_THRESHOLD:
         is_using_default_conversation_style = True
-    ranked_chunks, _ = await async_retrieve_hybrid_reranked_documents(
+    # Sources of the first search to answer are shown right away, then replaced by the reranked ones
+    ranked_chunks = None
+    partial_view_update: asyncio.Task | None = None
+    keywordb = TypesenseIndex(collection=typesense_collection_name)
+    async for retrieval_update in async_stream_hybrid_reranked_documents(
         query=query,
         user_id=None,  # This mean it'll retrieve all public docs (which only that now)
         filters=None,
-        vectordb=QdrantVectorDB(collection=qdrant_collection_name),
-        keywordb=TypesenseIndex(collection=typesense_collection_name),
-    )
+        # Chunks indexed with slim Qdrant payloads get their contents from Typesense
+        vectordb=QdrantVectorDB(collection=qdrant_collection_name, content_index=keywordb),
+        keywordb=keywordb,
+    ):
+        if retrieval_update.is_final:
+            ranked_chunks = retrieval_update.ranked_chunks
+            break
+        partial_search_docs = chunks_to_search_docs(retrieval_update.ranked_chunks)
+        if not partial_search_docs:
+            continue
+        partial_view = create_response_command_view(
+            private_metadata_str=json.dumps({"response": "Refining the most relevant sources..."}),
+            is_using_default_conversation_style=is_using_default_conversation_style,
+            is_rephrasing_stage=False,
+            search_docs=partial_search_docs,
+        )
+        # Not awaited so fusion and reranking go on while Slack renders the view
+        partial_view_update = asyncio.create_task(
+            view_update_with_appropriate_token(
+                client=client, view=partial_view, view_id=view_id, view_slack_token=view_slack_token
+            )
+        )
+    if partial_view_update is not None:
+        # Let it land before the final view so it can't overwrite it
+        try:
+            await partial_view_update
+        except Exception as e:
+            logger.warning(f"Failed to show partial search results due to {e}")
 
     search_docs = chunks_to_search_docs(ranked_chunks)
     if len(search_docs) == 0:
@@ -128,72 +157,51 @@ async def qa_and_response(
     )
 
     qa_model = await async_get_default_backend_qa_model(model_timeout=10)
-    (
-        qa_response,
-        sources,
-        is_docs_revelant,
-        confidence_score,
-    ) = await qa_model.async_answer_question_and_verify(
+    # The answer is shown as soon as it is verified, the rephrased one once it's ready. The rephrasing
+    # starts while the model is still writing the quotes
+    async for qa_update in qa_model.async_stream_answer_verify_and_rephrase(
         query,
         context_docs=ranked_chunks if ranked_chunks else [],
-    )
-
-    processed_response = format_openai_to_slack(qa_response if qa_response else "")
-    private_metadata_str = json.dumps(
-        {
-            "response": processed_response,
-            "channel_id": channel_id,
-            "channel_type": channel_type,
-            "slack_user_token": slack_user_token,
-            "view_slack_token": view_slack_token,
-            "conversation_style": conversation_style,
-            "is_docs_revelant": is_docs_revelant,
-            "confidence_score": confidence_score,
-        }
-    )
-    response_view = create_response_command_view(
-        private_metadata_str=private_metadata_str,
-        is_using_default_conversation_style=is_using_default_conversation_style,
-        is_rephrasing_stage=True,
-        is_rephrase_answer_available=False,
-        search_docs=search_docs,
-    )
-    await view_update_with_appropriate_token(
-        client=client, view=response_view, view_id=view_id, view_slack_token=view_slack_token
-    )
-
-    rephrased_response = await async_rephrase_response(
-        conversation_style=conversation_style,
-        query=query,
-        slack_user_id=slack_user_id,
-        qa_response=qa_response if qa_response else "",
-        chat_pairs=slack_chat_pairs,
-    )
-    private_metadata_str = json.dumps(
-        {
+        rephrase=lambda qa_response: async_rephrase_response(
+            conversation_style=conversation_style,
+            query=query,
+            slack_user_id=slack_user_id,
+            qa_response=qa_response,
+            chat_pairs=slack_chat_pairs,
+        ),
+        # Answers are cached until either collection is re-indexed
+        collections=[qdrant_collection_name, typesense_collection_name],
+    ):
+        processed_response = format_openai_to_slack(qa_update.answer if qa_update.answer else "")
+        metadata = {
             "response": processed_response,
-            "rephrased_response": rephrased_response,
             "channel_id": channel_id,
             "channel_type": channel_type,
             "slack_user_token": slack_user_token,
             "view_slack_token": view_slack_token,
             "conversation_style": conversation_style,
-            "is_docs_revelant": is_docs_revelant,
-            "confidence_score": confidence_score,
-            "is_using_default_conversation_style": is_using_default_conversation_style,
-            "ts": thread_ts if thread_ts else ts,
+            "is_docs_revelant": qa_update.is_docs_relevant,
+            "confidence_score": qa_update.confidence_score,
         }
-    )
-    response_view = create_response_command_view(
-        private_metadata_str=private_metadata_str,
-        is_using_default_conversation_style=is_using_default_conversation_style,
-        is_rephrasing_stage=True,
-        is_rephrase_answer_available=True,
-        search_docs=search_docs,
-    )
-    await view_update_with_appropriate_token(
-        client=client, view=response_view, view_id=view_id, view_slack_token=view_slack_token
-    )
+        is_rephrase_answer_available = qa_update.rephrased_response is not None
+        if is_rephrase_answer_available:
+            metadata.update(
+                {
+                    "rephrased_response": qa_update.rephrased_response,
+                    "is_using_default_conversation_style": is_using_default_conversation_style,
+                    "ts": thread_ts if thread_ts else ts,
+                }
+            )
+        response_view = create_response_command_view(
+            private_metadata_str=json.dumps(metadata),
+            is_using_default_conversation_style=is_using_default_conversation_style,
+            is_rephrasing_stage=True,
+            is_rephrase_answer_available=is_rephrase_answer_available,
+            search_docs=search_docs,
+        )
+        await view_update_with_appropriate_token(
+            client=client, view=response_view, view_id=view_id, view_slack_token=view_slack_token
+        )
     return
 
 
@@ -1,12 +1,25 @@
+from urllib.parse import urlparse
+
+import aiohttp
+import httpx
+import redis
 import typesense  # type: ignore
 from qdrant_client import QdrantClient
+from qdrant_client.http import AsyncApis
+from redis import asyncio as aioredis
 from supabase import Client, create_client
 
 from digital_twin.config.app_config import (
+    INDEX_ASYNC_CLIENT_MAX_CONNECTIONS,
+    INDEX_ASYNC_CLIENT_TIMEOUT_SECONDS,
+    LLM_ASYNC_CLIENT_MAX_CONNECTIONS,
     QDRANT_API_KEY,
     QDRANT_HOST,
     QDRANT_PORT,
     QDRANT_URL,
+    REDIS_HOST,
+    REDIS_PASSWORD,
+    REDIS_PORT,
     SUPABASE_SERVICE_ROLE_KEY,
     SUPABASE_URL,
     TYPESENSE_API_KEY,
@@ -18,6 +31,13 @@ from digital_twin.config.app_config import (
 _qdrant_client: QdrantClient | None = None
 _typesense_client: typesense.Client | None = None
 _supabase_client: Client | None = None
+_async_qdrant_client: AsyncApis | None = None
+# AsyncApis builds its own httpx client, the pooled connections are held by the transport passed to it
+_async_qdrant_transport: httpx.AsyncHTTPTransport | None = None
+_async_typesense_client: httpx.AsyncClient | None = None
+_redis_client: redis.Redis | None = None
+_async_redis_client: aioredis.Redis | None = None
+_async_llm_session: aiohttp.ClientSession | None = None
 
 
 def get_qdrant_client() -> QdrantClient:
@@ -55,6 +75,104 @@ def get_typesense_client() -> typesense.Client:
     return _typesense_client
 
 
+def _get_async_client_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=INDEX_ASYNC_CLIENT_MAX_CONNECTIONS,
+        max_keepalive_connections=INDEX_ASYNC_CLIENT_MAX_CONNECTIONS,
+    )
+
+
+def get_async_qdrant_client() -> AsyncApis:
+    """Async REST client over a pooled httpx connection, shared by all requests of the event loop"""
+    global _async_qdrant_client, _async_qdrant_transport
+    if _async_qdrant_client is None:
+        headers = {}
+        if QDRANT_URL and QDRANT_API_KEY:
+            parsed_url = urlparse(QDRANT_URL)
+            # Same default port as QdrantClient
+            rest_uri = f"{parsed_url.scheme}://{parsed_url.hostname}:{parsed_url.port or QDRANT_PORT}"
+            headers["api-key"] = QDRANT_API_KEY
+        elif QDRANT_HOST and QDRANT_PORT:
+            rest_uri = f"http://{QDRANT_HOST}:{QDRANT_PORT}"
+        else:
+            raise Exception("Unable to instantiate async QdrantClient")
+        _async_qdrant_transport = httpx.AsyncHTTPTransport(limits=_get_async_client_limits())
+        _async_qdrant_client = AsyncApis(
+            host=rest_uri,
+            headers=headers,
+            transport=_async_qdrant_transport,
+            timeout=INDEX_ASYNC_CLIENT_TIMEOUT_SECONDS,
+        )
+
+    return _async_qdrant_client
+
+
+def get_async_typesense_client() -> httpx.AsyncClient:
+    """The typesense package is synchronous, async requests go straight to the Typesense HTTP API"""
+    global _async_typesense_client
+    if _async_typesense_client is None:
+        if TYPESENSE_HOST and TYPESENSE_PORT and TYPESENSE_API_KEY and TYPESENSE_PROTOCOL:
+            _async_typesense_client = httpx.AsyncClient(
+                base_url=f"{TYPESENSE_PROTOCOL}://{TYPESENSE_HOST}:{TYPESENSE_PORT}",
+                headers={"X-TYPESENSE-API-KEY": TYPESENSE_API_KEY},
+                limits=_get_async_client_limits(),
+                timeout=INDEX_ASYNC_CLIENT_TIMEOUT_SECONDS,
+            )
+        else:
+            raise Exception("Unable to instantiate async TypesenseClient")
+
+    return _async_typesense_client
+
+
+def get_redis_client() -> redis.Redis:
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(host=REDIS_HOST, port=int(REDIS_PORT), password=REDIS_PASSWORD, ssl=True)
+
+    return _redis_client
+
+
+def get_async_redis_client() -> aioredis.Redis:
+    """Pooled async Redis client, unlike the Slack installation store which connects per call"""
+    global _async_redis_client
+    if _async_redis_client is None:
+        _async_redis_client = aioredis.Redis(
+            host=REDIS_HOST, port=int(REDIS_PORT), password=REDIS_PASSWORD, ssl=True
+        )
+
+    return _async_redis_client
+
+
+def get_async_llm_session() -> aiohttp.ClientSession:
+    """Pooled aiohttp session for the async OpenAI requests, the openai package otherwise opens a new
+    session (and TLS connection) per request. Must be first called from the event loop"""
+    global _async_llm_session
+    if _async_llm_session is None or _async_llm_session.closed:
+        _async_llm_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=LLM_ASYNC_CLIENT_MAX_CONNECTIONS)
+        )
+
+    return _async_llm_session
+
+
+async def close_async_clients() -> None:
+    global _async_qdrant_client, _async_qdrant_transport, _async_typesense_client, _async_redis_client
+    global _async_llm_session
+    if _async_qdrant_transport is not None:
+        await _async_qdrant_transport.aclose()
+        _async_qdrant_client = None
+        _async_qdrant_transport = None
+    if _async_typesense_client is not None:
+        await _async_typesense_client.aclose()
+        _async_typesense_client = None
+    if _async_redis_client is not None:
+        await _async_redis_client.close()
+        _async_redis_client = None
+    if _async_llm_session is not None:
+        await _async_llm_session.close()
+        _async_llm_session = None
+
+
 # We need this for our S3-like stuff
 # TODO: We'll deprecate this completely once we move to AWS
 def get_supabase_client() -> Client:
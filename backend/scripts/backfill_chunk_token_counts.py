@@ -0,0 +1,130 @@
+"""Checks and backfills the token counts stored with the chunks of every Qdrant and Typesense collection.
+
+Chunks indexed before the counts were stored have none, and the counts of a collection go stale when the
+QA model switches to another tokenizer. The prompts then fall back to tokenizing those chunks per request.
+Each chunk content is counted again with the tokenizer of the configured QA model (DEFAULT_LLM) and
+compared with the stored count, only the missing or stale ones are written. Slim payload Qdrant points
+have no content, their counts are read from Typesense.
+
+Run from the backend directory: python scripts/backfill_chunk_token_counts.py [--check]
+With --check nothing is written and the exit code is 1 if any count is missing or stale.
+"""
+import argparse
+import sys
+from typing import Any
+
+from digital_twin.config.constants import CONTENT, NUM_TOKENS, TOKENIZER
+from digital_twin.indexdb.qdrant.indexing import list_qdrant_collections
+from digital_twin.indexdb.utils import get_chunk_token_count_fields
+from digital_twin.llm.interface import get_selected_model_type
+from digital_twin.utils.clients import get_qdrant_client, get_typesense_client
+
+BATCH_SIZE = 250
+
+
+class ConsistencyReport:
+    def __init__(self) -> None:
+        self.num_checked = 0
+        self.num_missing = 0
+        self.num_stale = 0
+
+    def add(self, payload: dict[str, Any], expected_fields: dict[str, Any]) -> bool:
+        """Returns whether the stored count needs to be (re)written"""
+        self.num_checked += 1
+        if payload.get(NUM_TOKENS) is None:
+            self.num_missing += 1
+            return True
+        if any(payload.get(key) != value for key, value in expected_fields.items()):
+            self.num_stale += 1
+            return True
+        return False
+
+    @property
+    def is_consistent(self) -> bool:
+        return self.num_missing == 0 and self.num_stale == 0
+
+    def __str__(self) -> str:
+        return f"{self.num_checked} checked, {self.num_missing} missing, {self.num_stale} stale"
+
+
+def backfill_qdrant_collection(collection: str, check_only: bool) -> ConsistencyReport:
+    client = get_qdrant_client()
+    report = ConsistencyReport()
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection,
+            limit=BATCH_SIZE,
+            offset=offset,
+            with_payload=[CONTENT, NUM_TOKENS, TOKENIZER],
+            with_vectors=False,
+        )
+        points = [point for point in points if point.payload and CONTENT in point.payload]
+        expected = get_chunk_token_count_fields([point.payload[CONTENT] for point in points])  # type: ignore
+        # The mini chunk points of a chunk share its payload, points with the same count are set together
+        point_ids_by_count: dict[int, list[str]] = {}
+        for point, expected_fields in zip(points, expected):
+            if report.add(point.payload, expected_fields):  # type: ignore
+                point_ids_by_count.setdefault(expected_fields[NUM_TOKENS], []).append(str(point.id))
+
+        if not check_only:
+            for num_tokens, point_ids in point_ids_by_count.items():
+                client.set_payload(
+                    collection_name=collection,
+                    payload={NUM_TOKENS: num_tokens, TOKENIZER: expected[0][TOKENIZER]},
+                    points=point_ids,
+                )
+        if offset is None:
+            return report
+
+
+def backfill_typesense_collection(collection: str, check_only: bool) -> ConsistencyReport:
+    documents_client = get_typesense_client().collections[collection].documents
+    report = ConsistencyReport()
+    page = 1
+    while True:
+        results = documents_client.search(
+            {
+                "q": "*",
+                "include_fields": f"id,{CONTENT},{NUM_TOKENS},{TOKENIZER}",
+                "per_page": BATCH_SIZE,
+                "page": page,
+            }
+        )
+        documents = [hit["document"] for hit in results["hits"]]
+        expected = get_chunk_token_count_fields([document[CONTENT] for document in documents])
+        updates = [
+            {"id": document["id"], **expected_fields}
+            for document, expected_fields in zip(documents, expected)
+            if report.add(document, expected_fields)
+        ]
+        if updates and not check_only:
+            documents_client.import_(updates, {"action": "update"})
+        if len(documents) < BATCH_SIZE:
+            return report
+        page += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and backfill the token counts of indexed chunks.")
+    parser.add_argument("--check", action="store_true", help="Only report missing or stale counts")
+    args = parser.parse_args()
+
+    tokenizer = get_selected_model_type().tokenizer
+    if tokenizer is None:
+        print(f"{get_selected_model_type().name} has no tiktoken tokenizer, no token counts are stored")
+        sys.exit(0)
+    print(f"Token counts of the {tokenizer} tokenizer")
+
+    is_consistent = True
+    for qdrant_collection in list_qdrant_collections().collections:
+        report = backfill_qdrant_collection(qdrant_collection.name, args.check)
+        is_consistent &= report.is_consistent
+        print(f"Qdrant collection {qdrant_collection.name}: {report}")
+    for typesense_collection in get_typesense_client().collections.retrieve():
+        report = backfill_typesense_collection(typesense_collection["name"], args.check)
+        is_consistent &= report.is_consistent
+        print(f"Typesense collection {typesense_collection['name']}: {report}")
+
+    if args.check and not is_consistent:
+        sys.exit(1)
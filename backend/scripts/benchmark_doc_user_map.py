@@ -0,0 +1,75 @@
+"""Microbenchmark for the ACL bookkeeping done on every indexing batch.
+
+Builds batches of 10k chunks, from many short documents and from a few very long PDF-like documents,
+and times get_doc_user_map against a whitelist lookup that doesn't touch the network.
+Fails if the bookkeeping takes longer than the budget, the cost should grow with the number of
+chunks only, not chunks x documents.
+
+Run from the backend directory: python scripts/benchmark_doc_user_map.py
+"""
+import time
+
+from digital_twin.config.constants import DocumentSource
+from digital_twin.connectors.model import Document, Section
+from digital_twin.indexdb.chunking.models import IndexChunk
+from digital_twin.indexdb.utils import get_doc_user_map, get_uuid_from_chunk
+
+NUM_CHUNKS = 10_000
+NUM_RUNS = 5
+# Generous for slow machines, the old per-chunk deepcopy took ~60s on the many documents batch
+BUDGET_SECONDS = 0.5
+
+
+def build_chunks(num_docs: int, num_chunks: int = NUM_CHUNKS) -> list[IndexChunk]:
+    chunks_per_doc = num_chunks // num_docs
+    chunks = []
+    for doc_ind in range(num_docs):
+        document = Document(
+            id=f"https://example.com/doc/{doc_ind}",
+            sections=[Section(link=f"https://example.com/doc/{doc_ind}", text="text")],
+            source=DocumentSource.WEB,
+            semantic_identifier=f"Document {doc_ind}",
+            metadata={},
+        )
+        for chunk_id in range(chunks_per_doc):
+            chunks.append(
+                IndexChunk(
+                    chunk_id=chunk_id,
+                    blurb="blurb",
+                    content="content",
+                    source_links={0: document.id},
+                    section_continuation=False,
+                    source_document=document,
+                )
+            )
+    return chunks
+
+
+def benchmark(name: str, chunks: list[IndexChunk]) -> float:
+    # Every other document already exists in the document store
+    existing: dict[str, tuple[list[str], list[str]]] = {
+        str(get_uuid_from_chunk(chunk)): (["existing_user"], [])
+        for chunk in chunks
+        if chunk.chunk_id == 0 and int(chunk.source_document.id.rsplit("/", 1)[-1]) % 2 == 0
+    }
+
+    def whitelists_fnc(doc_chunk_ids: list[str]) -> dict[str, tuple[list[str], list[str]]]:
+        return {chunk_id: existing[chunk_id] for chunk_id in doc_chunk_ids if chunk_id in existing}
+
+    timings = []
+    for _ in range(NUM_RUNS):
+        start = time.perf_counter()
+        get_doc_user_map(chunks, whitelists_fnc, "user")
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    print(f"{name}: {len(chunks)} chunks, best of {NUM_RUNS}: {best * 1000:.1f} ms")
+    return best
+
+
+if __name__ == "__main__":
+    results = [
+        benchmark("many short documents", build_chunks(num_docs=2_000)),
+        benchmark("few long documents", build_chunks(num_docs=10)),
+    ]
+    if max(results) > BUDGET_SECONDS:
+        raise SystemExit(f"ACL bookkeeping exceeded the budget of {BUDGET_SECONDS}s")
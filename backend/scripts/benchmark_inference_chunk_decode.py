@@ -0,0 +1,86 @@
+"""Per-hit cost of decoding search hits into InferenceChunks.
+
+Compares InferenceChunk.from_dict with the previous decoder, which reflected over the class signature
+and decoded the metadata JSON for every hit. Payloads mirror what Qdrant and Typesense return.
+
+Run from the backend directory: python scripts/benchmark_inference_chunk_decode.py
+"""
+import inspect
+import json
+import time
+from typing import Any, cast
+
+from digital_twin.config.constants import (
+    ALLOWED_GROUPS,
+    ALLOWED_USERS,
+    BLURB,
+    CHUNK_ID,
+    CONTENT,
+    DOCUMENT_ID,
+    METADATA,
+    PUBLIC_DOC_PAT,
+    SECTION_CONTINUATION,
+    SEMANTIC_IDENTIFIER,
+    SOURCE_LINKS,
+    SOURCE_TYPE,
+)
+from digital_twin.indexdb.chunking.models import IndexType, InferenceChunk
+
+# 50 hits from Qdrant and 50 from Typesense per query
+NUM_HITS = 100
+NUM_RUNS = 200
+
+
+def previous_from_dict(init_dict: dict[str, Any], score_info: dict[str, Any], index_type: str) -> dict:
+    """The decoder before this benchmark was added, builds the kwargs of the old InferenceChunk"""
+    init_kwargs = {k: v for k, v in init_dict.items() if k in inspect.signature(InferenceChunk).parameters}
+    if SOURCE_LINKS in init_kwargs:
+        source_links = init_kwargs[SOURCE_LINKS]
+        source_links_dict = json.loads(source_links) if isinstance(source_links, str) else source_links
+        init_kwargs[SOURCE_LINKS] = {int(k): v for k, v in cast(dict[str, str], source_links_dict).items()}
+    from digital_twin.utils.logging import setup_logger  # noqa: F401
+
+    if METADATA in init_dict:
+        init_kwargs[METADATA] = json.loads(init_dict[METADATA])
+    else:
+        init_kwargs[METADATA] = {}
+    init_kwargs["score_info"] = score_info
+    init_kwargs["index_type"] = index_type
+    return init_kwargs
+
+
+def build_payloads() -> list[dict[str, Any]]:
+    return [
+        {
+            DOCUMENT_ID: f"https://example.atlassian.net/browse/PROJ-{hit_ind}",
+            CHUNK_ID: hit_ind % 7,
+            BLURB: "Customers on the enterprise plan report that exports time out " * 2,
+            CONTENT: "Customers on the enterprise plan report that exports time out " * 30,
+            SOURCE_TYPE: "jira",
+            SOURCE_LINKS: json.dumps({0: f"https://example.atlassian.net/browse/PROJ-{hit_ind}", 812: "x"}),
+            SEMANTIC_IDENTIFIER: f"PROJ-{hit_ind}: Exports time out",
+            SECTION_CONTINUATION: False,
+            ALLOWED_USERS: [PUBLIC_DOC_PAT],
+            ALLOWED_GROUPS: [],
+            METADATA: json.dumps({"status": "Open", "priority": "High", "labels": ["export", "enterprise"]}),
+        }
+        for hit_ind in range(NUM_HITS)
+    ]
+
+
+def time_per_hit(decode: Any, payloads: list[dict[str, Any]]) -> float:
+    best = float("inf")
+    for _ in range(NUM_RUNS):
+        start = time.perf_counter()
+        for payload in payloads:
+            decode(payload, {"score": 0.5}, IndexType.QDRANT.value)
+        best = min(best, time.perf_counter() - start)
+    return best / len(payloads)
+
+
+if __name__ == "__main__":
+    payloads = build_payloads()
+    before = time_per_hit(previous_from_dict, payloads)
+    after = time_per_hit(InferenceChunk.from_dict, payloads)
+    print(f"previous decoder: {before * 1e6:.2f} us per hit")
+    print(f"InferenceChunk.from_dict: {after * 1e6:.2f} us per hit ({before / after:.1f}x faster)")
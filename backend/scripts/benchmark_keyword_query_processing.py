@@ -0,0 +1,63 @@
+"""Throughput of the keyword search query preprocessing.
+
+Compares keyword_search_query_processing with the previous implementation, which built a new
+WordNetLemmatizer, reloaded the stop words into a set and tokenized the query twice on every call.
+Needs the stopwords, wordnet and punkt NLTK resources, they are downloaded if missing.
+
+Run from the backend directory: python scripts/benchmark_keyword_query_processing.py
+"""
+import time
+from typing import Callable
+
+from nltk.corpus import stopwords  # type:ignore
+from nltk.stem import WordNetLemmatizer  # type:ignore
+from nltk.tokenize import word_tokenize  # type:ignore
+
+from digital_twin.search.keyword_utils import (
+    ensure_nltk_resources,
+    keyword_search_query_processing,
+    warm_up_keyword_processing,
+)
+
+QUERIES = [
+    "How do I deploy the billing service to staging?",
+    "What is the on-call rotation for the data platform team this week",
+    "Why are exports timing out for customers on the enterprise plan?",
+    "where can I find the runbook for rotating the database credentials",
+    "Who owns the Slack integration and how were the documents indexed?",
+]
+NUM_RUNS = 200
+
+
+def previous_query_processing(query: str) -> str:
+    """The preprocessing before this benchmark was added"""
+    stop_words = set(stopwords.words("english"))
+    query = " ".join([word for word in word_tokenize(query) if word.casefold() not in stop_words])
+    lemmatizer = WordNetLemmatizer()
+    return " ".join([lemmatizer.lemmatize(word) for word in word_tokenize(query)])
+
+
+def queries_per_second(process: Callable[[str], str]) -> float:
+    start = time.perf_counter()
+    for _ in range(NUM_RUNS):
+        for query in QUERIES:
+            process(query)
+    return NUM_RUNS * len(QUERIES) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    ensure_nltk_resources()
+    print(f"resource check: {(time.perf_counter() - start) * 1e3:.1f} ms")
+    start = time.perf_counter()
+    warm_up_keyword_processing()
+    print(f"warm up: {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    for query in QUERIES:
+        if previous_query_processing(query) != keyword_search_query_processing(query):
+            print(f"output differs for {query!r}")
+
+    before = queries_per_second(previous_query_processing)
+    after = queries_per_second(keyword_search_query_processing)
+    print(f"previous preprocessing: {before:.0f} queries/s")
+    print(f"keyword_search_query_processing: {after:.0f} queries/s ({after / before:.1f}x faster)")
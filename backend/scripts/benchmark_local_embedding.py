@@ -0,0 +1,39 @@
+"""Throughput benchmark for the local embedding backend on the current machine's CPU.
+
+Embeds synthetic chunk-sized texts of mixed lengths with each runtime and prints texts per second.
+Run from the backend directory: python scripts/benchmark_local_embedding.py [model name]
+"""
+import random
+import sys
+import time
+
+from digital_twin.config.app_config import CHUNK_SIZE, LOCAL_EMBEDDING_MODEL
+from digital_twin.search.local_embedding import LocalEmbeddings
+
+NUM_TEXTS = 512
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while indexing many documents on commodity hardware".split()
+)
+
+
+def build_texts(num_texts: int = NUM_TEXTS) -> list[str]:
+    rand = random.Random(0)
+    texts = []
+    for _ in range(num_texts):
+        # Mix of short Slack messages and full chunks, roughly 6 characters per word
+        num_words = rand.choice([rand.randint(5, 50), rand.randint(50, CHUNK_SIZE // 6)])
+        texts.append(" ".join(rand.choice(WORDS) for _ in range(num_words)))
+    return texts
+
+
+if __name__ == "__main__":
+    model_name = sys.argv[1] if len(sys.argv) > 1 else LOCAL_EMBEDDING_MODEL
+    texts = build_texts()
+    for use_onnx, quantize in [(False, False), (True, False), (True, True)]:
+        embedder = LocalEmbeddings(model_name=model_name, use_onnx=use_onnx, quantize=quantize)
+        # Warm up so lazy initialization isn't measured
+        embedder.embed_documents(texts[:8])
+        start = time.perf_counter()
+        embedder.embed_documents(texts)
+        elapsed = time.perf_counter() - start
+        print(f"{embedder.model}: {NUM_TEXTS / elapsed:.1f} texts/s ({elapsed:.2f}s for {NUM_TEXTS} texts)")
@@ -0,0 +1,86 @@
+"""Time spent building the StuffQA prompt from the retrieved chunks.
+
+Compares StuffQA.get_filled_prompt with the previous implementation, which re-formatted the whole
+prompt and re-tokenized it after appending each context document. Runs with DEFAULT_LLM=GPT3_5_16k
+so that all the chunks fit in the context, the tokenizer is the tiktoken one used by the chat models
+(its encoding is downloaded on first use). No request is sent to the model.
+
+Run from the backend directory: DEFAULT_LLM=GPT3_5_16k python scripts/benchmark_prompt_stuffing.py
+"""
+import time
+from typing import Callable, List, Optional
+
+from langchain.chat_models import ChatOpenAI
+
+from digital_twin.config.app_config import NUM_RERANKED_RESULTS
+from digital_twin.indexdb.chunking.models import IndexType, InferenceChunk
+from digital_twin.llm.chains.qa_chain import StuffQA
+
+QUERY = "How do I rotate the database credentials of the billing service?"
+NUM_RUNS = 20
+CHUNK_CHARS = 2000
+
+
+def build_chunks(num_chunks: int) -> List[InferenceChunk]:
+    return [
+        InferenceChunk(
+            document_id=f"doc_{chunk_ind}",
+            chunk_id=0,
+            blurb="blurb",
+            content=(f"Section {chunk_ind} of the runbook, rotate the credentials from the vault. " * 40)[
+                :CHUNK_CHARS
+            ],
+            source_type="web",
+            source_links={0: f"https://example.com/doc_{chunk_ind}"},
+            section_continuation=False,
+            semantic_identifier=f"doc_{chunk_ind}",
+            raw_metadata={},
+            score_info={},
+            index_type=IndexType.QDRANT,
+        )
+        for chunk_ind in range(num_chunks)
+    ]
+
+
+def previous_get_filled_prompt(qa: StuffQA, query: str, context_docs: Optional[List[InferenceChunk]]) -> str:
+    """The prompt stuffing before this benchmark was added"""
+    documents = []
+    if context_docs:
+        for ranked_doc in context_docs:
+            documents.append(ranked_doc)
+            formatted_prompt = qa.create_prompt(question=query, context=qa.format_documents(documents))
+            if not qa.tokens_within_limit(formatted_prompt):
+                documents.pop()
+                break
+    return qa.create_prompt(question=query, context=qa.format_documents(documents))
+
+
+def ms_per_prompt(fill_prompt: Callable[[], str]) -> float:
+    start = time.perf_counter()
+    for _ in range(NUM_RUNS):
+        fill_prompt()
+    return (time.perf_counter() - start) / NUM_RUNS * 1e3
+
+
+if __name__ == "__main__":
+    qa = StuffQA(ChatOpenAI(model_name="gpt-3.5-turbo", openai_api_key="unused", max_tokens=2000))
+    chunks = build_chunks(NUM_RERANKED_RESULTS)
+    # Loads the tokenizer
+    qa.llm.get_num_tokens(QUERY)
+
+    if previous_get_filled_prompt(qa, QUERY, chunks) != qa.get_filled_prompt(QUERY, chunks):
+        print("prompts differ")
+
+    before = ms_per_prompt(lambda: previous_get_filled_prompt(qa, QUERY, chunks))
+    new_query_ind = 0
+
+    def fill_prompt_new_query() -> str:
+        # The chunk token counts are cached, only the rest of the prompt is tokenized
+        global new_query_ind
+        new_query_ind += 1
+        return qa.get_filled_prompt(f"{QUERY} {new_query_ind}", chunks)
+
+    after = ms_per_prompt(fill_prompt_new_query)
+    print(f"{len(chunks)} chunks of {CHUNK_CHARS} chars")
+    print(f"previous get_filled_prompt: {before:.2f} ms")
+    print(f"get_filled_prompt, new query: {after:.3f} ms ({before / after:.0f}x faster)")
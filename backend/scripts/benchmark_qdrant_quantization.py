@@ -0,0 +1,159 @@
+"""Recall vs latency of QdrantVectorDB.semantic_retrieval over quantized and HNSW-tuned collections.
+
+Builds one collection per setting from the same fixture corpus of clustered random vectors, the way
+chunks of related documents cluster in embedding space. Recall@k is measured against an exact
+(brute force) search over the original vectors. Also reports the RAM taken by the searched vectors.
+
+Quantization is not supported by the in-memory client, this needs a Qdrant server (QDRANT_HOST / QDRANT_URL).
+Run from the backend directory: python scripts/benchmark_qdrant_quantization.py [num_chunks]
+"""
+import json
+import sys
+import time
+import uuid
+
+import numpy as np
+from qdrant_client.http.models import CollectionStatus, SearchParams
+from qdrant_client.models import PointStruct
+
+from digital_twin.config.app_config import DOC_EMBEDDING_DIM
+from digital_twin.config.constants import (
+    ALLOWED_GROUPS,
+    ALLOWED_USERS,
+    BLURB,
+    CHUNK_ID,
+    CONTENT,
+    DOCUMENT_ID,
+    METADATA,
+    PUBLIC_DOC_PAT,
+    SECTION_CONTINUATION,
+    SEMANTIC_IDENTIFIER,
+    SOURCE_LINKS,
+    SOURCE_TYPE,
+)
+from digital_twin.indexdb.qdrant import store
+from digital_twin.indexdb.qdrant.indexing import create_qdrant_collection
+from digital_twin.indexdb.qdrant.store import QdrantVectorDB
+from digital_twin.utils.clients import get_qdrant_client
+
+COLLECTION_PREFIX = "quantization_benchmark"
+NUM_CLUSTERS = 200
+NUM_QUERIES = 50
+NUM_TO_RETRIEVE = 10
+
+# (name, quantization, oversampling, rescore, hnsw m, hnsw ef_construct)
+SETTINGS = [
+    ("float32", "none", 1.0, False, 16, 100),
+    ("float32 m=32", "none", 1.0, False, 32, 200),
+    ("scalar", "scalar", 1.0, False, 16, 100),
+    ("scalar rescore", "scalar", 1.0, True, 16, 100),
+    ("scalar rescore x2", "scalar", 2.0, True, 16, 100),
+    ("scalar rescore x3", "scalar", 3.0, True, 16, 100),
+    ("product rescore x2", "product", 2.0, True, 16, 100),
+    ("product rescore x4", "product", 4.0, True, 16, 100),
+]
+# Bytes per dimension of the vectors searched in RAM
+BYTES_PER_DIM = {"none": 4, "scalar": 1, "product": 4 / 16}
+
+
+def build_corpus(num_chunks: int, rand: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    centers = rand.normal(size=(NUM_CLUSTERS, DOC_EMBEDDING_DIM))
+    chunk_centers = centers[rand.integers(NUM_CLUSTERS, size=num_chunks)]
+    vectors = chunk_centers + rand.normal(scale=0.6, size=(num_chunks, DOC_EMBEDDING_DIM))
+    query_centers = centers[rand.integers(NUM_CLUSTERS, size=NUM_QUERIES)]
+    queries = query_centers + rand.normal(scale=0.6, size=(NUM_QUERIES, DOC_EMBEDDING_DIM))
+    return vectors.astype(np.float32), queries.astype(np.float32)
+
+
+def fill_collection(collection: str, vectors: np.ndarray) -> None:
+    client = get_qdrant_client()
+    points = [
+        PointStruct(
+            id=str(uuid.uuid4()),
+            vector=vector.tolist(),
+            payload={
+                DOCUMENT_ID: f"doc_{chunk_ind}",
+                CHUNK_ID: 0,
+                BLURB: "blurb",
+                CONTENT: "content " * 300,
+                SOURCE_TYPE: "web",
+                SOURCE_LINKS: json.dumps({0: f"https://example.com/doc_{chunk_ind}"}),
+                SEMANTIC_IDENTIFIER: f"doc_{chunk_ind}",
+                SECTION_CONTINUATION: False,
+                ALLOWED_USERS: [PUBLIC_DOC_PAT],
+                ALLOWED_GROUPS: [],
+                METADATA: json.dumps({}),
+            },
+        )
+        for chunk_ind, vector in enumerate(vectors)
+    ]
+    for start in range(0, len(points), 500):
+        client.upsert(collection_name=collection, points=points[start : start + 500])
+    # Measure once the HNSW graph and the quantized vectors are built
+    while client.get_collection(collection).status != CollectionStatus.GREEN:
+        time.sleep(1)
+
+
+def get_exact_results(collection: str, queries: np.ndarray) -> list[set[str]]:
+    client = get_qdrant_client()
+    return [
+        {
+            hit.payload[DOCUMENT_ID]  # type: ignore
+            for hit in client.search(
+                collection_name=collection,
+                query_vector=query.tolist(),
+                search_params=SearchParams(exact=True),
+                limit=NUM_TO_RETRIEVE,
+            )
+        }
+        for query in queries
+    ]
+
+
+def run(collection: str, queries: np.ndarray, exact_results: list[set[str]]) -> tuple[float, list[float]]:
+    vectordb = QdrantVectorDB(collection=collection)
+    recalls = []
+    latencies = []
+    for query, exact_result in zip(queries, exact_results):
+        # The query embedding is not part of what is compared
+        store.embed_query = lambda _, query=query: query.tolist()  # type: ignore
+        start = time.perf_counter()
+        chunks = vectordb.semantic_retrieval(
+            "query", None, None, num_to_retrieve=NUM_TO_RETRIEVE, distance_cutoff=None
+        )
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len({chunk.document_id for chunk in chunks} & exact_result) / NUM_TO_RETRIEVE)
+    return float(np.mean(recalls)), latencies
+
+
+if __name__ == "__main__":
+    num_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    rand = np.random.default_rng(0)
+    vectors, queries = build_corpus(num_chunks, rand)
+    client = get_qdrant_client()
+
+    exact_results: list[set[str]] | None = None
+    print(f"{num_chunks} chunks of {DOC_EMBEDDING_DIM} dims, recall@{NUM_TO_RETRIEVE} vs exact search")
+    for name, quantization, oversampling, rescore, hnsw_m, hnsw_ef_construct in SETTINGS:
+        collection = f"{COLLECTION_PREFIX}_{uuid.uuid4().hex[:8]}"
+        create_qdrant_collection(
+            collection,
+            embedding_dim=DOC_EMBEDDING_DIM,
+            quantization=quantization,
+            hnsw_m=hnsw_m,
+            hnsw_ef_construct=hnsw_ef_construct,
+        )
+        try:
+            fill_collection(collection, vectors)
+            if exact_results is None:
+                exact_results = get_exact_results(collection, queries)
+            store.QDRANT_QUANTIZATION_OVERSAMPLING = oversampling
+            store.QDRANT_QUANTIZATION_RESCORE = rescore
+            recall, latencies = run(collection, queries, exact_results)
+        finally:
+            client.delete_collection(collection)
+        vector_ram_mb = num_chunks * DOC_EMBEDDING_DIM * BYTES_PER_DIM[quantization] / 1e6
+        print(
+            f"{name:>20}: recall {recall:.3f}, median {np.median(latencies) * 1000:.1f} ms, "
+            f"p95 {np.percentile(latencies, 95) * 1000:.1f} ms, vectors in RAM {vector_ram_mb:.0f} MB"
+        )
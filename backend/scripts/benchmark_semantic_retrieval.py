@@ -0,0 +1,115 @@
+"""Compares the paginated and the single over-fetch search of QdrantVectorDB.semantic_retrieval at k=50.
+
+Uses an in-memory Qdrant collection of random vectors where every chunk has mini chunk points,
+so the paginated mode has to go through several pages of duplicates. Reports the number of search
+requests and the latency of each mode, on a real Qdrant deployment each request is a network round-trip.
+
+Run from the backend directory: python scripts/benchmark_semantic_retrieval.py
+"""
+import json
+import time
+import uuid
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from digital_twin.config.constants import (
+    ALLOWED_GROUPS,
+    ALLOWED_USERS,
+    BLURB,
+    CHUNK_ID,
+    CONTENT,
+    DOCUMENT_ID,
+    METADATA,
+    PUBLIC_DOC_PAT,
+    SECTION_CONTINUATION,
+    SEMANTIC_IDENTIFIER,
+    SOURCE_LINKS,
+    SOURCE_TYPE,
+)
+from digital_twin.indexdb.qdrant import store
+from digital_twin.indexdb.qdrant.store import QdrantVectorDB
+
+COLLECTION = "semantic_retrieval_benchmark"
+EMBEDDING_DIM = 256
+NUM_CHUNKS = 5_000
+POINTS_PER_CHUNK = 5
+NUM_TO_RETRIEVE = 50
+NUM_QUERIES = 20
+
+
+def build_collection(client: QdrantClient, rand: np.random.Generator) -> None:
+    client.recreate_collection(
+        collection_name=COLLECTION,
+        vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE),
+    )
+    points = []
+    for chunk_ind in range(NUM_CHUNKS):
+        document_id = f"doc_{chunk_ind // 10}"
+        chunk_vector = rand.normal(size=EMBEDDING_DIM)
+        payload = {
+            DOCUMENT_ID: document_id,
+            CHUNK_ID: chunk_ind % 10,
+            BLURB: "blurb",
+            CONTENT: "content " * 300,
+            SOURCE_TYPE: "web",
+            SOURCE_LINKS: json.dumps({0: f"https://example.com/{document_id}"}),
+            SEMANTIC_IDENTIFIER: document_id,
+            SECTION_CONTINUATION: False,
+            ALLOWED_USERS: [PUBLIC_DOC_PAT],
+            ALLOWED_GROUPS: [],
+            METADATA: json.dumps({}),
+        }
+        # Mini chunk vectors are close to their chunk's vector, so they rank next to each other
+        for point_ind in range(POINTS_PER_CHUNK):
+            points.append(
+                PointStruct(
+                    id=str(uuid.uuid4()),
+                    vector=(chunk_vector + rand.normal(scale=0.1, size=EMBEDDING_DIM) * point_ind).tolist(),
+                    payload=payload,
+                )
+            )
+    for start in range(0, len(points), 1000):
+        client.upsert(collection_name=COLLECTION, points=points[start : start + 1000])
+
+
+def run(vectordb: QdrantVectorDB, queries: list[list[float]], use_pagination: bool) -> None:
+    num_requests = 0
+    search = vectordb.client.search
+
+    def counted_search(*args, **kwargs):  # type: ignore
+        nonlocal num_requests
+        num_requests += 1
+        return search(*args, **kwargs)
+
+    vectordb.client.search = counted_search  # type: ignore
+    latencies = []
+    for query in queries:
+        # The query embedding is not part of what is compared
+        store.embed_query = lambda _, query=query: query  # type: ignore
+        start = time.perf_counter()
+        chunks = vectordb.semantic_retrieval(
+            "query", None, None, num_to_retrieve=NUM_TO_RETRIEVE, use_pagination=use_pagination
+        )
+        latencies.append(time.perf_counter() - start)
+        assert len(chunks) == NUM_TO_RETRIEVE
+    vectordb.client.search = search  # type: ignore
+
+    mode = "paginated" if use_pagination else "single over-fetch"
+    print(
+        f"{mode}: {num_requests / len(queries):.1f} searches per query, "
+        f"median {np.median(latencies) * 1000:.1f} ms, p95 {np.percentile(latencies, 95) * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    rand = np.random.default_rng(0)
+    vectordb = QdrantVectorDB(collection=COLLECTION)
+    vectordb.client = QdrantClient(":memory:")
+    build_collection(vectordb.client, rand)
+    store.POINTS_PER_CHUNK = POINTS_PER_CHUNK
+
+    queries = [rand.normal(size=EMBEDDING_DIM).tolist() for _ in range(NUM_QUERIES)]
+    run(vectordb, queries, use_pagination=True)
+    run(vectordb, queries, use_pagination=False)
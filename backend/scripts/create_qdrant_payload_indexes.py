@@ -0,0 +1,18 @@
+"""Creates the payload indexes of every existing Qdrant collection.
+
+New collections get them when they are created, this is for the collections created before.
+Creating an index that already exists is a no-op, so the script can be re-run.
+
+Run from the backend directory: python scripts/create_qdrant_payload_indexes.py
+"""
+from digital_twin.indexdb.qdrant.indexing import (
+    QDRANT_INDEXED_PAYLOAD_FIELDS,
+    create_qdrant_payload_indexes,
+    list_qdrant_collections,
+)
+
+if __name__ == "__main__":
+    collections = list_qdrant_collections().collections
+    for collection in collections:
+        create_qdrant_payload_indexes(collection.name)
+        print(f"Indexed {', '.join(QDRANT_INDEXED_PAYLOAD_FIELDS)} of collection {collection.name}")
@@ -0,0 +1,30 @@
+"""Forces documents to be re-indexed on the next connector run.
+
+The indexing pipeline skips documents whose content is unchanged since they were last indexed into a
+collection, going by the fingerprints stored in Postgres. When the chunks in the index no longer match
+those fingerprints (the collection was dropped or restored by hand, chunking or embedding changed, ...)
+the fingerprints have to be forgotten so the documents are indexed again.
+
+Run from the backend directory:
+    python scripts/reset_document_fingerprints.py <qdrant collection> [--document-id ID ...]
+Without --document-id all the fingerprints of the collection are deleted.
+"""
+import argparse
+
+from digital_twin.db.connectors.document_fingerprint import delete_document_fingerprints
+from digital_twin.db.engine import get_session
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Force documents of a collection to be re-indexed.")
+    parser.add_argument("collection", help="Qdrant collection the documents are indexed into")
+    parser.add_argument(
+        "--document-id",
+        action="append",
+        dest="document_ids",
+        help="Only re-index this document, can be repeated",
+    )
+    args = parser.parse_args()
+
+    with get_session() as db_session:
+        delete_document_fingerprints(args.collection, db_session, args.document_ids)
+    print(f"Deleted the fingerprints of collection {args.collection}")